@@ -0,0 +1,67 @@
+# Copyright (C) 2020 Mattia Samory
+
+"""Compares the json parsers available to pytangle on large response pages. Pass the paths of recorded responses
+(e.g. saved from `curl "https://api.crowdtangle.com/posts?token=...&count=100&includeHistory=true"`) to benchmark on
+real data; otherwise, a page of 100 posts with 500 history timesteps each is synthesized."""
+
+import json
+import random
+import sys
+import timeit
+
+from pytangle.decoding import DECODERS, available_decoders
+
+
+def make_page(n_posts=100, n_timesteps=500):
+    """
+    Returns:
+    bytes of a synthetic /posts response, shaped as one with includeHistory=true
+    """
+    statistics = ["likeCount", "shareCount", "commentCount", "loveCount", "wowCount", "hahaCount", "sadCount",
+                  "angryCount", "thankfulCount", "careCount"]
+    posts = list()
+    for n in range(n_posts):
+        history = [dict(timestep=timestep,
+                        date="2020-06-{:02d} {:02d}:{:02d}:00".format(1 + timestep // 96, timestep // 4 % 24,
+                                                                     timestep % 4 * 15),
+                        score=random.random() * 10,
+                        actual={statistic: random.randint(0, 10000) for statistic in statistics},
+                        expected={statistic: random.randint(0, 10000) for statistic in statistics})
+                   for timestep in range(n_timesteps)]
+        posts.append(dict(id="{}_{}".format(random.randint(10 ** 14, 10 ** 15), n),
+                          platform="Facebook",
+                          date="2020-06-01 00:00:00",
+                          type="link",
+                          message="post number {} ".format(n) * 10,
+                          history=history,
+                          account=dict(id=random.randint(0, 10 ** 7), name="an account", handle="an_account",
+                                       subscriberCount=random.randint(0, 10 ** 7), verified=True)))
+    response = dict(status=200, result=dict(posts=posts, pagination=dict(
+        nextPage="https://api.crowdtangle.com/posts?count=100&offset=100")))
+    return json.dumps(response).encode('utf-8')
+
+
+def benchmark(pages, repeat=5):
+    results = dict()
+    for name in available_decoders():
+        decoder = DECODERS[name]
+        seconds = min(timeit.repeat(lambda: [decoder(page) for page in pages], number=1, repeat=repeat))
+        results[name] = seconds
+    return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        pages = list()
+        for path in sys.argv[1:]:
+            with open(path, 'rb') as f:
+                pages.append(f.read())
+    else:
+        pages = [make_page()]
+    megabytes = sum(map(len, pages)) / 1024 ** 2
+    print("{} page(s), {:.1f}MB".format(len(pages), megabytes))
+    results = benchmark(pages)
+    baseline = results['json']
+    for name, seconds in sorted(results.items(), key=lambda x: x[1]):
+        print("{:>8}: {:7.1f}ms {:6.1f}MB/s {:5.1f}x".format(name, seconds * 1000, megabytes / seconds,
+                                                             baseline / seconds))
@@ -1,18 +1,25 @@
 # Copyright (C) 2020 Mattia Samory
 
-import json
 import logging
 import time
 from datetime import datetime
 import schedule
 import optparse
 from pytangle.api import API, CONFIG_FILE_LOCATIONS
+from pytangle.monitoring import Monitor, MonitorState, Stream, AdaptiveCadence, DEFAULT_EVERY, DEFAULT_OVERLAP, \
+    DEFAULT_WORKERS
 
 logger = logging.getLogger()
 
 
+# seconds per time unit, for time units that can be polled at a fixed interval
+TIMEUNIT_SECONDS = dict(second=1, seconds=1, minute=60, minutes=60, hour=60 * 60, hours=60 * 60,
+                        day=24 * 60 * 60, days=24 * 60 * 60, week=7 * 24 * 60 * 60, weeks=7 * 24 * 60 * 60)
+
+
 class PyTangleScraper(object):
-    def __init__(self, api_key, config, lists, store_path, quiet, every, timeunit, at):
+    def __init__(self, api_key, config, lists, store_path, quiet, every, timeunit, at, state_path=None,
+                 overlap=DEFAULT_OVERLAP, workers=DEFAULT_WORKERS, target_latency=None):
         self.config = config
         self.api_key = api_key
         self.at = at
@@ -21,34 +28,59 @@ class PyTangleScraper(object):
         self.lists = lists
         self.quiet = quiet
         self.store_path = store_path
+        self.target_latency = target_latency
 
-        self.timestamp_last_post = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')  # current time
         self.api = API(token=self.api_key, config_file_locations=self.config)
+        # watermarks and archived posts survive restarts: each stream resumes from the last post it archived
+        self.state = MonitorState(state_path or store_path + '.state.sqlite', overlap=overlap)
+        # each list, or group of lists joined by +, is an independent stream, with its own watermark. Streams polled
+        # on weekdays or at set times are all polled by scrape_once, whatever their cadence
+        self.streams = [Stream(list_ids=None if group is None else group.split('+'),
+                               every=self.get_interval() or DEFAULT_EVERY, cadence=self.get_cadence())
+                        for group in (self.lists or [None])]
+        self.monitor = Monitor(self.api, self.streams, self.state, self.store_path, workers=workers)
         self.counter = 0
         if not self.quiet:
             logger.setLevel(logging.DEBUG)
 
+    def get_interval(self):
+        """
+        Returns:
+        seconds between polls, or None if polls are scheduled on weekdays or at set times
+        """
+        if self.at or self.timeunit not in TIMEUNIT_SECONDS:
+            return None
+        return self.every * TIMEUNIT_SECONDS[self.timeunit]
+
+    def get_cadence(self):
+        """
+        Returns:
+        AdaptiveCadence meeting the target latency, polling at most every EVERY TIMEUNIT, or None if no target
+        latency is set
+        """
+        if self.target_latency is None:
+            return None
+        interval = self.get_interval()
+        if interval is None:
+            return AdaptiveCadence(target_latency=self.target_latency)
+        return AdaptiveCadence(target_latency=self.target_latency, min_every=interval)
+
     def scrape_once(self):
-        most_recent_timestamp = self.timestamp_last_post
-        counter = 0
-        with open(self.store_path, 'a+') as out_file:
-
-            for post in self.api.posts(listIds=self.lists,
-                                       sortBy='date', count=-1, startDate=self.timestamp_last_post,
-                                       endDate=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')):
-                out_file.write(json.dumps(post) + '\n')
-                post_date = post['date']
-                if type(post_date) == list: #unpack items if they are nested in a list
-                    post_date = post_date[0]
-                most_recent_timestamp = max(most_recent_timestamp, post_date)
-                counter += 1
-        self.timestamp_last_post = most_recent_timestamp
+        archived_before = sum(stream.stats['archived'] for stream in self.streams)
+        self.monitor.run_once()
+        counter = sum(stream.stats['archived'] for stream in self.streams) - archived_before
         self.counter += counter
         if not self.quiet:
             logger.debug("returned {} posts ({} up to now)".format(counter, self.counter))
+            for name, stream_stats in self.monitor.stats().items():
+                logger.debug("stream {}: {}".format(name, stream_stats))
             logger.debug("done at " + datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
 
     def run(self):
+        if self.get_interval() is not None or self.target_latency is not None:
+            # streams are polled concurrently, each on its own cadence
+            self.monitor.run()
+            return
         job = schedule.every(self.every).__getattribute__(self.timeunit)
         if self.at:
             job = job.at(self.at)
@@ -73,7 +105,8 @@ def main():
 
     parser.add_option("-l", "--lists", dest="lists", default=None, action='callback',
                       callback=split_list, nargs=1, type='string',
-                      help="comma-separated ids of the list to scrape, e.g. -l 123,345")
+                      help="comma-separated ids of the list to scrape, e.g. -l 123,345. Each list is monitored "
+                           "independently; join lists with + to monitor them together, e.g. -l 123+345,678")
 
     parser.add_option("-q", "--quiet",
                       action="store_true", dest="quiet", default=False,
@@ -115,6 +148,18 @@ def main():
                       help="API key", metavar="CTAPIKEY")
     parser.add_option("-c", "--config", dest="config_path", default=CONFIG_FILE_LOCATIONS,
                       help="pytangle config file location")
+    parser.add_option("-s", "--state", dest="state_path", default=None,
+                      help="file where watermarks and archived post ids are kept across restarts "
+                           "(default: FILE.state.sqlite)", metavar="STATE")
+    parser.add_option("-o", "--overlap", dest="overlap", default=DEFAULT_OVERLAP / 60, type='float',
+                      help="(float) minutes before the last archived post from which a restarted monitor "
+                           "queries again, to catch posts indexed late")
+    parser.add_option("-L", "--latency", dest="target_latency", default=None, type='float',
+                      help="(float) minutes from the publication of a post to its archiving to aim for. If set, "
+                           "each list is polled as often as its post arrival rate requires (but at most every "
+                           "EVERY TIMEUNIT) and the rate budget allows")
+    parser.add_option("-w", "--workers", dest="workers", default=DEFAULT_WORKERS, type='int',
+                      help="(int) number of lists polled concurrently")
 
     (options, args) = parser.parse_args()
 
@@ -125,7 +170,11 @@ def main():
                     quiet=options.quiet,
                     every=options.every,
                     timeunit=options.time_unit,
-                    at=options.at).run()
+                    at=options.at,
+                    state_path=options.state_path,
+                    overlap=options.overlap * 60,
+                    workers=options.workers,
+                    target_latency=None if options.target_latency is None else options.target_latency * 60).run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,548 @@
+# Copyright (C) 2020 Mattia Samory
+
+import asyncio
+import time
+from collections import deque
+from functools import partial
+
+import requests
+
+import logging
+
+from pytangle.api import API, get_looked_up_post
+from pytangle.connectivity import Paginator, ShardedPaginator, get_next_page_params, get_response_items, parse_error_details, \
+    read_checkpoint, read_returned_count, \
+    ONE_SECOND, DEFAULT_POOL_CONNECTIONS, DEFAULT_POOL_MAXSIZE, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from pytangle.decoding import decode, no_decoding
+from pytangle.errors import create_error, ClientError, CrowdTangleError, NotFoundError, TokenError, RateLimitError
+from pytangle.frames import get_column_types, make_getters, chunk_to_arrays, concatenate_chunks, arrays_to_frame, \
+    require_numpy, require_pandas, DEFAULT_CHUNK_SIZE
+from pytangle.retry import DEFAULT_RETRY_POLICY
+from pytangle.tokens import get_token_pool
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger()
+
+
+def encode_params(params):
+    """aiohttp only accepts scalar query parameters: expand lists (e.g. from parsed pagination links) into repeated
+    parameters"""
+    encoded = list()
+    for key, value in params.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        for a_value in values:
+            encoded.append((key, str(a_value)))
+    return encoded
+
+
+class AsyncSession:
+    """Asynchronous counterpart of connectivity.Session, backed by an aiohttp connection pool. The pool is created
+    lazily, so that it is bound to the event loop in which the first call is made."""
+
+    def __init__(self,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT):
+        if aiohttp is None:
+            raise ImportError("AsyncAPI requires aiohttp. Install it via `pip3 install pytangle[async]`")
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.request_count = 0
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_connections * self.pool_maxsize,
+                                             limit_per_host=self.pool_maxsize)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def get(self, uri, params):
+        """
+        Returns:
+        tuple (HTTP status, headers, body as bytes)
+        """
+        self.request_count += 1
+        async with self._get_session().get(uri, params=encode_params(params)) as response:
+            content = await response.read()
+            return response.status, response.headers, content
+
+    def connection_stats(self):
+        return dict(requests=self.request_count)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+async def run_blocking(fun, *args, **kwargs):
+    """Runs a blocking call (e.g. to a rate limit backend that locks a file, or to the response cache) in the default
+    executor, so that it does not stall the other coroutines of the event loop"""
+    return await asyncio.get_event_loop().run_in_executor(None, partial(fun, *args, **kwargs))
+
+
+async def make_request_async(uri, params, session=None, retry_policy=None, fail_on_token_error=False, decoder=None):
+    """Asynchronous counterpart of connectivity.make_request. Raises the same errors; connection errors and timeouts
+    are raised as requests.exceptions.ConnectionError."""
+    if retry_policy is None:
+        retry_policy = DEFAULT_RETRY_POLICY
+    if decoder is None:
+        decoder = decode
+    start_time = time.monotonic()
+    attempt = 0
+    while True:
+        try:
+            try:
+                status, headers, content = await session.get(uri, params)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                raise requests.exceptions.ConnectionError(str(e) or type(e).__name__)
+            logger.debug("{} {}".format(status, uri))
+            if status >= 400:
+                error_details = parse_error_details(status, content)
+                raise create_error(status, error_details, headers=headers)
+            return decoder(content)
+        except TokenError as e:
+            logger.error(e)
+            if fail_on_token_error:
+                raise
+            error = e
+        except CrowdTangleError as e:
+            logger.error(e)
+            error = e
+        except requests.exceptions.ConnectionError as e:
+            logger.error("Error Connecting:{}".format(e))
+            error = e
+        attempt += 1
+        wait_time = retry_policy.get_wait_time(error, attempt, time.monotonic() - start_time)
+        if wait_time is None:
+            raise error
+        logger.debug("retrying in {:.1f} seconds".format(wait_time))
+        await asyncio.sleep(wait_time)
+
+
+async def request_endpoint(endpoint, params, raw=False):
+    """Asynchronous counterpart of Endpoint.request: same response cache and scheduling across tokens as
+    TokenPool.request, waiting on the event loop instead of blocking"""
+    decoder = endpoint.get_decoder(raw)
+    if endpoint.response_cache is None:
+        return await request_endpoint_uncached(endpoint, params, decoder)
+    content = await run_blocking(endpoint.response_cache.get, type(endpoint).__name__, endpoint.get_endpoint_url(),
+                                 params)
+    if content is None:
+        content = await request_endpoint_uncached(endpoint, params, no_decoding)
+        await run_blocking(endpoint.response_cache.set, type(endpoint).__name__, endpoint.get_endpoint_url(), params,
+                           content)
+    return decoder(content)
+
+
+async def request_endpoint_uncached(endpoint, params, decoder):
+    rate_limit = endpoint.get_rate_limit()
+    token_pool = endpoint.token_pool
+    if token_pool is None:
+        token_pool = get_token_pool(params.get('token'))
+    retry_policy = token_pool.retry_policy
+
+    start_time = time.monotonic()
+    rate_limit_errors = 0
+    while True:
+        rejection = token_pool.get_rejection()
+        if rejection is not None:
+            raise rejection
+        wait_times = list()
+        for token in token_pool.available_tokens():
+            if rate_limit is not None:
+                wait_time = await run_blocking(token_pool.backend.try_acquire, token, rate_limit)
+                if wait_time > 0:
+                    wait_times.append(wait_time)
+                    continue
+            token_pool.mark_used(token)
+            try:
+                response = await make_request_async(endpoint.get_endpoint_url(), dict(params, token=token),
+                                                    session=endpoint.session, retry_policy=retry_policy,
+                                                    fail_on_token_error=True, decoder=decoder)
+            except RateLimitError as e:
+                rate_limit_errors += 1
+                wait_time = retry_policy.get_wait_time(e, rate_limit_errors, time.monotonic() - start_time)
+                if wait_time is None:
+                    raise
+                if rate_limit is not None:
+                    await run_blocking(token_pool.backend.record_rate_limited, token, rate_limit, e.retry_after)
+                else:
+                    token_pool.bench(token, wait_time)
+                continue
+            except TokenError as e:
+                token_pool.reject(token, e)
+                continue
+            if rate_limit is not None:
+                await run_blocking(token_pool.backend.record_success, token, rate_limit)
+            return response
+        if token_pool.get_rejection() is not None:
+            continue
+        benched_wait_time = token_pool.time_until_available()
+        if benched_wait_time is not None:
+            wait_times.append(benched_wait_time)
+        await asyncio.sleep(max(min(wait_times, default=ONE_SECOND), ONE_SECOND / 10))
+
+
+async def to_arrays_async(items, column_types, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Asynchronous counterpart of frames.to_arrays, consuming the items with `async for`"""
+    require_numpy()
+    getters = make_getters(column_types)
+    chunks = list()
+    chunk = list()
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            chunks.append(chunk_to_arrays(chunk, column_types, getters))
+            chunk = list()
+    if len(chunk):
+        chunks.append(chunk_to_arrays(chunk, column_types, getters))
+    return concatenate_chunks(chunks, column_types)
+
+
+async def to_frame_async(items, column_types, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Asynchronous counterpart of frames.to_frame, consuming the items with `async for`"""
+    require_pandas()
+    return arrays_to_frame(await to_arrays_async(items, column_types, chunk_size=chunk_size), column_types)
+
+
+class AsyncPagePrefetcher:
+    """Asynchronous counterpart of connectivity.PagePrefetcher: fetches pages in a background task."""
+    _DONE = object()
+
+    def __init__(self, endpoint, params, max_pages, max_items=-1, raw=False):
+        self.endpoint = endpoint
+        self.params = params
+        self.raw = raw
+        self.max_items = max_items
+        self.pages = asyncio.Queue(maxsize=max_pages)
+        self._finished = False
+        self._task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        params = self.params
+        fetched_items = 0
+        response_field = self.endpoint.get_response_field_name()
+        try:
+            while True:
+                response = await request_endpoint(self.endpoint, params, raw=self.raw)
+                next_page_params = get_next_page_params(response, response_field, self.endpoint.max_query_offset())
+                await self.pages.put((response, next_page_params, None))
+                fetched_items += len(get_response_items(response, response_field))
+                if next_page_params is None or -1 < self.max_items <= fetched_items:
+                    break
+                params = next_page_params
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.pages.put((None, None, e))
+        await self.pages.put(self._DONE)
+
+    async def get(self):
+        if self._finished:
+            return None
+        item = await self.pages.get()
+        if item is self._DONE:
+            self._finished = True
+            return None
+        response, next_page_params, exception = item
+        if exception is not None:
+            raise exception
+        return response, next_page_params
+
+    def stop(self):
+        self._task.cancel()
+
+
+class AsyncPaginator(Paginator):
+    """Asynchronous counterpart of Paginator: iterate it with `async for`. Pagination, deduplication, and the
+    roll-back of endDate when sorting by date behave as in Paginator. Checkpoint files are read and written in the
+    default executor, so that they do not stall the event loop."""
+
+    def __init__(self, endpoint, checkpoint=None, resume_from=None, **paginator_options):
+        # a checkpoint file to resume from is read on the first iteration (see _resume)
+        self._resume_path = None
+        if isinstance(resume_from, str):
+            self._resume_path = resume_from
+            if checkpoint is None:
+                checkpoint = resume_from
+            resume_from = None
+        super().__init__(endpoint, checkpoint=checkpoint, resume_from=resume_from, **paginator_options)
+        if self._resume_path is not None:
+            # nothing to record until the checkpoint is read
+            self._recorded_returned_count = self.returned_count
+
+    async def _resume(self):
+        path, self._resume_path = self._resume_path, None
+        state = await run_blocking(read_checkpoint, path)
+        if state is not None:
+            self.set_state(state)
+            self._skip_returned(await run_blocking(read_returned_count, path))
+
+    async def _fetch_page(self):
+        if self.prefetch > 0:
+            if self.prefetcher is None:
+                max_items = -1
+                if self.total_count > -1:
+                    max_items = self.total_count - self.returned_count
+                self.prefetcher = AsyncPagePrefetcher(self.endpoint,
+                                                      self.next_page_params,
+                                                      max_pages=self.prefetch,
+                                                      max_items=max_items,
+                                                      raw=self.raw)
+            page = await self.prefetcher.get()
+            if page is not None:
+                return page
+
+        logger.debug("call params " + str(self.next_page_params))
+        response = await request_endpoint(self.endpoint, self.next_page_params, raw=self.raw)
+        return response, get_next_page_params(response, self.response_field, self.max_offset_threshold)
+
+    async def _fetch_next_response(self):
+        response, next_page_params = await self._fetch_page()
+        self._ingest_response(response, next_page_params)
+
+    def __next__(self):
+        raise TypeError("AsyncPaginator must be iterated with `async for`")
+
+    def __iter__(self):
+        raise TypeError("AsyncPaginator must be iterated with `async for`")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._resume_path is not None:
+            await self._resume()
+        if self._is_spent():
+            await self.aclose()
+            raise StopAsyncIteration
+        if not len(self.current_results):
+            await self._fetch_next_response()
+            await run_blocking(self.save_checkpoint)
+        if self._is_spent():
+            # may have fetched no results
+            await self.aclose()
+            raise StopAsyncIteration
+        return self._pop_result()
+
+    async def to_arrays(self, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Asynchronous counterpart of Paginator.to_arrays: consumes the items left with `async for`, e.g.
+        `columns = await crawl.to_arrays()`
+
+        Returns:
+        dict mapping each column to a numpy array, with a row per item
+        """
+        return await to_arrays_async(self, get_column_types(self.endpoint, columns), chunk_size=chunk_size)
+
+    async def to_frame(self, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Returns:
+        pandas.DataFrame with a row per item left, and the columns built by to_arrays, e.g.
+        `frame = await crawl.to_frame()`
+        """
+        return await to_frame_async(self, get_column_types(self.endpoint, columns), chunk_size=chunk_size)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """Asynchronous counterpart of close: stops fetching pages in the background, if prefetching, and saves the
+        checkpoint, if any, off the event loop"""
+        self._stop_prefetcher()
+        await run_blocking(self.save_checkpoint)
+
+
+class AsyncShardedPaginator(ShardedPaginator):
+    """Asynchronous counterpart of ShardedPaginator: iterate it with `async for`. Each time window is crawled by its
+    own AsyncPaginator, in a task of the event loop rather than in a thread; results are merged as in
+    ShardedPaginator."""
+
+    def __init__(self, endpoint, shards, **paginator_options):
+        super().__init__(endpoint, shards, **paginator_options)
+        self.shard_tasks = list()
+
+    def _new_shard_paginator(self, endpoint, **paginator_options):
+        return AsyncPaginator(endpoint, **paginator_options)
+
+    def _start_shard(self, paginator):
+        shard_queue = asyncio.Queue(maxsize=self.buffer_size)
+        self.shard_queues.append(shard_queue)
+        self.shard_tasks.append(asyncio.ensure_future(self._crawl_shard_async(paginator, shard_queue)))
+
+    def _is_crawling(self, shard):
+        return not self.shard_tasks[shard].done()
+
+    @classmethod
+    async def _crawl_shard_async(cls, paginator, shard_queue):
+        try:
+            async for result in paginator:
+                await shard_queue.put((result, None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await shard_queue.put((None, e))
+        finally:
+            paginator.close()
+        await shard_queue.put(cls._DONE)
+
+    def __next__(self):
+        raise TypeError("AsyncShardedPaginator must be iterated with `async for`")
+
+    def __iter__(self):
+        raise TypeError("AsyncShardedPaginator must be iterated with `async for`")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._started:
+            self._start()
+        while self.current_shard < len(self.shard_paginators):
+            if -1 < self.total_count <= self.returned_count:
+                break
+            self._start_shards()
+            if self.current_shard >= len(self.shard_queues):
+                break
+            result = self._get_shard_item(await self.shard_queues[self.current_shard].get())
+            if result is not None:
+                return result
+        self.close()
+        raise StopAsyncIteration
+
+    async def to_arrays(self, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Returns:
+        dict mapping each column to a numpy array, with a row per merged item left (see AsyncPaginator.to_arrays)
+        """
+        return await to_arrays_async(self, get_column_types(self.endpoint, columns), chunk_size=chunk_size)
+
+    async def to_frame(self, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Returns:
+        pandas.DataFrame with a row per merged item left, and the columns built by to_arrays
+        """
+        return await to_frame_async(self, get_column_types(self.endpoint, columns), chunk_size=chunk_size)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Stops crawling all time windows."""
+        for task in getattr(self, 'shard_tasks', ()):
+            try:
+                task.cancel()
+            except RuntimeError:
+                # the event loop is closed already
+                pass
+
+
+class AsyncAPI(API):
+    """Asynchronous wrapper for calling crowdtangle endpoints. Methods and parameters are the same as in API, but
+    return asynchronous iterators (AsyncPaginator) that can be consumed with `async for`. Rate limits are shared by
+    all the coroutines running in the process, so that many queries can run concurrently on one event loop.
+
+    Example use:
+    from pytangle.aio import AsyncAPI
+
+    async def main():
+        async with AsyncAPI() as api:
+            async for a_post in api.posts(count=5):
+                print(a_post)
+    """
+
+    def _new_session(self, **session_config):
+        return AsyncSession(**session_config)
+
+    def _paginate(self, endpoint, shards=1, **paginator_options):
+        paginator_options.setdefault('dedup_options', self.get_dedup_options(type(endpoint)))
+        if shards > 1:
+            return AsyncShardedPaginator(endpoint=endpoint, shards=shards, **paginator_options)
+        return AsyncPaginator(endpoint=endpoint, **paginator_options)
+
+    async def _lookup_post(self, id, account, includeHistory, endpoint):
+        post_endpoint = self._get_post_endpoint(id, account, includeHistory, endpoint)
+        try:
+            response = await request_endpoint(post_endpoint, post_endpoint.args)
+        except NotFoundError:
+            return None
+        except ClientError as e:
+            if e.http_status == 404:
+                return None
+            raise
+        return get_looked_up_post(response, post_endpoint)
+
+    async def posts_by_ids(self, ids, endpoint='ct', account=None, includeHistory=None,
+                           concurrency=DEFAULT_POOL_MAXSIZE, keep_order=False, resolved=None, not_found=None):
+        """Asynchronous counterpart of API.posts_by_ids, with the same parameters: lookups run as tasks on the event
+        loop, at most concurrency at a time, instead of in a pool of threads. Returns an asynchronous iterator of posts
+        (dict); closing it cancels the lookups in flight."""
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if resolved is None:
+            resolved = set()
+        ids = iter(ids)
+        pending = deque()
+        # ids in flight: marked as resolved only once their lookup completes (see API.posts_by_ids)
+        submitted = set()
+
+        def submit_next():
+            for an_id in ids:
+                if an_id in resolved or an_id in submitted:
+                    continue
+                submitted.add(an_id)
+                pending.append((an_id, asyncio.ensure_future(self._lookup_post(an_id, account, includeHistory,
+                                                                               endpoint))))
+                return True
+            return False
+
+        try:
+            while len(pending) < concurrency and submit_next():
+                pass
+            while len(pending):
+                if keep_order:
+                    an_id, task = pending.popleft()
+                    await asyncio.wait([task])
+                else:
+                    done, _ = await asyncio.wait([task for _, task in pending], return_when=asyncio.FIRST_COMPLETED)
+                    an_id, task = next((an_id, task) for an_id, task in pending if task in done)
+                    pending.remove((an_id, task))
+                a_post = task.result()
+                submitted.discard(an_id)
+                resolved.add(an_id)
+                if a_post is None:
+                    logger.warning("post {} not found".format(an_id))
+                    if not_found is not None:
+                        not_found.append(an_id)
+                submit_next()
+                if a_post is not None:
+                    yield a_post
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __enter__(self):
+        raise TypeError("use `async with` with AsyncAPI")
+
+    async def close(self):
+        """Closes the keep-alive connections held by this API instance."""
+        await self._session.close()
@@ -3,11 +3,19 @@
 import json
 import os
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from pytangle.connectivity import Paginator
+from pytangle.cache import ResponseCache, create_response_cache
+from pytangle.connectivity import Paginator, Session, ShardedPaginator, get_response_items, DEFAULT_POOL_MAXSIZE
+from pytangle.decoding import get_decoder
+from pytangle.errors import ClientError, NotFoundError
 from pytangle.endpoints import PostsEndpoint, PostEndpoint, SearchEndpoint, LeaderboardEndpoint, ListsEndpoint, \
     LinksEndpoint, \
-    AccountsEndpoint
+    AccountsEndpoint, Endpoint6CPM, Endpoint2CPM, EndpointOneShotCall
+from pytangle.ratelimiting import RateLimitBackend, create_backend
+from pytangle.retry import RetryPolicy, create_retry_policy
+from pytangle.tokens import TokenPool, ROUND_ROBIN
 from pytangle.utils import remove_null_values_from_dict
 import logging
 import logging.config
@@ -18,6 +26,16 @@ CONFIG_FILE_LOCATIONS = [os.path.join(os.path.dirname(sys.modules[__name__].__fi
 
 logger = logging.getLogger()
 
+RATE_LIMITED_ENDPOINT_CLASSES = (Endpoint6CPM, Endpoint2CPM, EndpointOneShotCall)
+DEDUPLICATED_ENDPOINT_CLASSES = (PostsEndpoint, SearchEndpoint, LeaderboardEndpoint, ListsEndpoint, LinksEndpoint,
+                                 AccountsEndpoint)
+DEDUP_OPTION_NAMES = ('max_cached_ids', 'mode', 'error_rate')
+
+
+def get_looked_up_post(response, post_endpoint):
+    posts = get_response_items(response, post_endpoint.get_response_field_name())
+    return posts[0] if len(posts) else None
+
 
 def read_config(config_file_locations):
     config_ = dict()
@@ -42,29 +60,253 @@ def read_token(config_):
         return None
 
 
+def read_tokens(config_):
+    if 'tokens' in config_:
+        return config_['tokens']
+    else:
+        return None
+
+
+def read_rate_limits_config(config_):
+    if 'rate_limits' in config_:
+        return config_['rate_limits']
+    else:
+        return dict()
+
+
+def setup_rate_limits(config_, token_pool):
+    """Overrides, for the calls made through the token pool, the rate limits of the endpoint classes named in the
+    "rate_limits" section of the configuration, e.g. {"Endpoint6CPM": {"burst": 3}}"""
+    endpoint_classes = {cls.__name__: cls for cls in RATE_LIMITED_ENDPOINT_CLASSES}
+    for class_name, rate_limit in read_rate_limits_config(config_).items():
+        if class_name not in endpoint_classes:
+            raise ValueError("unknown endpoint class in rate_limits: {}. Available: {}".format(
+                class_name, ", ".join(endpoint_classes)))
+        token_pool.set_rate_limit(endpoint_classes[class_name], **rate_limit)
+
+
+def read_deduplication_config(config_):
+    if 'deduplication' in config_:
+        return config_['deduplication']
+    else:
+        return dict()
+
+
+def setup_deduplication(config_):
+    """
+    Reads how paginators over the endpoint classes named in the "deduplication" section of the configuration drop
+    duplicates, e.g. {"PostsEndpoint": {"max_cached_ids": 1000000, "mode": "bloom"}}
+
+    Returns:
+    dict mapping endpoint classes to the options overriding theirs (see Endpoint.set_dedup_options)
+    """
+    endpoint_classes = {cls.__name__: cls for cls in DEDUPLICATED_ENDPOINT_CLASSES}
+    dedup_overrides = dict()
+    for class_name, dedup_options in read_deduplication_config(config_).items():
+        if class_name not in endpoint_classes:
+            raise ValueError("unknown endpoint class in deduplication: {}. Available: {}".format(
+                class_name, ", ".join(endpoint_classes)))
+        unknown_options = set(dedup_options) - set(DEDUP_OPTION_NAMES)
+        if unknown_options:
+            raise ValueError("unknown deduplication options for {}: {}. Available: {}".format(
+                class_name, ", ".join(sorted(unknown_options)), ", ".join(DEDUP_OPTION_NAMES)))
+        dedup_overrides[endpoint_classes[class_name]] = remove_null_values_from_dict(dedup_options)
+    return dedup_overrides
+
+
+def setup_json_decoder(config_):
+    """
+    Returns:
+    function parsing responses with the json parser named in the "json_decoder" field of the configuration, or None
+    to use the default parser of the process (see decoding.set_decoder)
+    """
+    if 'json_decoder' in config_:
+        return get_decoder(config_['json_decoder'])
+    return None
+
+
+def read_rate_limit_backend_config(config_):
+    if 'rate_limit_backend' in config_:
+        return config_['rate_limit_backend']
+    else:
+        return None
+
+
+def read_retry_config(config_):
+    if 'retry' in config_:
+        return config_['retry']
+    else:
+        return None
+
+
+def read_response_cache_config(config_):
+    if 'response_cache' in config_:
+        return config_['response_cache']
+    else:
+        return None
+
+
+def read_session_config(config_):
+    if 'session' in config_:
+        return config_['session']
+    else:
+        return dict()
+
+
 class API:
     """Wrapper for calling crowdtangle endpoints. All methods return iterators over the objects returned by
     crowdtangle. Rate limiting, deduplication, and pagination are handled automatically."""
 
-    def __init__(self, token=None, config_file_locations=CONFIG_FILE_LOCATIONS):
+    def __init__(self, token=None, config_file_locations=CONFIG_FILE_LOCATIONS, pool_connections=None,
+                 pool_maxsize=None, connect_timeout=None, read_timeout=None, tokens=None, token_strategy=ROUND_ROBIN,
+                 rate_limit_backend=None, retry_policy=None, response_cache=None):
         """
         Sets the token for the current API instance.
         If no token is provided, it will try to load it from config.py, if found in  CONFIG_FILE_LOCATIONS
+        Several tokens can be pooled, either via `tokens` or via the "tokens" list in the configuration file: calls are
+        then scheduled across the tokens, each with its own rate limits.
+        Connection settings that are not provided are read from the "session" section of the configuration file, if
+        any, and otherwise fall back to the defaults in pytangle.connectivity.
 
         Args:
             token: (str, default None) A valid crowdtangle token
             config_file_locations: (list of str, default CONFIG_FILE_LOCATIONS) possible locations for the
                     configuration file
+            pool_connections: (int, default None) number of per-host connection pools to keep
+            pool_maxsize: (int, default None) maximum number of keep-alive connections per host
+            connect_timeout: (float, default None) seconds to wait for a connection to crowdtangle
+            read_timeout: (float, default None) seconds to wait for crowdtangle to send data
+            tokens: (list of str, default None) A pool of valid crowdtangle tokens, used instead of token
+            token_strategy: (round_robin, least_recently_used, default round_robin) how calls are scheduled across
+                    the pool of tokens
+            rate_limit_backend: (RateLimitBackend or dict, default None) where rate budgets are kept, to share them
+                    with other processes or hosts; a dict is passed to ratelimiting.create_backend, e.g.
+                    {"type": "coordinator", "host": "10.0.0.1"}. If None, read from the configuration file, or kept in
+                    memory
+            retry_policy: (RetryPolicy or dict, default None) decides which failed calls are retried, and when; a
+                    dict is passed to retry.create_retry_policy, e.g. {"type": "exponential", "max_retries": 3}. If
+                    None, read from the "retry" section of the configuration file, or retry.DEFAULT_RETRY_POLICY
+            response_cache: (ResponseCache or dict, default None) stores responses on disk, so that repeated queries
+                    do not call crowdtangle; a dict is passed to cache.create_response_cache, e.g.
+                    {"path": "/tmp/ct.sqlite", "ttl": 600}. If None, read from the "response_cache" section of the
+                    configuration file, or responses are not cached
         """
         config_ = read_config(config_file_locations)
         setup_logger(config_)
-        if token is None:
-            token = read_token(config_)
+        self._json_decoder = setup_json_decoder(config_)
+        if tokens is None and token is not None:
+            tokens = [token]
+        if tokens is None:
+            tokens = read_tokens(config_)
+        if tokens is None and read_token(config_) is not None:
+            tokens = [read_token(config_)]
 
-        if token is None:
+        if not tokens:
             raise ValueError("Pass a token value, or set it in the configuration file. None found. Looked here: " + \
                              str(config_file_locations))
-        self._token = token
+        self._token = tokens[0]
+        if rate_limit_backend is None:
+            rate_limit_backend = read_rate_limit_backend_config(config_)
+        if rate_limit_backend is not None and not isinstance(rate_limit_backend, RateLimitBackend):
+            rate_limit_backend = create_backend(rate_limit_backend)
+        if retry_policy is None:
+            retry_policy = read_retry_config(config_)
+        if retry_policy is not None and not isinstance(retry_policy, RetryPolicy):
+            retry_policy = create_retry_policy(retry_policy)
+        self._token_pool = TokenPool(tokens, strategy=token_strategy, backend=rate_limit_backend,
+                                     retry_policy=retry_policy)
+        setup_rate_limits(config_, self._token_pool)
+        self._dedup_overrides = setup_deduplication(config_)
+
+        if response_cache is None:
+            response_cache = read_response_cache_config(config_)
+        if response_cache is not None and not isinstance(response_cache, ResponseCache):
+            response_cache = create_response_cache(response_cache)
+        self._response_cache = response_cache
+
+        session_config = read_session_config(config_)
+        session_config.update(remove_null_values_from_dict(dict(pool_connections=pool_connections,
+                                                                pool_maxsize=pool_maxsize,
+                                                                connect_timeout=connect_timeout,
+                                                                read_timeout=read_timeout,
+                                                                )))
+        self._session = self._new_session(**session_config)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """Closes the keep-alive connections held by this API instance."""
+        self._session.close()
+
+    def connection_stats(self):
+        """
+        Returns:
+        dict with the number of requests sent, of connections opened, and of requests that reused an open connection
+        """
+        return self._session.connection_stats()
+
+    def cache_stats(self):
+        """
+        Returns:
+        dict with the number of cached responses, their size in bytes, and the number of cache hits and misses, or
+        None if responses are not cached
+        """
+        if self._response_cache is None:
+            return None
+        return self._response_cache.stats()
+
+    def quota(self):
+        """
+        Reports the rate budget left for each token in the pool, e.g. to plan work ahead.
+
+        Returns:
+        dict mapping each token (only its last characters) to a dict, mapping each rate limited endpoint class to the
+        number of calls that can be made right now ("remaining"), the seconds until the next call can be made
+        ("next_refill"), and the current burst size ("burst"). "benched" reports the seconds until a token rejected
+        by crowdtangle returns to the pool.
+        """
+        rate_limits = {cls.__name__: self.get_rate_limit(cls) for cls in RATE_LIMITED_ENDPOINT_CLASSES
+                       if self.get_rate_limit(cls) is not None}
+        return self._token_pool.quota(rate_limits)
+
+    def get_rate_limit(self, endpoint_class):
+        """
+        Returns:
+        RateLimit of the calls to the endpoint class (e.g. PostsEndpoint) made by this API instance, as set in the
+        "rate_limits" section of its configuration or else for the class, or None if they are not rate limited
+        """
+        return self._token_pool.get_rate_limit(endpoint_class)
+
+    def token_count(self):
+        """
+        Returns:
+        the number of tokens in the pool, whose rate budgets add up
+        """
+        return len(self._token_pool)
+
+    def get_dedup_options(self, endpoint_class):
+        """
+        Returns:
+        dict of arguments to dedup.create_id_cache used by the paginators of this API instance over the endpoint class,
+        as set in the "deduplication" section of its configuration or else for the class
+        """
+        dedup_options = endpoint_class.dedup_options()
+        for cls in reversed(endpoint_class.__mro__):
+            dedup_options.update(self._dedup_overrides.get(cls, dict()))
+        return dedup_options
+
+    def _new_session(self, **session_config):
+        return Session(**session_config)
+
+    def _paginate(self, endpoint, shards=1, **paginator_options):
+        paginator_options.setdefault('dedup_options', self.get_dedup_options(type(endpoint)))
+        if shards > 1:
+            return ShardedPaginator(endpoint=endpoint, shards=shards, **paginator_options)
+        return Paginator(endpoint=endpoint, **paginator_options)
 
     def posts(
             self,
@@ -90,6 +332,16 @@ class API:
             weightShare=0,
             weightView=0,
             weightWow=0,
+            prefetch=0,
+            shards=1,
+            checkpoint=None,
+            resume_from=None,
+            raw=False,
+            fields=None,
+            records=False,
+            intern_accounts=None,
+            account_table=None,
+            compact_history=None,
     ):
         """
         Args:
@@ -139,6 +391,34 @@ class API:
         weightShare : ( 0-10, default 0 )
         weightView : ( 0-10, default 0 )
         weightWow : ( 0-10, default 0 )
+        prefetch : ( >= 0, default 0 ) Number of pages to fetch in the background while the current page is consumed.
+                    0 fetches a page only once the previous one is exhausted.
+        shards : ( >= 1, default 1 ) Number of time windows into which [startDate, endDate] is split and crawled
+                    concurrently. Requires sortBy="date" and a startDate. Results are still returned in date order.
+        checkpoint : ( path, default None ) File where the state of the crawl is saved after each page, so that an
+                    interrupted crawl can be continued via resume_from.
+        resume_from : ( path or dict, default None ) Checkpoint from which to continue a crawl of the same query,
+                    without fetching again the pages already consumed nor returning items already returned. The
+                    checkpoint keeps being updated as the crawl continues. If the file does not exist, the crawl starts
+                    from scratch.
+        raw : ( bool, default False ) Return each item as the bytes of its json (pytangle.rawjson.RawItem), as sliced
+                    from the response, e.g. to archive items without decoding and encoding them again. Top-level
+                    fields, e.g. id and date, can still be accessed by key.
+        fields : ( list of str, default None ) Fields of the items to keep, as dotted paths, e.g. ["id", "date",
+                    "account.handle", "statistics.actual.shareCount"]; the other fields are dropped as soon as a page
+                    is fetched. None returns items whole.
+        records : ( bool or subclass of pytangle.records.Record, default False ) Return items as compact records
+                    (e.g. pytangle.records.Post), whose fields can be accessed as attributes or by key, and which can
+                    be converted back via to_dict().
+        intern_accounts : ( shared, ids, default None ) Deduplicate the accounts embedded in items by account id:
+                    "shared" makes all items from the same account share one account object; "ids" replaces the
+                    account of each item with its id (accountId). Accounts are collected in the account_table
+                    attribute of the returned iterator, which can be exported.
+        account_table : ( pytangle.interning.AccountTable, default None ) Table collecting the interned accounts, e.g.
+                    to share it across queries. If None, a new table.
+        compact_history : ( arrays, compressed, default None ) Store the history of each post (see includeHistory) as
+                    delta-encoded arrays (pytangle.history.CompactHistory), optionally compressed, which can be
+                    converted back via to_list(). None returns histories as lists of timesteps.
 
         Returns:
         iterator of posts (dict)
@@ -177,14 +457,22 @@ class API:
             weightView=weightView,
             weightWow=weightWow,
         )
-        yield from Paginator(endpoint=PostsEndpoint(args=remove_null_values_from_dict(params)))
+        endpoint = PostsEndpoint(args=remove_null_values_from_dict(params), session=self._session,
+                                 token_pool=self._token_pool, response_cache=self._response_cache,
+                                 json_decoder=self._json_decoder)
+        return self._paginate(endpoint, prefetch=prefetch, shards=shards, checkpoint=checkpoint,
+                              resume_from=resume_from, raw=raw,
+                              fields=fields, records=records,
+                              intern_accounts=intern_accounts, account_table=account_table,
+                              compact_history=compact_history)
 
     def post(
             self,
             id,
             account=None,
             includeHistory=None,
-            endpoint='ct'
+            endpoint='ct',
+            compact_history=None,
     ):
         """
         Args:
@@ -196,6 +484,8 @@ class API:
         includeHistory : (None or True, default None (does not include)) Includes timestep data for growth of each post
                     returned.
         endpoint : ( platform, ct, default ct ) which API endpoint to query.
+        compact_history : ( arrays, compressed, default None ) Store the history of the post as delta-encoded arrays
+                    (pytangle.history.CompactHistory), optionally compressed. None returns the history as a list.
 
         Returns:
         iterator with a single post (dict) if available
@@ -210,12 +500,127 @@ class API:
             print(a_post)
 
        """
+        post_endpoint = self._get_post_endpoint(id, account, includeHistory, endpoint)
+        return self._paginate(post_endpoint, compact_history=compact_history)
+
+    def _get_post_endpoint(self, id, account, includeHistory, endpoint):
         params = dict(id=id,
                       token=self._token,
                       account=account,
                       includeHistory=includeHistory,
                       )
-        yield from Paginator(endpoint=PostEndpoint(endpoint=endpoint, args=remove_null_values_from_dict(params)))
+        return PostEndpoint(endpoint=endpoint, args=remove_null_values_from_dict(params),
+                            session=self._session,
+                            token_pool=self._token_pool, response_cache=self._response_cache,
+                            json_decoder=self._json_decoder)
+
+    def _lookup_post(self, id, account, includeHistory, endpoint):
+        post_endpoint = self._get_post_endpoint(id, account, includeHistory, endpoint)
+        try:
+            response = post_endpoint.request(post_endpoint.args)
+        except NotFoundError:
+            return None
+        except ClientError as e:
+            if e.http_status == 404:
+                return None
+            raise
+        return get_looked_up_post(response, post_endpoint)
+
+    def posts_by_ids(
+            self,
+            ids,
+            endpoint='ct',
+            account=None,
+            includeHistory=None,
+            concurrency=DEFAULT_POOL_MAXSIZE,
+            keep_order=False,
+            resolved=None,
+            not_found=None,
+    ):
+        """
+        Looks up many posts by id concurrently, e.g. to hydrate the post ids of a dataset.
+
+        Args:
+        ids : ( iterable ) Ids of the posts, as in post. Ids are consumed as lookups complete, so that they can be
+                    read lazily, e.g. from a file.
+        endpoint : ( platform, ct, default ct ) which API endpoint to query.
+        account : ( None ) Ignored if endpoint == "ct". The slug or ID of the posting account on its platform, as in
+                    post.
+        includeHistory : (None or True, default None (does not include)) Includes timestep data for growth of each post
+                    returned.
+        concurrency : ( >= 1, default 10 ) Number of lookups in flight. Lookups share the keep-alive connections of the
+                    API instance: set pool_maxsize to at least concurrency, so that connections are reused.
+        keep_order : ( bool, default False ) Return posts in the order of their ids, rather than as soon as they are
+                    returned. A slow lookup then holds back the posts after it, up to concurrency lookups.
+        resolved : ( set, default None ) Ids already looked up, which are skipped; ids are added to it once their
+                    lookup completes (with a post, or not found), so that passing the same set to later calls resumes an
+                    interrupted hydration, including the lookups that were in flight. If None, a new set: repeated ids
+                    are looked up once.
+        not_found : ( list, default None ) List to which the ids of the posts that do not exist are appended. Posts
+                    not found are skipped, and logged.
+
+        Returns:
+        iterator of posts (dict)
+
+        Example use:
+        from api import API
+        api = API(pool_maxsize=20)
+
+        # get the posts of a list of ids, 20 at a time
+        not_found = list()
+        for a_post in api.posts_by_ids(["1515871602074952_5362226790772728"], endpoint='platform', concurrency=20,
+                                       not_found=not_found):
+            print(a_post)
+        print("not found:", not_found)
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        if resolved is None:
+            resolved = set()
+        ids = iter(ids)
+        pending = deque()
+        # ids in flight: marked as resolved only once their lookup completes, so that ids whose lookup failed or was
+        # cancelled are looked up again when resuming
+        submitted = set()
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+        def submit_next():
+            for an_id in ids:
+                if an_id in resolved or an_id in submitted:
+                    continue
+                submitted.add(an_id)
+                pending.append((an_id, executor.submit(self._lookup_post, an_id, account, includeHistory, endpoint)))
+                return True
+            return False
+
+        def get_result(an_id, future):
+            a_post = future.result()
+            submitted.discard(an_id)
+            resolved.add(an_id)
+            if a_post is None:
+                logger.warning("post {} not found".format(an_id))
+                if not_found is not None:
+                    not_found.append(an_id)
+            return a_post
+
+        try:
+            while len(pending) < concurrency and submit_next():
+                pass
+            while len(pending):
+                if keep_order:
+                    an_id, future = pending.popleft()
+                else:
+                    done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+                    an_id, future = next((an_id, future) for an_id, future in pending if future in done)
+                    pending.remove((an_id, future))
+                a_post = get_result(an_id, future)
+                submit_next()
+                if a_post is not None:
+                    yield a_post
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
 
     def search(
             self,
@@ -242,6 +647,16 @@ class API:
             types=None,
             verifiedOnly=False,
             language=None,
+            prefetch=0,
+            shards=1,
+            checkpoint=None,
+            resume_from=None,
+            raw=False,
+            fields=None,
+            records=False,
+            intern_accounts=None,
+            account_table=None,
+            compact_history=None,
     ):
         """
         Args:
@@ -295,6 +710,34 @@ class API:
                     supply information about verified accounts.
         language : ( None, i.e. all languages ) Exceptions: Some languages require more than two characters: Chinese
                     (Simplified) is zh-CN and Chinese (Traditional) is zh-TW.
+        prefetch : ( >= 0, default 0 ) Number of pages to fetch in the background while the current page is consumed.
+                    0 fetches a page only once the previous one is exhausted.
+        shards : ( >= 1, default 1 ) Number of time windows into which [startDate, endDate] is split and crawled
+                    concurrently. Requires sortBy="date" and a startDate. Results are still returned in date order.
+        checkpoint : ( path, default None ) File where the state of the crawl is saved after each page, so that an
+                    interrupted crawl can be continued via resume_from.
+        resume_from : ( path or dict, default None ) Checkpoint from which to continue a crawl of the same query,
+                    without fetching again the pages already consumed nor returning items already returned. The
+                    checkpoint keeps being updated as the crawl continues. If the file does not exist, the crawl starts
+                    from scratch.
+        raw : ( bool, default False ) Return each item as the bytes of its json (pytangle.rawjson.RawItem), as sliced
+                    from the response, e.g. to archive items without decoding and encoding them again. Top-level
+                    fields, e.g. id and date, can still be accessed by key.
+        fields : ( list of str, default None ) Fields of the items to keep, as dotted paths, e.g. ["id", "date",
+                    "account.handle", "statistics.actual.shareCount"]; the other fields are dropped as soon as a page
+                    is fetched. None returns items whole.
+        records : ( bool or subclass of pytangle.records.Record, default False ) Return items as compact records
+                    (e.g. pytangle.records.Post), whose fields can be accessed as attributes or by key, and which can
+                    be converted back via to_dict().
+        intern_accounts : ( shared, ids, default None ) Deduplicate the accounts embedded in items by account id:
+                    "shared" makes all items from the same account share one account object; "ids" replaces the
+                    account of each item with its id (accountId). Accounts are collected in the account_table
+                    attribute of the returned iterator, which can be exported.
+        account_table : ( pytangle.interning.AccountTable, default None ) Table collecting the interned accounts, e.g.
+                    to share it across queries. If None, a new table.
+        compact_history : ( arrays, compressed, default None ) Store the history of each post (see includeHistory) as
+                    delta-encoded arrays (pytangle.history.CompactHistory), optionally compressed, which can be
+                    converted back via to_list(). None returns histories as lists of timesteps.
 
         Returns:
         iterator of posts (dict)
@@ -343,7 +786,14 @@ class API:
             verifiedOnly=verifiedOnly,
             language=language,
         )
-        yield from Paginator(endpoint=SearchEndpoint(args=remove_null_values_from_dict(params)))
+        endpoint = SearchEndpoint(args=remove_null_values_from_dict(params), session=self._session,
+                                  token_pool=self._token_pool, response_cache=self._response_cache,
+                                  json_decoder=self._json_decoder)
+        return self._paginate(endpoint, prefetch=prefetch, shards=shards, checkpoint=checkpoint,
+                              resume_from=resume_from, raw=raw,
+                              fields=fields, records=records,
+                              intern_accounts=intern_accounts, account_table=account_table,
+                              compact_history=compact_history)
 
     def leaderboard(
             self,
@@ -356,6 +806,14 @@ class API:
             offset=0,
             orderBy="desc",
             sortBy="total_interactions",
+            prefetch=0,
+            checkpoint=None,
+            resume_from=None,
+            raw=False,
+            fields=None,
+            records=False,
+            intern_accounts=None,
+            account_table=None,
     ):
         """
         Args:
@@ -377,6 +835,29 @@ class API:
         orderBy : ( default desc ) the order of the sort.
         sortBy : ( total_interactions, interaction_rate, default total_interactions ) The method by which the
                     accountStatistics are sorted.
+        prefetch : ( >= 0, default 0 ) Number of pages to fetch in the background while the current page is consumed.
+                    0 fetches a page only once the previous one is exhausted.
+        checkpoint : ( path, default None ) File where the state of the crawl is saved after each page, so that an
+                    interrupted crawl can be continued via resume_from.
+        resume_from : ( path or dict, default None ) Checkpoint from which to continue a crawl of the same query,
+                    without fetching again the pages already consumed nor returning items already returned. The
+                    checkpoint keeps being updated as the crawl continues. If the file does not exist, the crawl starts
+                    from scratch.
+        raw : ( bool, default False ) Return each item as the bytes of its json (pytangle.rawjson.RawItem), as sliced
+                    from the response, e.g. to archive items without decoding and encoding them again. Top-level
+                    fields, e.g. id and date, can still be accessed by key.
+        fields : ( list of str, default None ) Fields of the items to keep, as dotted paths, e.g. ["id", "date",
+                    "account.handle", "statistics.actual.shareCount"]; the other fields are dropped as soon as a page
+                    is fetched. None returns items whole.
+        records : ( bool or subclass of pytangle.records.Record, default False ) Return items as compact records
+                    (e.g. pytangle.records.Post), whose fields can be accessed as attributes or by key, and which can
+                    be converted back via to_dict().
+        intern_accounts : ( shared, ids, default None ) Deduplicate the accounts embedded in items by account id:
+                    "shared" makes all items from the same account share one account object; "ids" replaces the
+                    account of each item with its id (accountId). Accounts are collected in the account_table
+                    attribute of the returned iterator, which can be exported.
+        account_table : ( pytangle.interning.AccountTable, default None ) Table collecting the interned accounts, e.g.
+                    to share it across queries. If None, a new table.
 
         Returns:
         iterator of accounts (dict)
@@ -401,7 +882,12 @@ class API:
             orderBy=orderBy,
             sortBy=sortBy,
         )
-        yield from Paginator(endpoint=LeaderboardEndpoint(args=remove_null_values_from_dict(params)))
+        endpoint = LeaderboardEndpoint(args=remove_null_values_from_dict(params), session=self._session,
+                                       token_pool=self._token_pool, response_cache=self._response_cache,
+                                       json_decoder=self._json_decoder)
+        return self._paginate(endpoint, prefetch=prefetch, checkpoint=checkpoint, resume_from=resume_from,
+                              raw=raw, fields=fields, records=records,
+                              intern_accounts=intern_accounts, account_table=account_table)
 
     def lists(
             self,
@@ -423,7 +909,10 @@ class API:
         params = dict(
             token=self._token,
         )
-        yield from Paginator(endpoint=ListsEndpoint(args=remove_null_values_from_dict(params)))
+        endpoint = ListsEndpoint(args=remove_null_values_from_dict(params), session=self._session,
+                                 token_pool=self._token_pool, response_cache=self._response_cache,
+                                 json_decoder=self._json_decoder)
+        return self._paginate(endpoint)
 
     def links(
             self,
@@ -437,6 +926,16 @@ class API:
             link=None,
             includeSummary=False,
             platforms=None,
+            prefetch=0,
+            shards=1,
+            checkpoint=None,
+            resume_from=None,
+            raw=False,
+            fields=None,
+            records=False,
+            intern_accounts=None,
+            account_table=None,
+            compact_history=None,
     ):
         """
         Args:
@@ -458,6 +957,34 @@ class API:
                     link. It will look beyond the count requested to summarize across the time searched. Requires a value
                     for startDate.
         platforms : ( facebook,instagram, default None i.e. all platforms ) The platforms from which to retrieve links. This value can be comma-separated.
+        prefetch : ( >= 0, default 0 ) Number of pages to fetch in the background while the current page is consumed.
+                    0 fetches a page only once the previous one is exhausted.
+        shards : ( >= 1, default 1 ) Number of time windows into which [startDate, endDate] is split and crawled
+                    concurrently. Requires sortBy="date" and a startDate. Results are still returned in date order.
+        checkpoint : ( path, default None ) File where the state of the crawl is saved after each page, so that an
+                    interrupted crawl can be continued via resume_from.
+        resume_from : ( path or dict, default None ) Checkpoint from which to continue a crawl of the same query,
+                    without fetching again the pages already consumed nor returning items already returned. The
+                    checkpoint keeps being updated as the crawl continues. If the file does not exist, the crawl starts
+                    from scratch.
+        raw : ( bool, default False ) Return each item as the bytes of its json (pytangle.rawjson.RawItem), as sliced
+                    from the response, e.g. to archive items without decoding and encoding them again. Top-level
+                    fields, e.g. id and date, can still be accessed by key.
+        fields : ( list of str, default None ) Fields of the items to keep, as dotted paths, e.g. ["id", "date",
+                    "account.handle", "statistics.actual.shareCount"]; the other fields are dropped as soon as a page
+                    is fetched. None returns items whole.
+        records : ( bool or subclass of pytangle.records.Record, default False ) Return items as compact records
+                    (e.g. pytangle.records.Post), whose fields can be accessed as attributes or by key, and which can
+                    be converted back via to_dict().
+        intern_accounts : ( shared, ids, default None ) Deduplicate the accounts embedded in items by account id:
+                    "shared" makes all items from the same account share one account object; "ids" replaces the
+                    account of each item with its id (accountId). Accounts are collected in the account_table
+                    attribute of the returned iterator, which can be exported.
+        account_table : ( pytangle.interning.AccountTable, default None ) Table collecting the interned accounts, e.g.
+                    to share it across queries. If None, a new table.
+        compact_history : ( arrays, compressed, default None ) Store the history of each post (see includeHistory) as
+                    delta-encoded arrays (pytangle.history.CompactHistory), optionally compressed, which can be
+                    converted back via to_list(). None returns histories as lists of timesteps.
 
         Returns:
         iterator of posts (dict)
@@ -485,7 +1012,14 @@ class API:
             includeSummary=includeSummary,
             platforms=platforms,
         )
-        yield from Paginator(endpoint=LinksEndpoint(args=remove_null_values_from_dict(params)))
+        endpoint = LinksEndpoint(args=remove_null_values_from_dict(params), session=self._session,
+                                 token_pool=self._token_pool, response_cache=self._response_cache,
+                                 json_decoder=self._json_decoder)
+        return self._paginate(endpoint, prefetch=prefetch, shards=shards, checkpoint=checkpoint,
+                              resume_from=resume_from, raw=raw,
+                              fields=fields, records=records,
+                              intern_accounts=intern_accounts, account_table=account_table,
+                              compact_history=compact_history)
 
     def accounts_in_list(
             self,
@@ -493,6 +1027,12 @@ class API:
             count=10,
             batchSize=100,
             offset=0,
+            prefetch=0,
+            checkpoint=None,
+            resume_from=None,
+            raw=False,
+            fields=None,
+            records=False,
     ):
         """
         Args:
@@ -502,6 +1042,23 @@ class API:
         batchSize : ( 1-100, default 100 ) Number of accounts to return at most per call to the endpoint. Between 1-100.
         offset : ( >= 0, default 0 ) The number of accounts to offset (generally used for pagination). Pagination links will also
                     be provided in the response.
+        prefetch : ( >= 0, default 0 ) Number of pages to fetch in the background while the current page is consumed.
+                    0 fetches a page only once the previous one is exhausted.
+        checkpoint : ( path, default None ) File where the state of the crawl is saved after each page, so that an
+                    interrupted crawl can be continued via resume_from.
+        resume_from : ( path or dict, default None ) Checkpoint from which to continue a crawl of the same query,
+                    without fetching again the pages already consumed nor returning items already returned. The
+                    checkpoint keeps being updated as the crawl continues. If the file does not exist, the crawl starts
+                    from scratch.
+        raw : ( bool, default False ) Return each item as the bytes of its json (pytangle.rawjson.RawItem), as sliced
+                    from the response, e.g. to archive items without decoding and encoding them again. Top-level
+                    fields, e.g. id and date, can still be accessed by key.
+        fields : ( list of str, default None ) Fields of the items to keep, as dotted paths, e.g. ["id", "date",
+                    "account.handle", "statistics.actual.shareCount"]; the other fields are dropped as soon as a page
+                    is fetched. None returns items whole.
+        records : ( bool or subclass of pytangle.records.Record, default False ) Return items as compact records
+                    (e.g. pytangle.records.Post), whose fields can be accessed as attributes or by key, and which can
+                    be converted back via to_dict().
 
         Returns:
         iterator of accounts (dict)
@@ -524,4 +1081,8 @@ class API:
             offset=offset,
             listId=listId,
         )
-        yield from Paginator(endpoint=AccountsEndpoint(args=remove_null_values_from_dict(params)))
+        endpoint = AccountsEndpoint(args=remove_null_values_from_dict(params), session=self._session,
+                                    token_pool=self._token_pool, response_cache=self._response_cache,
+                                    json_decoder=self._json_decoder)
+        return self._paginate(endpoint, prefetch=prefetch, checkpoint=checkpoint, resume_from=resume_from,
+                              raw=raw, fields=fields, records=records)
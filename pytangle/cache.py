@@ -0,0 +1,157 @@
+# Copyright (C) 2020 Mattia Samory
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import zlib
+from threading import Lock
+
+import logging
+
+logger = logging.getLogger()
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), ".pytangle_cache.sqlite")
+DEFAULT_CACHE_TTL = 60 * 60
+DEFAULT_CACHE_MAX_SIZE = 1024 ** 3
+
+
+def normalize_params(params):
+    """
+    Returns:
+    the query parameters without the token, with values as strings, so that the first page of a query (built from
+    arguments) and the same page reached via pagination links (parsed from urls) are equal
+    """
+    normalized = dict()
+    for key, value in params.items():
+        if key == 'token' or value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = [str(a_value) for a_value in value]
+            if len(value) == 1:
+                value = value[0]
+        else:
+            value = str(value)
+        normalized[key] = value
+    return normalized
+
+
+def get_cache_key(uri, params):
+    key = json.dumps([uri, normalize_params(params)], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Stores the bodies of crowdtangle responses on disk, compressed, so that repeated queries are answered without calling
+    crowdtangle, hence without spending rate budget. Responses are keyed by endpoint url and query parameters (tokens
+    excluded, so that all tokens share the cache), expire after a time to live set per endpoint class, and the least
+    recently used ones are evicted when the cache exceeds max_size bytes. The cache is an sqlite database, which can be
+    shared by several processes."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL, ttls=None, max_size=DEFAULT_CACHE_MAX_SIZE,
+                 compression_level=6):
+        """
+        Args:
+            path: (str, default ~/.pytangle_cache.sqlite) file of the cache
+            ttl: (float, default 3600) seconds after which a cached response expires
+            ttls: (dict, default None) endpoint class names mapped to their own ttl, e.g. {"ListsEndpoint": 86400}; 0
+                    disables caching for the endpoint
+            max_size: (int, default 1GB) bytes of compressed responses past which the least recently used are evicted
+            compression_level: (0-9, default 6) zlib compression level
+        """
+        self.path = path
+        self.ttl = ttl
+        self.ttls = dict(ttls or dict())
+        self.max_size = max_size
+        self.compression_level = compression_level
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, "
+                                 "expires REAL, accessed REAL, size INTEGER, body BLOB)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get_ttl(self, endpoint_name):
+        return self.ttls.get(endpoint_name, self.ttl)
+
+    def get(self, endpoint_name, uri, params):
+        """
+        Returns:
+        the body of the cached response (bytes), or None if there is none, or if it expired
+        """
+        if not self.get_ttl(endpoint_name):
+            return None
+        key = get_cache_key(uri, params)
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT expires, body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[0] <= now:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        logger.debug("cache hit {}".format(uri))
+        return zlib.decompress(row[1])
+
+    def set(self, endpoint_name, uri, params, content):
+        """
+        Args:
+            endpoint_name: (str) name of the endpoint class, whose ttl applies
+            uri: (str) endpoint url
+            params: (dict) query parameters
+            content: (bytes) body of the response
+        """
+        ttl = self.get_ttl(endpoint_name)
+        if not ttl:
+            return
+        body = zlib.compress(content, self.compression_level)
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                                     (get_cache_key(uri, params), endpoint_name, now + ttl, now, len(body), body))
+            self._evict(now)
+
+    def _evict(self, now):
+        self._connection.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+        size, = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if size <= self.max_size:
+            return
+        evicted = 0
+        for key, entry_size in self._connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if size <= self.max_size:
+                break
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            size -= entry_size
+            evicted += 1
+        logger.debug("evicted {} responses from the cache".format(evicted))
+
+    def clear(self):
+        """Removes all the cached responses"""
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+
+    def stats(self):
+        """
+        Returns:
+        dict with the number of cached responses, their size in bytes, and the number of hits and misses so far
+        """
+        with self._lock:
+            entries, size = self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return dict(entries=entries, size=size, hits=self.hits, misses=self.misses)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def create_response_cache(config):
+    """
+    Args:
+        config: (dict) arguments to ResponseCache, e.g. {"path": "/tmp/ct.sqlite", "ttls": {"PostsEndpoint": 600}}
+
+    Returns:
+    ResponseCache
+    """
+    return ResponseCache(**config)
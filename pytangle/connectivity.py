@@ -1,15 +1,30 @@
 # Copyright (C) 2020 Mattia Samory
 
+import os
 import time
 import json
 from collections import defaultdict, deque
 from copy import deepcopy
+from functools import partial
+from datetime import datetime
 from json import JSONDecodeError
 from urllib.parse import urlparse, parse_qs
 from sys import exit
+from queue import Queue, Full
+from threading import Lock, Thread, Event
 from dateutil.parser import parse as date_parse
 import requests
-from ratelimit import limits, sleep_and_retry, RateLimitException
+from requests.adapters import HTTPAdapter
+
+from pytangle.decoding import decode
+from pytangle.dedup import SharedIdCache, create_id_cache
+from pytangle.errors import create_error, CrowdTangleError, TokenError
+from pytangle.history import compact_history
+from pytangle.frames import get_column_types, to_arrays, to_frame, DEFAULT_CHUNK_SIZE
+from pytangle.interning import AccountTable
+from pytangle.rawjson import RawItem
+from pytangle.retry import DEFAULT_RETRY_POLICY
+from pytangle.utils import compile_projection, project
 
 import logging
 
@@ -20,117 +35,385 @@ ONE_MINUTE = 60
 TEN_SECONDS = 10
 THIRTY_SECONDS = 30
 
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+
+CHECKPOINT_VERSION = 1
+# suffix of the file next to a checkpoint counting the items returned so far
+RETURNED_COUNT_SUFFIX = '.returned'
+
+
+class Session:
+    """Keep-alive HTTP connections shared by all the endpoints of an API instance. Connections are pooled per host,
+    so that subsequent calls to crowdtangle reuse an open TCP/TLS connection instead of performing a new handshake."""
+
+    def __init__(self,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT):
+        """
+        Args:
+            pool_connections: (int, default DEFAULT_POOL_CONNECTIONS) number of per-host connection pools to keep
+            pool_maxsize: (int, default DEFAULT_POOL_MAXSIZE) maximum number of open connections kept per host
+            connect_timeout: (float, default DEFAULT_CONNECT_TIMEOUT) seconds to wait for a connection to be
+                    established
+            read_timeout: (float, default DEFAULT_READ_TIMEOUT) seconds to wait between bytes sent by the server
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self._session = requests.Session()
+        self._session.mount('https://', self._adapter)
+        self._session.mount('http://', self._adapter)
+        self._lock = Lock()
+        self.request_count = 0
+
+    def get(self, uri, params):
+        with self._lock:
+            self.request_count += 1
+        return self._session.get(uri, params=params, timeout=self.timeout)
+
+    def connection_stats(self):
+        """
+        Returns:
+        dict with the number of requests sent, of connections opened, and of requests that reused an open connection
+        """
+        pools = self._adapter.poolmanager.pools
+        connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+        return dict(requests=self.request_count,
+                    connections=connections,
+                    reused=max(0, self.request_count - connections),
+                    )
 
-@sleep_and_retry
-@limits(calls=1, period=TEN_SECONDS)
-def make_request_1_every_10s(uri, params, max_retries=5):
-    return make_request(uri, params, max_retries=5)
+    def close(self):
+        self._session.close()
 
 
-@sleep_and_retry
-@limits(calls=1, period=THIRTY_SECONDS)
-def make_request_1_every_30s(uri, params, max_retries=5):
-    return make_request(uri, params, max_retries=5)
+def parse_error_details(http_status, content):
+    """
+    Args:
+        http_status: (int) HTTP status code of the failed response
+        content: (bytes) body of the failed response
 
+    Returns:
+    defaultdict with the details of the error reported by crowdtangle (None for missing details)
+    """
+    error_details = defaultdict(lambda: None)
+    try:
+        error_details.update(json.loads(content.decode()))
+    except AttributeError:
+        pass
+    except JSONDecodeError as e:
+        logger.debug(e)
+    error_details['http_status'] = http_status
 
-# TODO: add config for max_retries
-def make_request(uri, params, max_retries=5):
-    current_tries = 0
-    last_exception = None
-    while current_tries < max_retries:
+    logger.debug(("error status (HTTP):{}\n" +
+                  "error status (CrowdTangle):{}\n" +
+                  "error code:{}\n" +
+                  "error message:{}\n" +
+                  "error url:{}").format(error_details['http_status'],
+                                         error_details['ct_status'],
+                                         error_details['code'],
+                                         error_details['message'],
+                                         error_details['url']))
+    return error_details
+
+
+def make_request(uri, params, session=None, retry_policy=None, fail_on_token_error=False, decoder=None):
+    """
+    Calls crowdtangle, retrying failed calls as decided by the retry policy.
+
+    Args:
+        uri: (str) endpoint url
+        params: (dict) query parameters
+        session: (Session, default None) connections to use for the call; if None, opens a new connection
+        retry_policy: (RetryPolicy, default None) decides which failed calls are retried, and when; if None, uses
+                retry.DEFAULT_RETRY_POLICY
+        fail_on_token_error: (bool, default False) raise TokenErrors immediately, e.g. to retry with another token
+        decoder: (callable, default None) function parsing the body of the response (bytes); if None,
+                decoding.decode
+
+    Returns:
+    the decoded response
+
+    Raises:
+    CrowdTangleError (see pytangle.errors) or requests.exceptions.RequestException if the call fails and is not retried
+    """
+    if retry_policy is None:
+        retry_policy = DEFAULT_RETRY_POLICY
+    if decoder is None:
+        decoder = decode
+    start_time = time.monotonic()
+    attempt = 0
+    while True:
         try:
-            response = requests.get(uri, params=params)
+            if session is not None:
+                response = session.get(uri, params)
+            else:
+                response = requests.get(uri, params=params)
             logger.debug(response)
-            response.raise_for_status()
-            return json.loads(response.content.decode('utf-8'))
-        except requests.exceptions.HTTPError as errh:
-            logger.error(errh)
-            error_details = defaultdict(lambda: None)
+            if response.status_code >= 400:
+                error_details = parse_error_details(response.status_code, response.content)
+                raise create_error(response.status_code, error_details, headers=response.headers, response=response)
+            return decoder(response.content)
+        except TokenError as e:
+            logger.error(e)
+            if fail_on_token_error:
+                raise
+            error = e
+        except CrowdTangleError as e:
+            logger.error(e)
+            error = e
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            logger.error("Error Connecting:{}".format(e))
+            error = e
+        attempt += 1
+        wait_time = retry_policy.get_wait_time(error, attempt, time.monotonic() - start_time)
+        if wait_time is None:
+            raise error
+        logger.debug("retrying in {:.1f} seconds".format(wait_time))
+        time.sleep(wait_time)
+
+
+def get_response_items(response, response_field):
+    if ('result' not in response) or (response_field not in response['result']):
+        return list()
+    return response['result'][response_field]
+
+
+def get_next_page_params(response, response_field, max_offset_threshold):
+    """
+    Computes the query parameters of the page following the response. When sorting by date and the offset overflows
+    max_offset_threshold, offset is reset and endDate is retracted to the date of the last item in the response.
+
+    Returns:
+    dict of query parameters, or None if there is no page to follow
+    """
+    items = get_response_items(response, response_field)
+    if not len(items):
+        return None
+    pagination = defaultdict(lambda: None)
+    if 'pagination' in response['result']:
+        pagination.update(response["result"]['pagination'])
+    next_page = pagination['nextPage']
+    logger.debug("next page: {}".format(next_page))
+    if not next_page:
+        return None
+
+    next_page_params = defaultdict(lambda: None)
+    next_page_params.update(parse_qs(urlparse(next_page).query))
+    # if offset overflows
+    if int(next_page_params['offset'][0]) > max_offset_threshold:
+        # if sorting by date, retract endDate, reset offset
+        # (does not apply to leaderboard, which can't sortBy date)
+        if next_page_params['sortBy'] == ["date"]:
+            next_page_params['offset'] = 0
+            end_date = date_parse(items[-1]['date'])
+            next_page_params['endDate'] = end_date.strftime('%Y-%m-%dT%H:%M:%S')
+    # make it a regular dictionary
+    return dict(next_page_params)
+
+
+def read_checkpoint(path):
+    """
+    Returns:
+    the paginator state saved in the checkpoint file, or None if the file does not exist
+    """
+    if not os.path.exists(path):
+        logger.info("no checkpoint found at {}: starting from scratch".format(path))
+        return None
+    with open(path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def write_checkpoint(path, state):
+    """Writes the paginator state to a temporary file first, so that a crash while writing leaves the previous
+    checkpoint intact"""
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as checkpoint_file:
+        json.dump(state, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temp_path, path)
+
+
+def read_returned_count(path):
+    """
+    Returns:
+    the number of items returned, as recorded next to the checkpoint file, or None if not recorded
+    """
+    try:
+        with open(path + RETURNED_COUNT_SUFFIX) as count_file:
+            return int(count_file.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_returned_count(path, returned_count):
+    """Records the number of items returned next to the checkpoint file. Written with the checkpoint of each page, and
+    when the paginator is closed or garbage collected, e.g. after leaving the loop with break"""
+    with open(path + RETURNED_COUNT_SUFFIX, 'w') as count_file:
+        count_file.write(str(returned_count))
+
+
+def remove_token(params):
+    # tokens are neither saved in checkpoints nor part of the query
+    return {key: value for key, value in params.items() if key != 'token'}
+
+
+def get_dedup_options(endpoint, max_cached_ids=None, dedup_mode=None, dedup_options=None):
+    dedup_options = dict(endpoint.dedup_options() if dedup_options is None else dedup_options)
+    if max_cached_ids is not None:
+        dedup_options['max_cached_ids'] = max_cached_ids
+    if dedup_mode is not None:
+        dedup_options['mode'] = dedup_mode
+    return dedup_options
+
+
+def get_record_class(endpoint, records):
+    if records is True:
+        return endpoint.get_record_class()
+    if not records:
+        return None
+    return records
+
+
+class PagePrefetcher(Thread):
+    """Fetches pages in a background thread, following pagination, while the consumer drains the pages fetched so
+    far. At most max_pages pages are buffered: when the buffer is full, the thread waits for the consumer."""
+    _DONE = object()
+
+    def __init__(self, request_fun, response_field, max_offset_threshold, params, max_pages, max_items=-1):
+        """
+        Args:
+            request_fun: (callable) function that calls crowdtangle with a dict of query parameters
+            response_field: (str) field of the response containing the items
+            max_offset_threshold: (int) offset past which date-sorted queries retract endDate
+            params: (dict) query parameters of the first page to fetch
+            max_pages: (int) maximum number of pages buffered ahead of the consumer
+            max_items: (int, default -1) stop after fetching this many items; -1 means follow all pages
+        """
+        super().__init__(daemon=True)
+        self.request_fun = request_fun
+        self.response_field = response_field
+        self.max_offset_threshold = max_offset_threshold
+        self.params = params
+        self.max_items = max_items
+        self.pages = Queue(maxsize=max_pages)
+        self._stopped = Event()
+        self._finished = False
+
+    def run(self):
+        params = self.params
+        fetched_items = 0
+        try:
+            while not self._stopped.is_set():
+                logger.debug("prefetch call params " + str(params))
+                response = self.request_fun(params)
+                next_page_params = get_next_page_params(response, self.response_field, self.max_offset_threshold)
+                self._put((response, next_page_params, None))
+                fetched_items += len(get_response_items(response, self.response_field))
+                if next_page_params is None or -1 < self.max_items <= fetched_items:
+                    break
+                params = next_page_params
+        except Exception as e:
+            self._put((None, None, e))
+        self._put(self._DONE)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
             try:
-                error_details.update(json.loads(errh.response.content.decode()))
-            except AttributeError:
+                self.pages.put(item, timeout=ONE_SECOND)
+                return
+            except Full:
                 pass
-            except JSONDecodeError as e:
-                logger.debug(e)
-            error_details['http_status'] = errh.response.status_code
-            error_message = error_details['message']
-            error_ct_status = error_details['ct_status']
-            error_http_status = error_details['http_status']
-            error_code = error_details['code']
-            error_url = error_details['url']
-
-            logger.debug(("error status (HTTP):{}\n"+
-                         "error status (CrowdTangle):{}\n"+
-                         "error code:{}\n"+
-                         "error message:{}\n"+
-                         "error url:{}").format(error_http_status,
-                                                error_ct_status,
-                                                error_code,
-                                                error_message,
-                                                error_url))
-
-            if error_http_status == 429:  # rate limit exceeded
-                # should be handled by ratelimit
-                # it's actually not
-                # FIXME: make it so that ratelimit handles this
-                # raise
-                time.sleep(30)
-
-            elif error_code == 20:  # Unknown Parameter
-                logger.error("Crowdtangle error code 20: Unknown Parameter")
-                time.sleep(60)
-            elif error_code == 21:  # Illegal Parameter Value
-                logger.error("Crowdtangle error code 21: Illegal Parameter Value")
-                time.sleep(60)
-            elif error_code == 22:  # Missing Parameter
-                logger.error("Crowdtangle error code 22: Missing Parameter")
-                time.sleep(60)
-            elif error_code == 30:  # Missing Token
-                logger.error("Crowdtangle error code 30: Missing Token")
-                time.sleep(60)
-            elif error_code == 31:  # Invalid Token
-                logger.error("Crowdtangle error code 31: Invalid Token")
-                time.sleep(60)
-            elif error_code == 40:  # Does Not Exist
-                logger.error("Crowdtangle error code 40: Does Not Exist")
-                time.sleep(60)
-            elif error_code == 41:  # Not Allowed
-                logger.error("Crowdtangle error code 41: Not Allowed")
-                time.sleep(60)
-            elif error_http_status / 100 == 4:  # 4XX other client side error
-                time.sleep(60)
-                raise errh
-            elif error_http_status / 100 == 5:  # 5XX error
-                # TODO: add config for how long to wait
-                time.sleep(60)
-            else:
-                time.sleep(1)
-            last_exception = errh
-            current_tries += 1
-        except requests.exceptions.ConnectionError as errc:
-            logger.error("Error Connecting:{}".format(errc) + "\nsleeping")
-            last_exception = errc
-            time.sleep(60)
-            current_tries += 1
-        except requests.exceptions.Timeout as errt:
-            logger.error("Timeout Error:{}".format(errt) + "\nsleeping")
-            last_exception = errt
-            time.sleep(60)
-            current_tries += 1
-        except requests.exceptions.RequestException as err:
-            logger.error("Unspecified RequestException".format(err))
-            raise err
-    # if all retries fail, raise the last exception
-    raise last_exception
+
+    def get(self):
+        """
+        Returns:
+        tuple (response, parameters of the following page), or None if the thread stopped fetching
+        """
+        if self._finished:
+            return None
+        item = self.pages.get()
+        if item is self._DONE:
+            self._finished = True
+            return None
+        response, next_page_params, exception = item
+        if exception is not None:
+            raise exception
+        return response, next_page_params
+
+    def stop(self):
+        self._stopped.set()
 
 
 class Paginator:
 
-    def __init__(self, endpoint, max_cached_ids=100):
+    def __init__(self, endpoint, max_cached_ids=None, prefetch=0, checkpoint=None, resume_from=None, dedup_mode=None,
+                 raw=False, fields=None, records=False, intern_accounts=None, account_table=None,
+                 compact_history=None, dedup_options=None, id_cache=None):
+        """
+        Args:
+            endpoint: (Endpoint) endpoint to query
+            max_cached_ids: (int, default None) number of recent ids to remember when deduplicating. If None, as set
+                    for the endpoint (see Endpoint.set_dedup_options)
+            prefetch: (int, default 0) number of pages to fetch in the background
+            checkpoint: (str, default None) path of the file where the state of the crawl is saved once each page is
+                    fetched, and when the paginator is closed. The number of items returned is recorded after each item,
+                    in a file next to it, so that resuming does not return them again
+            resume_from: (str or dict, default None) path of a checkpoint file, or state returned by get_state, from
+                    which to continue the crawl. If a path is given and checkpoint is None, the checkpoint keeps being
+                    saved to the same file
+            dedup_mode: (lru, bloom, default None) how ids are remembered (see dedup.create_id_cache). If None, as set
+                    for the endpoint
+            raw: (bool, default False) return items as rawjson.RawItem, i.e. the bytes of their json as sliced from the
+                    response, instead of decoding them
+            fields: (list of str, default None) fields of the items to keep, as dotted paths (see
+                    utils.compile_projection); the other fields are dropped as soon as a page is fetched. If None, items
+                    are returned whole
+            records: (bool or subclass of records.Record, default False) return items as compact records: if True, of
+                    the class returned by endpoint.get_record_class()
+            intern_accounts: (shared, ids, default None) deduplicate the accounts embedded in items by account id (see
+                    interning.AccountTable)
+            account_table: (interning.AccountTable, default None) table collecting the interned accounts, e.g. to
+                    share it across paginators. If None and interning, a new table
+            compact_history: (arrays, compressed, default None) store the history of items as delta-encoded arrays
+                    (see history.CompactHistory), optionally compressed. If None, histories are lists of timesteps
+            dedup_options: (dict, default None) arguments to dedup.create_id_cache, e.g. as configured for an API
+                    instance (see API.get_dedup_options), overridden by max_cached_ids and dedup_mode. If None, as set
+                    for the endpoint
+            id_cache: (dedup.IdCache, default None) ids of the items returned, e.g. shared with the paginators of other
+                    time windows (see dedup.SharedIdCache). If None, a new cache, as set by the options above
+        """
         self.endpoint = endpoint
-        self.cached_ids = deque(maxlen=max_cached_ids)
+        if id_cache is None:
+            id_cache = create_id_cache(**get_dedup_options(endpoint, max_cached_ids, dedup_mode, dedup_options))
+        self.cached_ids = id_cache
 
-        self.request_fun = endpoint.request_function()
+        if raw and fields is not None:
+            raise ValueError("fields cannot be projected from raw items")
+        if raw and intern_accounts is not None:
+            raise ValueError("accounts cannot be interned in raw items")
+        if raw and compact_history is not None:
+            raise ValueError("histories cannot be compacted in raw items")
+        self.raw = raw
+        self.projection = None
+        if fields is not None:
+            self.projection = compile_projection(fields)
+        self.record_class = get_record_class(endpoint, records)
+        self.intern_accounts = intern_accounts
+        if intern_accounts is not None and account_table is None:
+            account_table = AccountTable()
+        self.account_table = account_table
+        self.compact_history = compact_history
+        self.request_fun = partial(endpoint.request, raw=raw)
         self.response_field = endpoint.get_response_field_name()
         self.param_dict = deepcopy(endpoint.args)
         self.max_offset_threshold = endpoint.max_query_offset()
@@ -144,6 +427,9 @@ class Paginator:
         self.current_results = deque()
         self.has_next_page = True
 
+        self.prefetch = prefetch
+        self.prefetcher = None
+
         count = -1
         if "batchSize" in self.param_dict:
             if "count" in self.param_dict:
@@ -155,16 +441,119 @@ class Paginator:
         self.total_count = count
         self.next_page_params = deepcopy(self.param_dict)
 
-    def __fetch_next_response(self):
+        self.checkpoint = checkpoint
+        # number of items returned as last recorded next to the checkpoint file, if known
+        self._recorded_returned_count = None
+        if resume_from is not None:
+            state = resume_from
+            if isinstance(resume_from, str):
+                if self.checkpoint is None:
+                    self.checkpoint = resume_from
+                state = read_checkpoint(resume_from)
+            if state is not None:
+                self.set_state(state)
+                if isinstance(resume_from, str):
+                    self._skip_returned(read_returned_count(resume_from))
+
+    def get_state(self):
+        """
+        Returns:
+        json-serializable dict with the progress of the crawl: the parameters of the next page to fetch, the number of
+        items returned, the ids cached for deduplication, and the items fetched but not returned yet. API tokens are
+        not included
+        """
+        return dict(
+            version=CHECKPOINT_VERSION,
+            endpoint=type(self.endpoint).__name__,
+            query=remove_token(self.param_dict),
+            next_page_params=remove_token(self.next_page_params),
+            has_next_page=self.has_next_page,
+            returned_count=self.returned_count,
+            cached_ids=self.cached_ids.get_state(),
+            current_results=[result.decode('utf-8') if self.raw else result for result in self.current_results],
+        )
+
+    def set_state(self, state):
+        """Continues the crawl from a state returned by get_state, for the same endpoint and query"""
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise ValueError("unsupported checkpoint version: {}".format(state.get('version')))
+        if state['endpoint'] != type(self.endpoint).__name__ or \
+                state['query'] != json.loads(json.dumps(remove_token(self.param_dict))):
+            raise ValueError("the checkpoint was saved by a different query: {} {}".format(state['endpoint'],
+                                                                                           state['query']))
+        self.next_page_params = state['next_page_params']
+        self.has_next_page = state['has_next_page']
+        self.returned_count = state['returned_count']
+        self.cached_ids.set_state(state['cached_ids'])
+        self.current_results = deque(RawItem(result.encode('utf-8')) if self.raw else result
+                                     for result in state['current_results'])
+        logger.info("resuming after {} items".format(self.returned_count))
+
+    def _skip_returned(self, returned_count):
+        # items of the page in the checkpoint that were returned after it was saved
+        if returned_count is None:
+            return
+        skipped = returned_count - self.returned_count
+        if 0 < skipped <= len(self.current_results):
+            for _ in range(skipped):
+                self.current_results.popleft()
+            self.returned_count = returned_count
+            logger.info("skipping {} items returned before the crawl was interrupted".format(skipped))
+
+    def dedup_stats(self):
+        """
+        Returns:
+        dict with the deduplication mode, the number of ids remembered, and the number of items dropped as
+        duplicates (hits) or returned as new (misses)
+        """
+        return self.cached_ids.stats()
+
+    def save_checkpoint(self):
+        """Saves the state of the crawl to the checkpoint file, if any"""
+        if self.checkpoint is not None:
+            write_checkpoint(self.checkpoint, self.get_state())
+            write_returned_count(self.checkpoint, self.returned_count)
+            self._recorded_returned_count = self.returned_count
+
+    def save_returned_count(self):
+        """Records the number of items returned next to the checkpoint file, if any, unless it is recorded already"""
+        if self.checkpoint is not None and self.returned_count != self._recorded_returned_count:
+            write_returned_count(self.checkpoint, self.returned_count)
+            self._recorded_returned_count = self.returned_count
+
+    def _fetch_page(self):
+        if self.prefetch > 0:
+            if self.prefetcher is None:
+                max_items = -1
+                if self.total_count > -1:
+                    max_items = self.total_count - self.returned_count
+                self.prefetcher = PagePrefetcher(self.request_fun,
+                                                 self.response_field,
+                                                 self.max_offset_threshold,
+                                                 self.next_page_params,
+                                                 max_pages=self.prefetch,
+                                                 max_items=max_items)
+                self.prefetcher.start()
+            page = self.prefetcher.get()
+            if page is not None:
+                return page
+            # the prefetcher stopped early, e.g. because duplicates were dropped: continue synchronously
+
         # call CT
         logger.debug("call params " + str(self.next_page_params))
-        response = self.request_fun(self.endpoint_url,
-                                    self.next_page_params)
+        response = self.request_fun(self.next_page_params)
+        return response, get_next_page_params(response, self.response_field, self.max_offset_threshold)
+
+    def _fetch_next_response(self):
+        response, next_page_params = self._fetch_page()
+        self._ingest_response(response, next_page_params)
+
+    def _ingest_response(self, response, next_page_params):
         self.response = response
 
         # update results
-        if ('result' not in response) or (self.response_field not in response['result']) or (
-                len(response['result'][self.response_field]) == 0):
+        results = get_response_items(response, self.response_field)
+        if len(results) == 0:
             logger.debug('no results returned')
             self.next_page = None
             self.previous_page = None
@@ -172,46 +561,33 @@ class Paginator:
             self.next_page_params = dict()
             return
 
-        new_ids_to_cache = list()
-        for result in response['result'][self.response_field]:
+        for result in results:
             # check for duplicates
             try:
                 result_id = self.endpoint.get_response_item_id(result)
-                if result_id not in self.cached_ids:
-                    self.current_results.append(result)
-                    new_ids_to_cache.append(result_id)
+                if self.cached_ids.seen(result_id):
+                    continue
             except NotImplementedError:
-                self.current_results.append(result)
-        if len(new_ids_to_cache):
-            self.cached_ids.extend(new_ids_to_cache)
+                pass
+            if self.projection is not None:
+                result = project(result, self.projection)
+            self.current_results.append(result)
 
         # update pagination information
         pagination = defaultdict(lambda: None)
         if 'pagination' in response['result']:
             pagination.update(response["result"]['pagination'])
         self.next_page = pagination['nextPage']
-        self.previous_page = pagination['nextPage']
+        self.previous_page = pagination['previousPage']
 
         # update current offset and end date
-        logger.debug("next page: {}".format(self.next_page))
-        self.next_page_params = defaultdict(lambda: None)
-        if self.next_page:
-            self.next_page_params.update(parse_qs(urlparse(self.next_page).query))
-            # if offset overflows
-            if int(self.next_page_params['offset'][0]) > self.max_offset_threshold:
-                # if sorting by date, retract endDate, reset offset
-                # (does not apply to leaderboard, which can't sortBy date)
-                if self.next_page_params['sortBy'] == ["date"]:
-                    self.next_page_params['offset'] = 0
-                    end_date = date_parse(self.current_results[-1]['date'])
-                    self.next_page_params['endDate'] = end_date.strftime('%Y-%m-%dT%H:%M:%S')
-        else:
+        if next_page_params is None:
             self.has_next_page = False
-        # make it a regular dictionary
-        self.next_page_params = dict(self.next_page_params)
+            next_page_params = dict()
+        self.next_page_params = next_page_params
         logger.debug(str(self.next_page_params))
 
-    def __is_spent(self):
+    def _is_spent(self):
         if -1 < self.total_count <= self.returned_count:  # returned all of the items requested
             return True
         elif len(self.current_results) > 0:  # not returned all cached results
@@ -221,16 +597,287 @@ class Paginator:
         return False
 
     def __next__(self):
-        if self.__is_spent():
+        if self._is_spent():
+            self.close()
             raise StopIteration
         if not len(self.current_results):
-            self.__fetch_next_response()
-        if self.__is_spent():
+            self._fetch_next_response()
+            # the page and the ids it adds for deduplication are saved before any of its items is returned
+            self.save_checkpoint()
+        if self._is_spent():
             # may have fetched no results
+            self.close()
             raise StopIteration
+        return self._pop_result()
+
+    def _pop_result(self):
         self.returned_count += 1
+        result = self.current_results.popleft()
+        if self.compact_history is not None:
+            result = compact_history(result, self.compact_history)
+        if self.intern_accounts is not None:
+            result = self.account_table.intern(result, self.intern_accounts, record_class=self.record_class)
+        if self.record_class is not None:
+            result = self.record_class.from_dict(result)
+        return result
+
+    def to_arrays(self, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Consumes the items left into numpy arrays, a chunk of items at a time (see frames.to_arrays).
 
-        return self.current_results.popleft()
+        Args:
+            columns: (list or dict, default None) dotted paths of the fields to build columns of, e.g.
+                    ["id", "statistics.actual.likeCount"], or dict mapping them to their type (int64, float64,
+                    object). If None, interaction counts and main fields (see frames.get_default_columns)
+            chunk_size: (int, default 10000) number of items converted at a time
+
+        Returns:
+        dict mapping each column to a numpy array, with a row per item
+        """
+        return to_arrays(self, get_column_types(self.endpoint, columns), chunk_size=chunk_size)
+
+    def to_frame(self, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Returns:
+        pandas.DataFrame with a row per item left, and the columns built by to_arrays
+        """
+        return to_frame(self, get_column_types(self.endpoint, columns), chunk_size=chunk_size)
 
     def __iter__(self):
         return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self._stop_prefetcher()
+        # records the items of the current page returned so far, e.g. when the loop was left with break
+        if getattr(self, 'checkpoint', None) is not None:
+            self.save_returned_count()
+
+    def _stop_prefetcher(self):
+        if getattr(self, 'prefetcher', None) is not None:
+            self.prefetcher.stop()
+
+    def close(self):
+        """Stops fetching pages in the background, if prefetching, and saves the checkpoint, if any."""
+        self._stop_prefetcher()
+        self.save_checkpoint()
+
+
+class ShardedPaginator:
+    """Crawls a date-sorted query by splitting [startDate, endDate] into contiguous time windows, which are crawled
+    concurrently, each by its own Paginator in a background thread. Results are merged into a single stream ordered by
+    date (most recent first, as returned by crowdtangle). Windows share the ids cached for deduplication, so that items
+    at the boundaries between windows are returned once, and the accounts table, if interning.
+    All windows go through the same endpoint, hence share its rate limits. When a count is set, older windows are only
+    crawled once the windows before them have returned fewer items than are left to return, so that no rate budget is
+    spent on items that would be dropped."""
+    _DONE = object()
+
+    def __init__(self, endpoint, shards, max_cached_ids=None, buffer_size=10000, dedup_mode=None, fields=None,
+                 records=False, intern_accounts=None, account_table=None, compact_history=None, dedup_options=None,
+                 **paginator_options):
+        """
+        Args:
+            endpoint: (Endpoint) endpoint to query; its args must sort by date and set a startDate
+            shards: (int) number of time windows to crawl concurrently
+            max_cached_ids: (int, default None) number of recent ids to remember when deduplicating. If None, as set
+                    for the endpoint
+            buffer_size: (int, default 10000) maximum number of items buffered per window ahead of the consumer
+            dedup_mode: (lru, bloom, default None) how ids are remembered. If None, as set for the endpoint
+            fields: (list of str, default None) fields of the items to keep, as dotted paths, projected by each window
+                    as soon as a page is fetched
+            records: (bool or subclass of records.Record, default False) return items as compact records
+            intern_accounts: (shared, ids, default None) deduplicate the accounts embedded in items by account id
+            account_table: (interning.AccountTable, default None) table collecting the interned accounts of all the
+                    windows
+            compact_history: (arrays, compressed, default None) store the history of items as delta-encoded arrays
+            dedup_options: (dict, default None) arguments to dedup.create_id_cache (see Paginator)
+            paginator_options: further arguments passed to the Paginator of each window
+        """
+        if endpoint.args.get('sortBy') != 'date':
+            raise ValueError("sharding requires sortBy='date'")
+        if endpoint.args.get('startDate') is None:
+            raise ValueError("sharding requires a startDate")
+        if paginator_options.get('checkpoint') is not None or paginator_options.get('resume_from') is not None:
+            raise ValueError("checkpoints are not supported when sharding")
+        self.endpoint = endpoint
+        self.cached_ids = SharedIdCache(create_id_cache(**get_dedup_options(endpoint, max_cached_ids, dedup_mode,
+                                                                            dedup_options)))
+        if intern_accounts is not None and account_table is None:
+            account_table = AccountTable()
+        self.account_table = account_table
+        self.total_count = endpoint.args.get('count', -1)
+        self.returned_count = 0
+
+        start_date = date_parse(endpoint.args['startDate'])
+        if endpoint.args.get('endDate') is None:
+            end_date = datetime.utcnow()
+        else:
+            end_date = date_parse(endpoint.args['endDate'])
+        if end_date <= start_date:
+            raise ValueError("startDate must be before endDate")
+        window = (end_date - start_date) / shards
+        boundaries = [start_date + window * n for n in range(shards)] + [end_date]
+
+        self.buffer_size = buffer_size
+        self.shard_paginators = list()
+        self.shard_queues = list()
+        self.shard_threads = list()
+        self._stopped = Event()
+        # most recent window first
+        for shard_start, shard_end in reversed(list(zip(boundaries[:-1], boundaries[1:]))):
+            shard_endpoint = endpoint.with_args(startDate=shard_start.strftime('%Y-%m-%dT%H:%M:%S'),
+                                                endDate=shard_end.strftime('%Y-%m-%dT%H:%M:%S'),
+                                                )
+            self.shard_paginators.append(self._new_shard_paginator(shard_endpoint, fields=fields, records=records,
+                                                                   intern_accounts=intern_accounts,
+                                                                   account_table=account_table,
+                                                                   compact_history=compact_history,
+                                                                   id_cache=self.cached_ids,
+                                                                   **paginator_options))
+        self.current_shard = 0
+        # items of the current window returned by the merged stream
+        self.current_shard_count = 0
+        self._started = False
+
+    def _new_shard_paginator(self, endpoint, **paginator_options):
+        return Paginator(endpoint, **paginator_options)
+
+    @classmethod
+    def _crawl_shard(cls, paginator, shard_queue, stopped):
+        # does not reference the ShardedPaginator, so that it can be garbage collected (and stop the threads)
+        # when the consumer abandons it
+        try:
+            for result in paginator:
+                if not cls._put(shard_queue, (result, None), stopped):
+                    break
+        except Exception as e:
+            cls._put(shard_queue, (None, e), stopped)
+        finally:
+            paginator.close()
+        cls._put(shard_queue, cls._DONE, stopped)
+
+    @staticmethod
+    def _put(shard_queue, item, stopped):
+        while not stopped.is_set():
+            try:
+                shard_queue.put(item, timeout=ONE_SECOND)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _start(self):
+        self._started = True
+        self._start_shards()
+
+    def _start_shard(self, paginator):
+        shard_queue = Queue(maxsize=self.buffer_size)
+        thread = Thread(target=self._crawl_shard, args=(paginator, shard_queue, self._stopped), daemon=True)
+        self.shard_queues.append(shard_queue)
+        self.shard_threads.append(thread)
+        thread.start()
+
+    def _is_crawling(self, shard):
+        return self.shard_threads[shard].is_alive()
+
+    def _get_missing_count(self):
+        """
+        Returns:
+        number of items left to return that the windows started so far will not return
+        """
+        pending_count = sum(paginator.returned_count for paginator in
+                            self.shard_paginators[self.current_shard:len(self.shard_queues)])
+        return self.total_count - self.returned_count - pending_count + self.current_shard_count
+
+    def _start_shards(self):
+        """Starts crawling all the windows, or, if a count is set, the next window once those started so far are done
+        and have returned fewer items than are left to return, asking it for just the missing items"""
+        while len(self.shard_queues) < len(self.shard_paginators):
+            paginator = self.shard_paginators[len(self.shard_queues)]
+            if self.total_count > -1:
+                # the windows the merged stream went past are done
+                if self.current_shard < len(self.shard_queues) and self._is_crawling(len(self.shard_queues) - 1):
+                    return
+                missing_count = self._get_missing_count()
+                if missing_count <= 0:
+                    return
+                paginator.total_count = missing_count
+            self._start_shard(paginator)
+
+    def _get_shard_item(self, item):
+        """
+        Returns:
+        the result of a window, as returned by the merged stream, or None at the end of the window
+        """
+        if item is self._DONE:
+            self.current_shard += 1
+            self.current_shard_count = 0
+            return None
+        result, exception = item
+        if exception is not None:
+            self.close()
+            raise exception
+        self.current_shard_count += 1
+        self.returned_count += 1
+        return result
+
+    def __next__(self):
+        if not self._started:
+            self._start()
+        while self.current_shard < len(self.shard_paginators):
+            if -1 < self.total_count <= self.returned_count:
+                break
+            self._start_shards()
+            if self.current_shard >= len(self.shard_queues):
+                break
+            result = self._get_shard_item(self.shard_queues[self.current_shard].get())
+            if result is not None:
+                return result
+        self.close()
+        raise StopIteration
+
+    def dedup_stats(self):
+        """
+        Returns:
+        dict with the deduplication counters of the merged stream (see Paginator.dedup_stats)
+        """
+        return self.cached_ids.stats()
+
+    def to_arrays(self, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Consumes the merged items left into numpy arrays, a chunk of items at a time (see Paginator.to_arrays).
+
+        Returns:
+        dict mapping each column to a numpy array, with a row per item
+        """
+        return to_arrays(self, get_column_types(self.endpoint, columns), chunk_size=chunk_size)
+
+    def to_frame(self, columns=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Returns:
+        pandas.DataFrame with a row per item left, and the columns built by to_arrays
+        """
+        return to_frame(self, get_column_types(self.endpoint, columns), chunk_size=chunk_size)
+
+    def __iter__(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Stops crawling all time windows."""
+        if getattr(self, '_stopped', None) is not None:
+            self._stopped.set()
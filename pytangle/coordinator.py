@@ -0,0 +1,68 @@
+# Copyright (C) 2020 Mattia Samory
+
+"""Rate limit coordinator: a small daemon holding the token buckets of all the workers that connect to it, so that
+processes on one or several hosts share a single budget per token. Workers connect via CoordinatorBackend, e.g.
+API(rate_limit_backend=dict(type="coordinator", host="10.0.0.1")).
+
+Run it with:
+    python -m pytangle.coordinator --host 0.0.0.0 --port 47215
+"""
+
+import json
+import optparse
+import socketserver
+
+from pytangle.ratelimiting import LocalBackend, RateLimit, DEFAULT_COORDINATOR_PORT
+
+import logging
+
+logger = logging.getLogger()
+
+ALLOWED_METHODS = ('try_acquire', 'record_success', 'record_rate_limited', 'status')
+
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    """Answers newline-delimited json requests {"key", "rate_limit", "method", "args"} with {"result"} or {"error"}"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode('utf-8'))
+                if request['method'] not in ALLOWED_METHODS:
+                    raise ValueError("unknown method {}".format(request['method']))
+                rate_limit = RateLimit(*request['rate_limit'])
+                bucket = self.server.backend.get_bucket(request['key'], rate_limit)
+                answer = dict(result=getattr(bucket, request['method'])(*request.get('args', list())))
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error("invalid request {}: {}".format(line, e))
+                answer = dict(error=str(e))
+            self.wfile.write(json.dumps(answer).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class RateLimitCoordinator(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_COORDINATOR_PORT):
+        super().__init__((host, port), CoordinatorHandler)
+        self.backend = LocalBackend()
+
+
+def main():
+    usage = "example usage: python -m pytangle.coordinator --host 0.0.0.0 --port 47215"
+    parser = optparse.OptionParser(usage)
+    parser.add_option("--host", dest="host", default='127.0.0.1',
+                      help="address to listen on; use 0.0.0.0 to accept workers from other hosts")
+    parser.add_option("-p", "--port", dest="port", default=DEFAULT_COORDINATOR_PORT, type='int',
+                      help="port to listen on")
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with RateLimitCoordinator(options.host, options.port) as server:
+        logger.info("rate limit coordinator listening on {}:{}".format(options.host, options.port))
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# Copyright (C) 2020 Mattia Samory
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+ORJSON = 'orjson'
+UJSON = 'ujson'
+STDLIB_JSON = 'json'
+
+
+def decode_orjson(content):
+    return orjson.loads(content)
+
+
+def decode_ujson(content):
+    return ujson.loads(content)
+
+
+def decode_stdlib_json(content):
+    return json.loads(content.decode('utf-8'))
+
+
+DECODERS = {ORJSON: decode_orjson, UJSON: decode_ujson, STDLIB_JSON: decode_stdlib_json}
+
+
+def available_decoders():
+    """
+    Returns:
+    names of the installed json parsers, fastest first
+    """
+    installed = dict(orjson=orjson is not None, ujson=ujson is not None, json=True)
+    return [name for name in (ORJSON, UJSON, STDLIB_JSON) if installed[name]]
+
+
+_decoder = DECODERS[available_decoders()[0]]
+
+
+def get_decoder(name=None):
+    """
+    Args:
+        name: (orjson, ujson, json, default None) name of the parser; if None, the fastest installed one
+
+    Returns:
+    function parsing a response body (bytes) with the parser
+    """
+    if name is None:
+        name = available_decoders()[0]
+    if name not in available_decoders():
+        raise ValueError("json parser not installed: {}. Available: {}".format(name, ", ".join(available_decoders())))
+    return DECODERS[name]
+
+
+def set_decoder(name=None):
+    """
+    Selects the default parser of crowdtangle responses in the process (see decode). API instances with a parser of
+    their own (the "json_decoder" field of their configuration) are not affected.
+
+    Args:
+        name: (orjson, ujson, json, default None) name of the parser; if None, the fastest installed one
+    """
+    global _decoder
+    _decoder = get_decoder(name)
+
+
+def no_decoding(content):
+    """Leaves the response body as bytes, e.g. to cache it"""
+    return content
+
+
+def decode(content):
+    """
+    Parses a response body (bytes, utf-8) directly, without decoding it to str first when the parser allows it.
+
+    Raises:
+    ValueError if the content is not valid json
+    """
+    return _decoder(content)
@@ -0,0 +1,257 @@
+# Copyright (C) 2020 Mattia Samory
+
+import base64
+import hashlib
+import math
+from collections import OrderedDict
+from threading import Lock
+
+LRU = 'lru'
+BLOOM = 'bloom'
+
+DEFAULT_MAX_CACHED_IDS = 10000
+DEFAULT_ERROR_RATE = 0.001
+
+
+class IdCache:
+    """Remembers the ids of recently returned items, to drop duplicates (e.g. at offset boundaries and endDate
+    roll-backs). Counts how many items were dropped as duplicates (hits) and how many were new (misses)."""
+    mode = None
+
+    def __init__(self, max_cached_ids=DEFAULT_MAX_CACHED_IDS):
+        self.max_cached_ids = max_cached_ids
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, item_id):
+        raise NotImplementedError
+
+    def add(self, item_id):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def seen(self, item_id):
+        """
+        Checks whether the id was seen recently, and remembers it.
+
+        Returns:
+        True if the item is a duplicate
+        """
+        if item_id in self:
+            self.hits += 1
+            return True
+        self.misses += 1
+        self.add(item_id)
+        return False
+
+    def stats(self):
+        return dict(mode=self.mode, max_cached_ids=self.max_cached_ids, hits=self.hits, misses=self.misses)
+
+    def get_state(self):
+        """
+        Returns:
+        json-serializable representation of the cached ids
+        """
+        raise NotImplementedError
+
+    def set_state(self, state):
+        raise NotImplementedError
+
+
+class LRUIdCache(IdCache):
+    """Exact cache of the max_cached_ids most recently seen ids, with O(1) lookups"""
+    mode = LRU
+
+    def __init__(self, max_cached_ids=DEFAULT_MAX_CACHED_IDS):
+        super().__init__(max_cached_ids)
+        self._ids = OrderedDict()
+
+    def __contains__(self, item_id):
+        if item_id in self._ids:
+            self._ids.move_to_end(item_id)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def add(self, item_id):
+        self._ids[item_id] = None
+        self._ids.move_to_end(item_id)
+        while len(self._ids) > self.max_cached_ids:
+            self._ids.popitem(last=False)
+
+    def clear(self):
+        self._ids.clear()
+
+    def get_state(self):
+        return list(self._ids)
+
+    def set_state(self, state):
+        if not isinstance(state, list):
+            raise ValueError("the checkpoint was saved with a different deduplication mode")
+        self.clear()
+        for item_id in state:
+            self.add(item_id)
+
+
+class BloomFilter:
+    """Set membership in a fixed number of bits: no false negatives, false positives at about error_rate when holding
+    capacity items"""
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, item_id):
+        """
+        Returns:
+        the positions of the bits set for the item, which are the same across filters of equal capacity and error rate
+        """
+        digest = hashlib.blake2b(str(item_id).encode('utf-8'), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], 'little')
+        second_hash = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(first_hash + n * second_hash) % size for n in range(self.hash_count)]
+
+    def has_positions(self, positions):
+        bits = self.bits
+        for position in positions:
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add_positions(self, positions):
+        bits = self.bits
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item_id):
+        return self.has_positions(self.positions(item_id))
+
+    def add(self, item_id):
+        self.add_positions(self.positions(item_id))
+
+    def get_state(self):
+        return dict(count=self.count, bits=base64.b64encode(bytes(self.bits)).decode('ascii'))
+
+    def set_state(self, state):
+        bits = base64.b64decode(state['bits'])
+        if len(bits) != len(self.bits):
+            raise ValueError("the checkpoint was saved with a different deduplication window")
+        self.bits = bytearray(bits)
+        self.count = state['count']
+
+
+class BloomIdCache(IdCache):
+    """Approximate cache of the most recently seen ids, in constant memory (about 1.8MB per million ids at the default
+    error rate). Ids are kept in two generations of max_cached_ids each: when the current generation is full, the
+    oldest one is forgotten. Hence, between max_cached_ids and twice as many recent ids are remembered. A new item is
+    wrongly dropped as a duplicate with probability of about error_rate."""
+    mode = BLOOM
+
+    def __init__(self, max_cached_ids=DEFAULT_MAX_CACHED_IDS, error_rate=DEFAULT_ERROR_RATE):
+        super().__init__(max_cached_ids)
+        self.error_rate = error_rate
+        self._current = BloomFilter(max_cached_ids, error_rate)
+        self._previous = BloomFilter(max_cached_ids, error_rate)
+
+    def __contains__(self, item_id):
+        positions = self._current.positions(item_id)
+        return self._current.has_positions(positions) or self._previous.has_positions(positions)
+
+    def add(self, item_id):
+        self._add_positions(self._current.positions(item_id))
+
+    def _add_positions(self, positions):
+        if self._current.count >= self.max_cached_ids:
+            self._previous = self._current
+            self._current = BloomFilter(self.max_cached_ids, self.error_rate)
+        self._current.add_positions(positions)
+
+    def seen(self, item_id):
+        # hashes the id once, for both lookup and insertion
+        positions = self._current.positions(item_id)
+        if self._current.has_positions(positions) or self._previous.has_positions(positions):
+            self.hits += 1
+            return True
+        self.misses += 1
+        self._add_positions(positions)
+        return False
+
+    def clear(self):
+        self._current = BloomFilter(self.max_cached_ids, self.error_rate)
+        self._previous = BloomFilter(self.max_cached_ids, self.error_rate)
+
+    def get_state(self):
+        return dict(current=self._current.get_state(), previous=self._previous.get_state())
+
+    def set_state(self, state):
+        if not isinstance(state, dict):
+            raise ValueError("the checkpoint was saved with a different deduplication mode")
+        self._current.set_state(state['current'])
+        self._previous.set_state(state['previous'])
+
+
+class SharedIdCache:
+    """Id cache shared by paginators crawling concurrently, e.g. the time windows of a ShardedPaginator, so that each
+    item is checked once across all of them. Ids are checked and remembered under a lock."""
+
+    def __init__(self, id_cache):
+        self.id_cache = id_cache
+        self._lock = Lock()
+
+    @property
+    def mode(self):
+        return self.id_cache.mode
+
+    def __contains__(self, item_id):
+        with self._lock:
+            return item_id in self.id_cache
+
+    def add(self, item_id):
+        with self._lock:
+            self.id_cache.add(item_id)
+
+    def clear(self):
+        with self._lock:
+            self.id_cache.clear()
+
+    def seen(self, item_id):
+        with self._lock:
+            return self.id_cache.seen(item_id)
+
+    def stats(self):
+        with self._lock:
+            return self.id_cache.stats()
+
+    def get_state(self):
+        with self._lock:
+            return self.id_cache.get_state()
+
+    def set_state(self, state):
+        with self._lock:
+            self.id_cache.set_state(state)
+
+
+def create_id_cache(max_cached_ids=DEFAULT_MAX_CACHED_IDS, mode=LRU, error_rate=DEFAULT_ERROR_RATE):
+    """
+    Args:
+        max_cached_ids: (int, default 10000) number of recent ids to remember
+        mode: (lru, bloom, default lru) exact LRU set, or memory-compact Bloom filters for windows of millions of ids
+        error_rate: (float, default 0.001) probability of dropping a new item, in bloom mode
+    """
+    if mode == LRU:
+        return LRUIdCache(max_cached_ids)
+    elif mode == BLOOM:
+        return BloomIdCache(max_cached_ids, error_rate)
+    raise ValueError("unknown deduplication mode: {}".format(mode))
@@ -1,14 +1,30 @@
 # Copyright (C) 2020 Mattia Samory
 
 from abc import ABC
-from copy import deepcopy
+from copy import copy, deepcopy
+from functools import partial
 
-from pytangle.connectivity import make_request_1_every_10s, make_request_1_every_30s, make_request
+from pytangle.connectivity import ONE_MINUTE
+from pytangle.decoding import decode, no_decoding
+from pytangle.dedup import DEFAULT_MAX_CACHED_IDS, LRU
+from pytangle.ratelimiting import RateLimit, override_rate_limit
+from pytangle.rawjson import split_response
+from pytangle.records import Account, AccountStatistics, Post
+from pytangle.tokens import get_token_pool
+from pytangle.utils import remove_null_values_from_dict
 
 
 class Endpoint(ABC):
-    def __init__(self, args):
+    _rate_limit = None
+    _dedup_options = dict(max_cached_ids=DEFAULT_MAX_CACHED_IDS, mode=LRU)
+
+    def __init__(self, args, session=None, token_pool=None, response_cache=None, json_decoder=None):
         self.args = deepcopy(args)
+        self.session = session
+        self.token_pool = token_pool
+        self.response_cache = response_cache
+        # function parsing responses (see decoding.get_decoder); if None, decoding.decode
+        self.json_decoder = json_decoder
         if self.has_endpoint_parameter_name():
             endpoint_parameter_name = self.get_endpoint_parameter_name()
             self.endpoint_parameter = self.args.pop(endpoint_parameter_name)
@@ -44,30 +60,113 @@ class Endpoint(ABC):
         return 10000
 
     @classmethod
-    def request_function(cls):
-        raise NotImplementedError
+    def rate_limit(cls):
+        """
+        Returns:
+        RateLimit allowed by crowdtangle for each token, or None if the endpoint is not rate limited
+        """
+        return cls._rate_limit
+
+    @classmethod
+    def set_rate_limit(cls, calls=None, period=None, burst=None):
+        """
+        Changes the rate limit of the endpoint and of its subclasses, e.g. to allow for the budget of a token with
+        increased limits, or to reduce bursts. Values that are not passed are left unchanged. This applies to all the
+        API instances of the process, unless overridden for their token pool (see TokenPool.set_rate_limit).
+        """
+        cls._rate_limit = override_rate_limit(cls.rate_limit(), calls=calls, period=period, burst=burst)
+
+    def get_rate_limit(self):
+        """
+        Returns:
+        RateLimit of the calls made by this endpoint: as overridden for its token pool, if any, or else rate_limit()
+        """
+        if self.token_pool is None:
+            return self.rate_limit()
+        return self.token_pool.get_rate_limit(type(self))
+
+    @classmethod
+    def dedup_options(cls):
+        """
+        Returns:
+        dict of arguments to dedup.create_id_cache, used by paginators to drop duplicate items
+        """
+        return dict(cls._dedup_options)
+
+    @classmethod
+    def set_dedup_options(cls, max_cached_ids=None, mode=None, error_rate=None):
+        """
+        Changes how many recent ids paginators over this endpoint (and its subclasses) remember to drop duplicates,
+        and how (see dedup.create_id_cache). Values that are not passed are left unchanged. This applies to all the
+        API instances of the process, unless overridden in their configuration (see API.get_dedup_options).
+        """
+        dedup_options = cls.dedup_options()
+        dedup_options.update(remove_null_values_from_dict(dict(max_cached_ids=max_cached_ids,
+                                                               mode=mode,
+                                                               error_rate=error_rate)))
+        cls._dedup_options = dedup_options
 
     @classmethod
     def get_response_item_id(cls, response_item):
         raise NotImplementedError
 
+    @classmethod
+    def get_record_class(cls):
+        """
+        Returns:
+        the subclass of records.Record representing the items returned by the endpoint
+        """
+        raise NotImplementedError
+
+    def get_decoder(self, raw=False):
+        """
+        Returns:
+        function parsing the body of a response: fully, or, if raw, slicing the items out of it
+        (see rawjson.split_response), with the json parser of the endpoint
+        """
+        json_decoder = decode if self.json_decoder is None else self.json_decoder
+        if raw:
+            return partial(split_response, response_field=self.get_response_field_name(), decoder=json_decoder)
+        return json_decoder
+
+    def request(self, params, raw=False):
+        decoder = self.get_decoder(raw)
+        if self.response_cache is not None:
+            content = self.response_cache.get(type(self).__name__, self.get_endpoint_url(), params)
+            if content is not None:
+                return decoder(content)
+        token_pool = self.token_pool
+        if token_pool is None:
+            token_pool = get_token_pool(params.get('token'))
+        if self.response_cache is None:
+            return token_pool.request(self.get_rate_limit(), self.get_endpoint_url(), params, session=self.session,
+                                      decoder=decoder)
+        content = token_pool.request(self.get_rate_limit(), self.get_endpoint_url(), params, session=self.session,
+                                     decoder=no_decoding)
+        self.response_cache.set(type(self).__name__, self.get_endpoint_url(), params, content)
+        return decoder(content)
+
+    def with_args(self, **args):
+        """
+        Returns:
+        a copy of this endpoint, sharing its session, where args are updated with the values passed
+        """
+        endpoint = copy(self)
+        endpoint.args = deepcopy(self.args)
+        endpoint.args.update(args)
+        return endpoint
+
 
 class Endpoint6CPM(Endpoint, ABC):
-    @classmethod
-    def request_function(cls):
-        return make_request_1_every_10s
+    _rate_limit = RateLimit(calls=6, period=ONE_MINUTE, burst=6)
 
 
 class Endpoint2CPM(Endpoint, ABC):
-    @classmethod
-    def request_function(cls):
-        return make_request_1_every_30s
+    _rate_limit = RateLimit(calls=2, period=ONE_MINUTE, burst=2)
 
 
 class EndpointOneShotCall(Endpoint, ABC):
-    @classmethod
-    def request_function(cls):
-        return make_request
+    _rate_limit = None
 
 
 class ListsEndpoint(EndpointOneShotCall):
@@ -97,6 +196,10 @@ class PostsEndpoint(Endpoint6CPM):
     def get_response_item_id(cls, response_item):
         return response_item['id']
 
+    @classmethod
+    def get_record_class(cls):
+        return Post
+
 
 class LinksEndpoint(Endpoint2CPM):
     @classmethod
@@ -111,6 +214,10 @@ class LinksEndpoint(Endpoint2CPM):
     def get_response_item_id(cls, response_item):
         return response_item['id']
 
+    @classmethod
+    def get_record_class(cls):
+        return Post
+
 
 class LeaderboardEndpoint(Endpoint6CPM):
     @classmethod
@@ -125,6 +232,10 @@ class LeaderboardEndpoint(Endpoint6CPM):
     def get_response_item_id(cls, response_item):
         return response_item['account']['id']
 
+    @classmethod
+    def get_record_class(cls):
+        return AccountStatistics
+
 
 class SearchEndpoint(Endpoint6CPM):
     @classmethod
@@ -139,6 +250,10 @@ class SearchEndpoint(Endpoint6CPM):
     def get_response_item_id(cls, response_item):
         return response_item['id']
 
+    @classmethod
+    def get_record_class(cls):
+        return Post
+
 
 class AccountsEndpoint(Endpoint6CPM):
     @classmethod
@@ -157,10 +272,15 @@ class AccountsEndpoint(Endpoint6CPM):
     def get_response_item_id(cls, response_item):
         return response_item['id']
 
+    @classmethod
+    def get_record_class(cls):
+        return Account
+
 
 class PostEndpoint(EndpointOneShotCall):
-    def __init__(self, endpoint, args):
-        super().__init__(args)
+    def __init__(self, endpoint, args, session=None, token_pool=None, response_cache=None, json_decoder=None):
+        super().__init__(args, session=session, token_pool=token_pool, response_cache=response_cache,
+                         json_decoder=json_decoder)
         self.endpoint = endpoint
 
     def get_endpoint_template(self):
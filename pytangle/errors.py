@@ -0,0 +1,137 @@
+# Copyright (C) 2020 Mattia Samory
+
+from datetime import datetime
+
+import requests
+from dateutil.parser import parse as date_parse
+
+
+def get_retry_after(headers):
+    """
+    Args:
+        headers: (dict-like) headers of the response
+
+    Returns:
+    the number of seconds to wait before retrying, as requested in the Retry-After header, or None
+    """
+    if headers is None or 'Retry-After' not in headers:
+        return None
+    retry_after = headers['Retry-After']
+    try:
+        return max(0., float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_date = date_parse(retry_after)
+        return max(0., (retry_date - datetime.now(retry_date.tzinfo)).total_seconds())
+    except (ValueError, OverflowError):
+        return None
+
+
+class CrowdTangleError(requests.exceptions.HTTPError):
+    """Error returned by crowdtangle. Subclasses of HTTPError, so that existing handlers of requests errors keep
+    working. `retryable` tells whether the same call may succeed if retried later."""
+    retryable = False
+
+    def __init__(self, http_status, error_details=None, retry_after=None, response=None):
+        """
+        Args:
+            http_status: (int) HTTP status of the response
+            error_details: (dict, default None) error details returned by crowdtangle (code, message, ...)
+            retry_after: (float, default None) seconds to wait before retrying, as requested by crowdtangle
+            response: (requests.Response, default None) the failed response
+        """
+        error_details = dict(error_details or dict())
+        self.http_status = http_status
+        self.code = error_details.get('code')
+        self.error_message = error_details.get('message')
+        self.error_details = error_details
+        self.retry_after = retry_after
+        super().__init__("HTTP {}, crowdtangle error code {}: {}".format(http_status, self.code, self.error_message),
+                         response=response)
+
+
+class ClientError(CrowdTangleError):
+    """4XX error: the call is not valid"""
+
+
+class ServerError(CrowdTangleError):
+    """5XX error: crowdtangle failed to answer"""
+    retryable = True
+
+
+class ParameterError(ClientError):
+    """The parameters of the call are not valid"""
+
+
+class UnknownParameterError(ParameterError):
+    """crowdtangle error code 20"""
+
+
+class IllegalParameterValueError(ParameterError):
+    """crowdtangle error code 21"""
+
+
+class MissingParameterError(ParameterError):
+    """crowdtangle error code 22"""
+
+
+class TokenError(ClientError):
+    """The call failed because of its token: it may succeed with another token"""
+
+
+class RateLimitError(TokenError):
+    """HTTP 429: the rate limit of the token was exceeded"""
+    retryable = True
+
+
+class MissingTokenError(TokenError):
+    """crowdtangle error code 30"""
+
+
+class InvalidTokenError(TokenError):
+    """crowdtangle error code 31"""
+
+
+class NotFoundError(ClientError):
+    """crowdtangle error code 40: the requested object does not exist"""
+
+
+class NotAllowedError(ClientError):
+    """crowdtangle error code 41: the token is not allowed to access the requested object"""
+
+
+ERROR_CODES = {
+    20: UnknownParameterError,
+    21: IllegalParameterValueError,
+    22: MissingParameterError,
+    30: MissingTokenError,
+    31: InvalidTokenError,
+    40: NotFoundError,
+    41: NotAllowedError,
+}
+
+
+def create_error(http_status, error_details=None, headers=None, response=None):
+    """
+    Args:
+        http_status: (int) HTTP status of the failed response
+        error_details: (dict, default None) error details returned by crowdtangle
+        headers: (dict-like, default None) headers of the failed response
+        response: (requests.Response, default None) the failed response
+
+    Returns:
+    the CrowdTangleError matching the status and crowdtangle error code
+    """
+    code = (error_details or dict()).get('code')
+    if http_status == 429:
+        error_class = RateLimitError
+    elif code in ERROR_CODES:
+        error_class = ERROR_CODES[code]
+    elif 400 <= http_status < 500:
+        error_class = ClientError
+    elif http_status >= 500:
+        error_class = ServerError
+    else:
+        error_class = CrowdTangleError
+    return error_class(http_status, error_details, retry_after=get_retry_after(headers), response=response)
@@ -0,0 +1,181 @@
+# Copyright (C) 2020 Mattia Samory
+
+from itertools import islice
+
+from pytangle.records import Account, AccountStatistics, Interactions, Post
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+DEFAULT_CHUNK_SIZE = 10000
+
+INTEGER = 'int64'
+FLOAT = 'float64'
+OBJECT = 'object'
+
+# values of missing fields, by type of column
+MISSING_VALUES = {INTEGER: 0, FLOAT: float('nan'), OBJECT: None}
+
+POST_COLUMNS = dict([('id', OBJECT),
+                     ('date', OBJECT),
+                     ('type', OBJECT),
+                     ('account.id', INTEGER),
+                     ('subscriberCount', INTEGER),
+                     ('score', FLOAT)] +
+                    [('statistics.actual.' + count, INTEGER) for count in Interactions._fields] +
+                    [('statistics.expected.' + count, INTEGER) for count in Interactions._fields])
+
+ACCOUNT_STATISTICS_COLUMNS = dict([('account.id', INTEGER),
+                                   ('account.handle', OBJECT),
+                                   ('subscriberData.initialCount', INTEGER),
+                                   ('subscriberData.finalCount', INTEGER),
+                                   ('summary.postCount', INTEGER),
+                                   ('summary.totalInteractionCount', INTEGER),
+                                   ('summary.interactionRate', FLOAT)] +
+                                  [('summary.' + count, INTEGER) for count in Interactions._fields])
+
+ACCOUNT_COLUMNS = dict([('id', INTEGER),
+                        ('name', OBJECT),
+                        ('handle', OBJECT),
+                        ('platform', OBJECT),
+                        ('subscriberCount', INTEGER)])
+
+DEFAULT_COLUMNS = {Post: POST_COLUMNS, AccountStatistics: ACCOUNT_STATISTICS_COLUMNS, Account: ACCOUNT_COLUMNS}
+
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError("building arrays requires numpy. Install it via `pip3 install pytangle[frames]`")
+
+
+def require_pandas():
+    if pandas is None:
+        raise ImportError("building data frames requires pandas. Install it via `pip3 install pytangle[frames]`")
+
+
+def get_default_columns(endpoint):
+    """
+    Returns:
+    dict mapping the dotted path of the columns built by default for the items of the endpoint to their type
+    """
+    try:
+        return dict(DEFAULT_COLUMNS[endpoint.get_record_class()])
+    except (NotImplementedError, KeyError):
+        raise ValueError("no default columns for {}: pass columns".format(type(endpoint).__name__))
+
+
+def get_column_types(endpoint, columns=None):
+    """
+    Args:
+        endpoint: (Endpoint) endpoint returning the items
+        columns: (list or dict, default None) dotted paths of the columns, or dict mapping them to their type (int64,
+                float64, object). Columns passed as a list have the type of the default column with the same path, if
+                any, and are object otherwise. If None, the default columns of the endpoint
+
+    Returns:
+    dict mapping the dotted path of each column to its type
+    """
+    if columns is None:
+        return get_default_columns(endpoint)
+    if isinstance(columns, dict):
+        return dict(columns)
+    try:
+        default_columns = get_default_columns(endpoint)
+    except ValueError:
+        default_columns = dict()
+    return {column: default_columns.get(column, OBJECT) for column in columns}
+
+
+def make_getter(column, missing_value):
+    keys = column.split('.')
+
+    def get_value(item):
+        try:
+            for key in keys:
+                item = item[key]
+        except (KeyError, TypeError, IndexError):
+            return missing_value
+        return missing_value if item is None else item
+
+    return get_value
+
+
+def make_getters(column_types):
+    return {column: make_getter(column, MISSING_VALUES[column_type]) for column, column_type in column_types.items()}
+
+
+def chunk_to_arrays(chunk, column_types, getters):
+    """
+    Returns:
+    dict mapping the dotted path of each column to a numpy array, with a row per item of the chunk (list)
+    """
+    arrays = dict()
+    for column, column_type in column_types.items():
+        get_value = getters[column]
+        if column_type == OBJECT:
+            array = numpy.empty(len(chunk), dtype=object)
+            for n, item in enumerate(chunk):
+                array[n] = get_value(item)
+        else:
+            array = numpy.fromiter((get_value(item) for item in chunk), dtype=column_type, count=len(chunk))
+        arrays[column] = array
+    return arrays
+
+
+def concatenate_chunks(chunks, column_types):
+    """
+    Returns:
+    dict mapping the dotted path of each column to the concatenation of its arrays in the chunks (see chunk_to_arrays)
+    """
+    return {column: numpy.concatenate([arrays[column] for arrays in chunks]) if len(chunks)
+            else numpy.empty(0, dtype=column_type)
+            for column, column_type in column_types.items()}
+
+
+def to_arrays(items, column_types, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Builds a column per field from the items, consuming them a chunk at a time: each column of a chunk is filled into
+    a preallocated typed array, and chunks are concatenated at the end. Missing counts are 0, missing floats NaN.
+
+    Args:
+        items: (iterable) items (dict, records.Record, or rawjson.RawItem)
+        column_types: (dict) dotted path of each column mapped to its type (int64, float64, object)
+        chunk_size: (int, default 10000) number of items converted at a time
+
+    Returns:
+    dict mapping the dotted path of each column to a numpy array, with a row per item
+    """
+    require_numpy()
+    getters = make_getters(column_types)
+    chunks = list()
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not len(chunk):
+            break
+        chunks.append(chunk_to_arrays(chunk, column_types, getters))
+    return concatenate_chunks(chunks, column_types)
+
+
+def arrays_to_frame(arrays, column_types):
+    """
+    Returns:
+    pandas.DataFrame with the columns built by to_arrays, in the order of column_types
+    """
+    return pandas.DataFrame(arrays, columns=list(column_types))
+
+
+def to_frame(items, column_types, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Returns:
+    pandas.DataFrame with a row per item and the columns built by to_arrays
+    """
+    require_pandas()
+    return arrays_to_frame(to_arrays(items, column_types, chunk_size=chunk_size), column_types)
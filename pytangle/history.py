@@ -0,0 +1,308 @@
+# Copyright (C) 2020 Mattia Samory
+
+import calendar
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+from threading import Lock
+
+ARRAYS = 'arrays'
+COMPRESSED = 'compressed'
+
+INTEGER = 'int'
+BOOLEAN = 'bool'
+DATE = 'date'
+FLOAT = 'float'
+OBJECT = 'object'
+# kinds of columns stored, delta-encoded, as int64
+INTEGER_KINDS = frozenset([INTEGER, BOOLEAN, DATE])
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+MAX_INTEGER = 2 ** 62
+# number of distinct column layouts shared across histories, beyond which the least recently used are forgotten
+MAX_SHARED_LAYOUTS = 1000
+
+_MISSING = object()
+# column layouts, shared by the histories with the same fields; histories are built in prefetching, sharding and
+# monitoring threads, hence the lock
+_layouts = OrderedDict()
+_layouts_lock = Lock()
+
+
+def share_layout(layout):
+    """
+    Returns:
+    the layout (tuple) equal to the one passed that is already used by other histories, if any, so that histories with
+    the same fields share it. Only the MAX_SHARED_LAYOUTS most recently used layouts are kept.
+    """
+    with _layouts_lock:
+        shared = _layouts.get(layout)
+        if shared is not None:
+            _layouts.move_to_end(layout)
+            return shared
+        _layouts[layout] = layout
+        if len(_layouts) > MAX_SHARED_LAYOUTS:
+            _layouts.popitem(last=False)
+        return layout
+
+
+def flatten_step(step, prefix=(), flat=None):
+    if flat is None:
+        flat = dict()
+    for key, value in step.items():
+        if isinstance(value, dict) and len(value):
+            flatten_step(value, prefix + (key,), flat)
+        else:
+            flat[prefix + (key,)] = value
+    return flat
+
+
+def encode_date(value):
+    try:
+        seconds = calendar.timegm(time.strptime(value, DATE_FORMAT))
+    except (TypeError, ValueError):
+        return None
+    if decode_date(seconds) != value:
+        return None
+    return seconds
+
+
+def decode_date(seconds):
+    return time.strftime(DATE_FORMAT, time.gmtime(seconds))
+
+
+def get_kind(path, values):
+    if all(type(value) is bool for value in values):
+        return BOOLEAN
+    if all(type(value) is int and -MAX_INTEGER < value < MAX_INTEGER for value in values):
+        return INTEGER
+    if all(type(value) is float for value in values):
+        return FLOAT
+    if path[-1] == 'date' and all(encode_date(value) is not None for value in values):
+        return DATE
+    return OBJECT
+
+
+def delta_encode(values):
+    previous = 0
+    for value in values:
+        yield value - previous
+        previous = value
+
+
+class CompactHistory:
+    """Timeseries of a post (its history, as returned by crowdtangle when includeHistory is set), stored as columns
+    rather than as a list of timesteps: each field of the timesteps (e.g. actual.likeCount) is a column. Integer
+    columns, including dates (as seconds) and flags, are delta-encoded into a single int64 array, floats into a single
+    float64 array, and both can be compressed. Other fields are kept as they are.
+    The history can be accessed as the list it was built from, by timestep or as a whole (to_list), or by column
+    (column)."""
+    __slots__ = ('_length', '_layout', '_integers', '_floats', '_objects', '_missing', '_compressed')
+
+    @classmethod
+    def from_list(cls, history, compress=False):
+        """
+        Args:
+            history: (list of dict) timesteps, as returned by crowdtangle
+            compress: (bool, default False) compress the arrays with zlib: smaller, but decompressed on each access
+
+        Returns:
+        the compact history
+        """
+        steps = [flatten_step(step) for step in history]
+        paths = dict()
+        for step in steps:
+            for path in step:
+                paths.setdefault(path, None)
+        layout = list()
+        integers = array('q')
+        floats = array('d')
+        objects = list()
+        missing = dict()
+        for index, path in enumerate(paths):
+            values = [step.get(path, _MISSING) for step in steps]
+            present = [value for value in values if value is not _MISSING]
+            kind = get_kind(path, present)
+            layout.append((path, kind))
+            if len(present) < len(values):
+                missing[index] = bytes(value is _MISSING for value in values)
+            if kind in INTEGER_KINDS:
+                if kind == DATE:
+                    present = [encode_date(value) for value in present]
+                # missing values repeat the previous value, so that their delta is 0
+                filled = list()
+                present = iter(present)
+                previous = 0
+                for value in values:
+                    if value is not _MISSING:
+                        previous = int(next(present))
+                    filled.append(previous)
+                integers.extend(delta_encode(filled))
+            elif kind == FLOAT:
+                floats.extend(0. if value is _MISSING else value for value in values)
+            else:
+                objects.append([None if value is _MISSING else value for value in values])
+
+        compact = cls.__new__(cls)
+        compact._length = len(steps)
+        compact._layout = share_layout(tuple(layout))
+        compact._compressed = compress
+        if compress:
+            compact._integers = zlib.compress(integers.tobytes()) if len(integers) else None
+            compact._floats = zlib.compress(floats.tobytes()) if len(floats) else None
+        else:
+            compact._integers = integers if len(integers) else None
+            compact._floats = floats if len(floats) else None
+        compact._objects = tuple(objects) if len(objects) else None
+        compact._missing = missing if len(missing) else None
+        return compact
+
+    def _get_array(self, typecode, data):
+        if data is None:
+            return array(typecode)
+        if not self._compressed:
+            return data
+        values = array(typecode)
+        values.frombytes(zlib.decompress(data))
+        return values
+
+    def _columns(self):
+        integers = self._get_array('q', self._integers)
+        floats = self._get_array('d', self._floats)
+        n = self._length
+        integer_offset = float_offset = object_offset = 0
+        for index, (path, kind) in enumerate(self._layout):
+            if kind in INTEGER_KINDS:
+                values = list(accumulate(integers[integer_offset:integer_offset + n]))
+                integer_offset += n
+                if kind == DATE:
+                    values = [decode_date(value) for value in values]
+                elif kind == BOOLEAN:
+                    values = [bool(value) for value in values]
+            elif kind == FLOAT:
+                values = floats[float_offset:float_offset + n].tolist()
+                float_offset += n
+            else:
+                values = self._objects[object_offset]
+                object_offset += 1
+            yield index, path, values
+
+    def _step(self, step):
+        integers = self._get_array('q', self._integers)
+        floats = self._get_array('d', self._floats)
+        n = self._length
+        integer_offset = float_offset = object_offset = 0
+        for index, (path, kind) in enumerate(self._layout):
+            if kind in INTEGER_KINDS:
+                value = sum(integers[integer_offset:integer_offset + step + 1])
+                integer_offset += n
+                if kind == DATE:
+                    value = decode_date(value)
+                elif kind == BOOLEAN:
+                    value = bool(value)
+            elif kind == FLOAT:
+                value = floats[float_offset + step]
+                float_offset += n
+            else:
+                value = self._objects[object_offset][step]
+                object_offset += 1
+            yield index, path, value
+
+    def _is_missing(self, index):
+        if self._missing is None or index not in self._missing:
+            return None
+        return self._missing[index]
+
+    def column(self, path):
+        """
+        Args:
+            path: (str) dotted path of a field of the timesteps, e.g. "actual.likeCount"
+
+        Returns:
+        list with the value of the field at each timestep, None where missing
+        """
+        path = tuple(path.split('.'))
+        for index, column_path, values in self._columns():
+            if column_path == path:
+                missing = self._is_missing(index)
+                if missing is None:
+                    return list(values)
+                return [None if is_missing else value for value, is_missing in zip(values, missing)]
+        raise KeyError('.'.join(path))
+
+    def fields(self):
+        """
+        Returns:
+        list of the dotted paths of the fields of the timesteps
+        """
+        return ['.'.join(path) for path, kind in self._layout]
+
+    def to_list(self):
+        """
+        Returns:
+        the history as a list of timesteps (dict), as returned by crowdtangle
+        """
+        history = [dict() for _ in range(self._length)]
+        for index, path, values in self._columns():
+            missing = self._is_missing(index)
+            for step, value in enumerate(values):
+                if missing is not None and missing[step]:
+                    continue
+                node = history[step]
+                for key in path[:-1]:
+                    node = node.setdefault(key, dict())
+                node[path[-1]] = value
+        return history
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.to_list()[index]
+        try:
+            step = range(self._length)[index]
+        except IndexError:
+            raise IndexError("history index out of range")
+        timestep = dict()
+        for index, path, value in self._step(step):
+            missing = self._is_missing(index)
+            if missing is not None and missing[step]:
+                continue
+            node = timestep
+            for key in path[:-1]:
+                node = node.setdefault(key, dict())
+            node[path[-1]] = value
+        return timestep
+
+    def __eq__(self, other):
+        if isinstance(other, CompactHistory):
+            return self.to_list() == other.to_list()
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return "CompactHistory({} timesteps, fields={})".format(self._length, self.fields())
+
+
+def compact_history(item, mode=ARRAYS):
+    """
+    Args:
+        item: (dict) item with a history, e.g. a post fetched with includeHistory
+        mode: (arrays, compressed, default arrays) whether the arrays of the history are compressed
+
+    Returns:
+    the item, with its history replaced by a CompactHistory. Items without a history are returned as they are
+    """
+    if mode not in (ARRAYS, COMPRESSED):
+        raise ValueError("unknown history compaction mode: {}".format(mode))
+    history = item.get('history')
+    if isinstance(history, list):
+        item['history'] = CompactHistory.from_list(history, compress=mode == COMPRESSED)
+    return item
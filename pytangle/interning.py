@@ -0,0 +1,71 @@
+# Copyright (C) 2020 Mattia Samory
+
+import json
+
+from pytangle.records import Record
+
+SHARED = 'shared'
+IDS = 'ids'
+
+
+class AccountTable:
+    """Accounts embedded in the items returned by crowdtangle, by account id. Interning an item replaces its account
+    either with the first copy of the account seen (shared), so that items from the same account share one object,
+    or with the account id (ids), so that items only carry the id and accounts are kept once, in the table."""
+
+    def __init__(self):
+        self.accounts = dict()
+
+    def intern(self, item, mode=SHARED, record_class=None):
+        """
+        Args:
+            item: (dict) item embedding an account, e.g. a post
+            mode: (shared, ids, default shared) how the account of the item is replaced
+            record_class: (subclass of records.Record, default None) class of the records the items are converted
+                    to, if any: accounts are then kept as records, so that records from the same account share one
+
+        Returns:
+        the item, with its account interned. Items without an account are returned as they are
+        """
+        account = item.get('account')
+        if not isinstance(account, dict) or 'id' not in account:
+            return item
+        account_id = account['id']
+        if account_id not in self.accounts:
+            if record_class is not None and 'account' in record_class._records:
+                account = record_class._records['account'].from_dict(account)
+            # setdefault, so that paginators interning into the same table from several threads share one copy
+            self.accounts.setdefault(account_id, account)
+        if mode == SHARED:
+            item['account'] = self.accounts[account_id]
+        elif mode == IDS:
+            del item['account']
+            item['accountId'] = account_id
+        else:
+            raise ValueError("unknown interning mode: {}".format(mode))
+        return item
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def __contains__(self, account_id):
+        return account_id in self.accounts
+
+    def __getitem__(self, account_id):
+        return self.accounts[account_id]
+
+    def __iter__(self):
+        return iter(self.accounts.values())
+
+    def to_dicts(self):
+        """
+        Returns:
+        list of the accounts (dict)
+        """
+        return [account.to_dict() if isinstance(account, Record) else account for account in self]
+
+    def export(self, path):
+        """Writes the accounts to a file, one json object per line"""
+        with open(path, 'w') as out_file:
+            for account in self.to_dicts():
+                out_file.write(json.dumps(account) + '\n')
@@ -0,0 +1,515 @@
+# Copyright (C) 2020 Mattia Samory
+
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from threading import Lock
+
+from dateutil.parser import parse as date_parse
+
+from pytangle.endpoints import PostsEndpoint
+
+import logging
+
+logger = logging.getLogger()
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_OVERLAP = 60 * 60
+DEFAULT_EVERY = 60 * 60
+DEFAULT_WORKERS = 4
+DEFAULT_ITEMS_PER_TURN = 100
+DEFAULT_RETRY_DELAY = 60
+DEFAULT_TARGET_LATENCY = 15 * 60
+DEFAULT_MIN_EVERY = 60
+DEFAULT_MAX_EVERY = 24 * 60 * 60
+DEFAULT_PAGE_SIZE = 100
+
+
+def hash_id(post_id):
+    """
+    Returns:
+    signed 64 bit hash of the id, as stored in the index of archived posts
+    """
+    digest = hashlib.blake2b(str(post_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def get_stream_name(list_ids=None):
+    """
+    Returns:
+    name of the stream of posts from the lists, e.g. "123,345"; "all" for posts from all the lists of the dashboard
+    """
+    if not list_ids:
+        return 'all'
+    return ','.join(sorted(str(list_id) for list_id in list_ids))
+
+
+class MonitorState:
+    """Durable state of a monitor, kept in an sqlite database so that a monitor can be restarted without losing the
+    posts published in the meantime, nor archiving the same posts twice. For each stream of posts (e.g. the posts of
+    a list), the state keeps a watermark, i.e. the date of the latest post archived; restarted monitors query again
+    from the watermark minus an overlap, to catch posts that crowdtangle indexes late. Posts already archived are
+    recognized by a 64 bit hash of their id, so that the index stays compact, and the archive is never read again.
+    Changes are saved on commit, e.g. once the posts of a scrape are written."""
+
+    def __init__(self, path, overlap=DEFAULT_OVERLAP):
+        """
+        Args:
+            path: (str) file of the state
+            overlap: (float, default 3600) seconds before the watermark from which a restarted stream is queried
+        """
+        self.path = path
+        self.overlap = overlap
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS watermarks (stream TEXT PRIMARY KEY, watermark TEXT)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS archived (hash INTEGER PRIMARY KEY)")
+        self._connection.commit()
+
+    def get_watermark(self, stream):
+        """
+        Returns:
+        the date of the latest post archived for the stream (str), or None if the stream is new
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT watermark FROM watermarks WHERE stream = ?", (stream,)).fetchone()
+        return None if row is None else row[0]
+
+    def set_watermark(self, stream, watermark):
+        """Moves the watermark of the stream forward to the date (str), if it is later than the current one"""
+        current = self.get_watermark(stream)
+        if current is not None and date_parse(current) >= date_parse(watermark):
+            return
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO watermarks VALUES (?, ?)", (stream, watermark))
+
+    def get_start_date(self, stream, default=None):
+        """
+        Returns:
+        the date (str) from which to query the stream: its watermark minus the overlap, or default if the stream is
+        new
+        """
+        watermark = self.get_watermark(stream)
+        if watermark is None:
+            return default
+        return (date_parse(watermark) - timedelta(seconds=self.overlap)).strftime(DATE_FORMAT)
+
+    def is_archived(self, post_id):
+        with self._lock:
+            return self._connection.execute("SELECT 1 FROM archived WHERE hash = ?",
+                                            (hash_id(post_id),)).fetchone() is not None
+
+    def __contains__(self, post_id):
+        return self.is_archived(post_id)
+
+    def add(self, post_id):
+        """Marks the post as archived"""
+        with self._lock:
+            self._connection.execute("INSERT OR IGNORE INTO archived VALUES (?)", (hash_id(post_id),))
+
+    def archived_count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM archived").fetchone()[0]
+
+    def commit(self):
+        """Saves the watermarks set and the posts archived since the last commit"""
+        with self._lock:
+            self._connection.commit()
+
+    def rollback(self):
+        """Discards the watermarks set and the posts archived since the last commit"""
+        with self._lock:
+            self._connection.rollback()
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AdaptiveCadence:
+    """Adapts the polling interval of a stream to the arrival rate of its posts, estimated from its recent polls (an
+    exponential moving average of posts per second of the windows they covered). A post waits on average half an
+    interval before being polled, and then the duration of the poll: the interval is the longest for which this
+    predicted lag meets the target latency. The interval is then lengthened:
+    - for quiet streams, until a poll is expected to return min_posts_per_poll posts, so that polls are not wasted
+    - until the calls of a poll (a page per batch of posts) fit the call budget of the stream
+    and clipped between min_every and max_every. Intervals grow at most max_growth times from a poll to the next, so
+    that a few empty polls do not make a stream wait for long."""
+
+    def __init__(self, target_latency=DEFAULT_TARGET_LATENCY, min_every=DEFAULT_MIN_EVERY,
+                 max_every=DEFAULT_MAX_EVERY, smoothing=0.3, min_posts_per_poll=1, max_growth=2):
+        """
+        Args:
+            target_latency: (float, default 900) seconds from the publication of a post to its archiving to aim for
+            min_every: (float, default 60) shortest interval between polls, in seconds
+            max_every: (float, default 86400) longest interval between polls, in seconds
+            smoothing: (0-1, default 0.3) weight of the latest poll in the estimated arrival rate
+            min_posts_per_poll: (float, default 1) number of posts a poll should be expected to return; 0 polls quiet
+                    streams as often as busy ones
+            max_growth: (float, default 2) largest ratio between an interval and the previous one
+        """
+        if not 0 < smoothing <= 1:
+            raise ValueError("smoothing must be in (0, 1]")
+        self.target_latency = target_latency
+        self.min_every = min_every
+        self.max_every = max_every
+        self.smoothing = smoothing
+        self.min_posts_per_poll = min_posts_per_poll
+        self.max_growth = max_growth
+        # posts per second, None until the first poll
+        self.arrival_rate = None
+        self.poll_duration = 0.
+        self.over_budget = False
+        self.interval = None
+
+    def update(self, posts, window, duration):
+        """
+        Args:
+            posts: (int) posts returned by a poll
+            window: (float) seconds of publication dates covered by the poll
+            duration: (float) seconds the poll took
+        """
+        if window > 0:
+            rate = posts / window
+            if self.arrival_rate is None:
+                self.arrival_rate = rate
+            else:
+                self.arrival_rate += self.smoothing * (rate - self.arrival_rate)
+        self.poll_duration += self.smoothing * (duration - self.poll_duration)
+
+    def get_interval(self, call_budget=float('inf'), page_size=DEFAULT_PAGE_SIZE):
+        """
+        Args:
+            call_budget: (float, default inf) calls per second available to the stream
+            page_size: (int, default 100) posts per page
+
+        Returns:
+        seconds until the next poll
+        """
+        interval = 2 * (self.target_latency - self.poll_duration)
+        rate = self.arrival_rate or 0.
+        if self.min_posts_per_poll > 0:
+            interval = max(interval, self.min_posts_per_poll / rate if rate > 0 else float('inf'))
+        # a poll makes a call, and one more per page of posts: calls / interval must not exceed the budget
+        page_rate = rate / page_size
+        self.over_budget = call_budget <= page_rate
+        if self.over_budget:
+            logger.warning("posts arrive faster than the call budget allows to fetch them")
+        else:
+            interval = max(interval, 1 / (call_budget - page_rate))
+        if self.interval is not None:
+            interval = min(interval, self.interval * self.max_growth)
+        self.interval = min(self.max_every, max(self.min_every, interval))
+        return self.interval
+
+    def predicted_lag(self, interval):
+        """
+        Returns:
+        seconds, on average, from the publication of a post to its archiving, if polling every interval seconds
+        """
+        return interval / 2 + self.poll_duration
+
+    def stats(self, interval):
+        """
+        Returns:
+        dict with the estimated arrival rate (posts per hour), the predicted lag in seconds, and whether posts arrive
+        faster than the call budget allows
+        """
+        return dict(arrival_rate=None if self.arrival_rate is None else self.arrival_rate * 60 * 60,
+                    predicted_lag=self.predicted_lag(interval), over_budget=self.over_budget)
+
+
+class Stream:
+    """Posts of a list, or of a group of lists, monitored independently of the other streams: each stream has its
+    own watermark and polling cadence, and its failures do not affect the other streams."""
+
+    def __init__(self, list_ids=None, every=DEFAULT_EVERY, name=None, start_date=None, query=None, cadence=None):
+        """
+        Args:
+            list_ids: (list, default None) ids of the lists whose posts are monitored. If None, all the lists of the
+                    dashboard
+            every: (float, default 3600) seconds between the starts of consecutive polls
+            name: (str, default None) name of the stream in the state. If None, the ids of its lists (see
+                    get_stream_name)
+            start_date: (str, default None) date from which a new stream is queried. If None, the time of the first
+                    poll
+            query: (dict, default None) further arguments to api.posts, e.g. {"types": "video"}
+            cadence: (AdaptiveCadence, default None) adapts every to the arrival rate of posts after each poll,
+                    starting from the given every. If None, the stream is polled every `every` seconds
+        """
+        self.list_ids = list_ids
+        self.every = every
+        self.name = name or get_stream_name(list_ids)
+        self.start_date = start_date
+        self.query = dict(query or dict())
+        self.cadence = cadence
+        if cadence is not None and cadence.interval is None:
+            cadence.interval = every
+        self.next_run = 0
+        # crawl in progress, consumed a turn at a time, and the latest post date it returned
+        self.crawl = None
+        self.crawl_started = None
+        self.crawl_watermark = None
+        self.crawl_archived = 0
+        self.crawl_consumed = 0
+        self.crawl_window = 0
+        # latest post date archived by this monitor: later polls continue from it, without overlap
+        self.watermark = None
+        self.stats = dict(polls=0, archived=0, skipped=0, errors=0, last_error=None, last_poll=None, every=every)
+
+    def __repr__(self):
+        return "Stream({}, every={})".format(self.name, self.every)
+
+
+class Monitor:
+    """Polls several streams of posts concurrently, archiving new posts. Streams share the api, hence its rate
+    budget for the posts endpoint. To be fair between streams, a poll is split into turns of at most
+    items_per_turn posts (i.e. about a page): after each turn, a stream whose crawl is not over goes back to the queue,
+    behind the streams that were due before it, so that a busy stream does not delay the others.
+    Posts are written, as returned by crowdtangle, to store_path, which may depend on the stream (e.g.
+    "posts_{stream}.njson"); archived posts and watermarks are kept in a MonitorState.
+
+    Example use:
+    from pytangle.api import API
+    from pytangle.monitoring import Monitor, MonitorState, Stream
+
+    api = API()
+    streams = [Stream([123], every=600), Stream([345, 678], every=3600)]
+    with MonitorState('monitor.sqlite') as state:
+        Monitor(api, streams, state, 'posts_{stream}.njson').run()
+    """
+
+    def __init__(self, api, streams, state, store_path, workers=DEFAULT_WORKERS,
+                 items_per_turn=DEFAULT_ITEMS_PER_TURN, retry_delay=DEFAULT_RETRY_DELAY):
+        """
+        Args:
+            api: (api.API) api to query
+            streams: (list of Stream) streams to monitor; their names must be distinct
+            state: (MonitorState) durable state of the monitor
+            store_path: (str) file where posts are appended, one json object per line; "{stream}" is replaced by the
+                    name of the stream of the posts
+            workers: (int, default 4) number of streams polled concurrently
+            items_per_turn: (int, default 100) number of posts a stream is polled for before yielding to the others
+            retry_delay: (float, default 60) seconds after which a stream whose poll failed is polled again, at most
+                    its cadence
+        """
+        if not len(streams):
+            raise ValueError("no streams to monitor")
+        if len(set(stream.name for stream in streams)) < len(streams):
+            raise ValueError("stream names must be distinct")
+        self.api = api
+        self.streams = list(streams)
+        self.state = state
+        self.store_path = store_path
+        self.workers = workers
+        self.items_per_turn = items_per_turn
+        self.retry_delay = retry_delay
+        self._file_locks = dict()
+        self._lock = Lock()
+        self._executor = None
+        self._running = dict()
+
+    def get_call_budget(self, stream):
+        """
+        Returns:
+        calls per second to the posts endpoint available to the stream: the rate budget of all the tokens, shared
+        equally by the streams
+        """
+        rate_limit = self.api.get_rate_limit(PostsEndpoint)
+        if rate_limit is None:
+            return float('inf')
+        return rate_limit.calls / rate_limit.period * max(1, self.api.token_count()) / len(self.streams)
+
+    def _get_file_lock(self, path):
+        with self._lock:
+            return self._file_locks.setdefault(path, Lock())
+
+    def _start_crawl(self, stream, now):
+        end_date = datetime.utcnow().strftime(DATE_FORMAT)
+        start_date = stream.watermark or self.state.get_start_date(stream.name, default=stream.start_date or end_date)
+        stream.crawl = self.api.posts(listIds=stream.list_ids, sortBy='date', count=-1, startDate=start_date,
+                                      endDate=end_date, timeframe=None, raw=True, **stream.query)
+        stream.crawl_started = now
+        stream.crawl_watermark = start_date
+        stream.crawl_archived = 0
+        stream.crawl_consumed = 0
+        stream.crawl_window = (date_parse(end_date) - date_parse(start_date)).total_seconds()
+
+    def _finish_crawl(self, stream, now):
+        stream.crawl.close()
+        stream.crawl = None
+        stream.stats['polls'] += 1
+        stream.stats['last_poll'] = now - stream.crawl_started
+        # posts come newest first: the watermark moves only once the whole window is archived
+        self.state.set_watermark(stream.name, stream.crawl_watermark)
+        stream.watermark = stream.crawl_watermark
+        if stream.cadence is not None:
+            stream.cadence.update(stream.crawl_consumed, stream.crawl_window, stream.stats['last_poll'])
+            stream.every = stream.cadence.get_interval(self.get_call_budget(stream),
+                                                       stream.query.get('batchSize', DEFAULT_PAGE_SIZE))
+            stream.stats.update(stream.cadence.stats(stream.every))
+        stream.stats['every'] = stream.every
+        stream.next_run = stream.crawl_started + stream.every
+        logger.debug("polled stream {}: {} posts archived in {:.1f} seconds".format(
+            stream.name, stream.crawl_archived, stream.stats['last_poll']))
+
+    def _archive_turn(self, stream, path):
+        """
+        Archives at most items_per_turn posts of the crawl of the stream. The state is shared by all the streams, and
+        any of them may commit it: posts are flushed to disk before they are marked as archived, so that a commit never
+        records posts that were not written
+
+        Returns:
+        tuple (number of posts consumed, number of posts archived)
+        """
+        consumed = 0
+        archived_ids = list()
+        with self._get_file_lock(path), open(path, 'ab') as out_file:
+            try:
+                for post in stream.crawl:
+                    consumed += 1
+                    stream.crawl_consumed += 1
+                    stream.crawl_watermark = max(stream.crawl_watermark, post['date'])
+                    if post['id'] in self.state:
+                        stream.stats['skipped'] += 1
+                    else:
+                        out_file.write(post + b'\n')
+                        archived_ids.append(post['id'])
+                    if consumed >= self.items_per_turn:
+                        break
+            finally:
+                out_file.flush()
+                os.fsync(out_file.fileno())
+                for post_id in archived_ids:
+                    self.state.add(post_id)
+                stream.stats['archived'] += len(archived_ids)
+                stream.crawl_archived += len(archived_ids)
+        return consumed, len(archived_ids)
+
+    def poll(self, stream):
+        """
+        Polls the stream for a turn: starts a new crawl from its watermark if none is in progress, archives at most
+        items_per_turn new posts, and schedules the next turn of the stream
+
+        Returns:
+        the number of posts archived
+        """
+        now = time.time()
+        path = self.store_path.format(stream=stream.name)
+        archived = 0
+        try:
+            if stream.crawl is None:
+                self._start_crawl(stream, now)
+            consumed, archived = self._archive_turn(stream, path)
+            if consumed < self.items_per_turn:
+                self._finish_crawl(stream, time.time())
+            else:
+                stream.next_run = time.time()
+        except Exception as e:
+            logger.warning("polling stream {} failed: {}".format(stream.name, e))
+            stream.stats['errors'] += 1
+            stream.stats['last_error'] = repr(e)
+            if stream.crawl is not None:
+                stream.crawl.close()
+                stream.crawl = None
+            stream.next_run = time.time() + min(self.retry_delay, stream.every)
+        finally:
+            # posts are on disk before they are marked as archived: a crash may only archive them twice
+            self.state.commit()
+        return archived
+
+    def _reap(self, timeout=None):
+        if not len(self._running):
+            return
+        done, _ = wait(list(self._running.values()), timeout=timeout, return_when=FIRST_COMPLETED)
+        for name, future in list(self._running.items()):
+            if future in done:
+                del self._running[name]
+
+    def run_pending(self, streams=None):
+        """
+        Submits the turns of the streams that are due, earliest due first, as long as there are free workers
+
+        Args:
+            streams: (list of Stream, default None) streams to consider. If None, all the streams
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        now = time.time()
+        due = sorted((stream for stream in (self.streams if streams is None else streams)
+                      if stream.name not in self._running and stream.next_run <= now),
+                     key=lambda stream: stream.next_run)
+        for stream in due:
+            if len(self._running) >= self.workers:
+                break
+            self._running[stream.name] = self._executor.submit(self.poll, stream)
+
+    def run_once(self):
+        """Polls all the streams once, to the end of their crawls, concurrently"""
+        attempts = {stream.name: stream.stats['polls'] + stream.stats['errors'] for stream in self.streams}
+        for stream in self.streams:
+            stream.next_run = 0
+        while True:
+            pending = [stream for stream in self.streams
+                       if stream.stats['polls'] + stream.stats['errors'] == attempts[stream.name]]
+            if not len(pending) and not len(self._running):
+                break
+            self.run_pending(pending)
+            self._reap()
+
+    def run(self, duration=None):
+        """
+        Polls the streams as they are due, until interrupted
+
+        Args:
+            duration: (float, default None) seconds after which to stop. If None, runs forever
+        """
+        end_time = float('inf') if duration is None else time.time() + duration
+        try:
+            while time.time() < end_time:
+                self.run_pending()
+                if len(self._running) >= self.workers:
+                    # streams due wait for a worker to be free
+                    wake_time = end_time
+                else:
+                    wake_time = min([stream.next_run for stream in self.streams
+                                     if stream.name not in self._running] + [end_time])
+                timeout = max(0, wake_time - time.time())
+                if len(self._running):
+                    self._reap(None if timeout == float('inf') else timeout)
+                else:
+                    logger.debug('sleeping for {} seconds'.format(timeout))
+                    time.sleep(timeout)
+        finally:
+            self.close()
+
+    def stats(self):
+        """
+        Returns:
+        dict mapping the name of each stream to its stats: number of completed polls, of posts archived, of posts
+        skipped as already archived, of failed polls, the last error, the duration of the last poll and the interval
+        between polls in seconds. Streams with an adaptive cadence also report their estimated arrival rate, predicted
+        lag, and whether they are over budget (see AdaptiveCadence.stats)
+        """
+        return {stream.name: dict(stream.stats) for stream in self.streams}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._running = dict()
+        for stream in self.streams:
+            if stream.crawl is not None:
+                stream.crawl.close()
+                stream.crawl = None
+        self.state.commit()
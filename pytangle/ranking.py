@@ -0,0 +1,172 @@
+# Copyright (C) 2020 Mattia Samory
+
+from pytangle.decoding import decode
+from pytangle.frames import to_arrays, require_numpy, DEFAULT_CHUNK_SIZE, INTEGER, OBJECT
+from pytangle.records import Interactions
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TOTAL_INTERACTIONS = 'total_interactions'
+OVERPERFORMING = 'overperforming'
+UNDERPERFORMING = 'underperforming'
+INTERACTION_RATE = 'interaction_rate'
+SORT_ORDERS = (TOTAL_INTERACTIONS, OVERPERFORMING, UNDERPERFORMING, INTERACTION_RATE)
+
+VIEW_COUNT = 'viewCount'
+# weight parameters of api.posts, mapped to the count they weigh
+WEIGHT_COUNTS = {'weightAngry': 'angryCount',
+                 'weightComment': 'commentCount',
+                 'weightHaha': 'hahaCount',
+                 'weightLike': 'likeCount',
+                 'weightLove': 'loveCount',
+                 'weightSad': 'sadCount',
+                 'weightShare': 'shareCount',
+                 'weightView': VIEW_COUNT,
+                 'weightWow': 'wowCount'}
+# interaction counts, then video views (0 for posts without views)
+COUNTS = Interactions._fields + (VIEW_COUNT,)
+
+RANKING_COLUMNS = dict([('id', OBJECT), ('subscriberCount', INTEGER), ('account.subscriberCount', INTEGER)] +
+                       [('statistics.actual.' + count, INTEGER) for count in COUNTS] +
+                       [('statistics.expected.' + count, INTEGER) for count in COUNTS])
+
+
+def load_posts(path):
+    """
+    Args:
+        path: (str) archive of posts, one json object per line, e.g. as stored by examples/real_time_monitor.py
+
+    Returns:
+    generator of the posts in the archive (dict)
+    """
+    with open(path, 'rb') as in_file:
+        for line in in_file:
+            if len(line.strip()):
+                yield decode(line)
+
+
+def get_weights(weights=None):
+    """
+    Args:
+        weights: (dict, default None) weight of each type of interaction, named as the weight parameters of
+                api.posts, e.g. {"weightLike": 1, "weightShare": 2}; weightView weighs video views. Types of
+                interactions that are not weighted count 0. If None or empty, all interactions count 1, and views 0
+
+    Returns:
+    numpy array with the weight of each count, in the order of COUNTS
+    """
+    if not weights:
+        return numpy.array([0. if count == VIEW_COUNT else 1. for count in COUNTS])
+    unknown = set(weights) - set(WEIGHT_COUNTS)
+    if len(unknown):
+        raise ValueError("unknown weights: {}. Available weights: {}".format(", ".join(sorted(unknown)),
+                                                                          ", ".join(WEIGHT_COUNTS)))
+    counts = {WEIGHT_COUNTS[name]: weight for name, weight in weights.items()}
+    return numpy.array([counts.get(count, 0) for count in COUNTS], dtype=float)
+
+
+class PostRanker:
+    """Scores and re-ranks posts that were already fetched, without calling the api: trying a new weighting of
+    interactions costs a matrix product over the interaction counts, rather than a new crawl. Scores follow the
+    sortBy options of api.posts: weighted total interactions, overperforming ratio (weighted actual interactions over
+    weighted expected interactions), and interaction rate (weighted total interactions over subscribers).
+
+    Example use:
+    from pytangle.api import API
+    from pytangle.ranking import PostRanker
+
+    api = API()
+    ranker = PostRanker(api.posts(listIds=[12345, ], count=1000))
+    for a_weighting in ({'weightShare': 1}, {'weightLike': 1, 'weightShare': 2}):
+        print(ranker.top(k=5, sortBy='overperforming', weights=a_weighting))
+    """
+
+    def __init__(self, posts, keep_posts=True, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            posts: (iterable) posts (dict, records.Record, or rawjson.RawItem), e.g. returned by api.posts, or loaded
+                    from an archive with load_posts
+            keep_posts: (bool, default True) keep the posts, so that rankings return them. If False, rankings return
+                    post ids, and only the interaction counts are kept in memory
+            chunk_size: (int, default 10000) number of posts converted to arrays at a time
+        """
+        require_numpy()
+        if keep_posts:
+            posts = list(posts)
+        self.posts = posts if keep_posts else None
+        columns = to_arrays(posts, RANKING_COLUMNS, chunk_size=chunk_size)
+        self.ids = columns['id']
+        # interaction counts, a row per post and a column per type of interaction
+        self.actual = numpy.stack([columns['statistics.actual.' + count] for count in COUNTS], axis=1).astype(float)
+        self.expected = numpy.stack([columns['statistics.expected.' + count] for count in COUNTS],
+                                    axis=1).astype(float)
+        # subscribers at the time of posting, or else the current subscribers of the account
+        self.subscriber_counts = numpy.where(columns['subscriberCount'] > 0, columns['subscriberCount'],
+                                             columns['account.subscriberCount']).astype(float)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def scores(self, sortBy=OVERPERFORMING, weightings=None):
+        """
+        Args:
+            sortBy: ( interaction_rate, overperforming, total_interactions, underperforming, default overperforming )
+                    the score to compute. Underperforming scores are the opposite of overperforming ones
+            weightings: (list of dict, default None) weightings to score posts by (see get_weights). If None, a single
+                    weighting with all interactions counting 1
+
+        Returns:
+        numpy array with a row per post and a column per weighting. Scores that are undefined (e.g. overperforming
+        posts with no expected interactions) are NaN
+        """
+        if sortBy not in SORT_ORDERS:
+            raise ValueError("cannot rank by {}. Available orders: {}".format(sortBy, ", ".join(SORT_ORDERS)))
+        weight_matrix = numpy.stack([get_weights(weights) for weights in (weightings or [None])], axis=1)
+        totals = self.actual @ weight_matrix
+        if sortBy == TOTAL_INTERACTIONS:
+            return totals
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            if sortBy == INTERACTION_RATE:
+                scores = totals / self.subscriber_counts[:, None]
+            else:
+                scores = totals / (self.expected @ weight_matrix)
+                if sortBy == UNDERPERFORMING:
+                    scores = -scores
+        scores[~numpy.isfinite(scores)] = numpy.nan
+        return scores
+
+    def top_many(self, weightings, k=10, sortBy=OVERPERFORMING):
+        """
+        Args:
+            weightings: (list of dict) weightings to rank posts by (see get_weights)
+            k: (int, default 10) number of posts returned per weighting
+            sortBy: ( interaction_rate, overperforming, total_interactions, underperforming, default overperforming )
+
+        Returns:
+        list with a ranking per weighting, each a list of the k posts (or post ids, if posts are not kept) with the
+        highest score, as (post, score) pairs in decreasing order of score. Posts with undefined scores come last
+        """
+        scores = self.scores(sortBy=sortBy, weightings=weightings)
+        keys = numpy.where(numpy.isnan(scores), -numpy.inf, scores)
+        k = min(k, len(self))
+        rankings = list()
+        for column in range(keys.shape[1]):
+            if k < len(self):
+                top_indices = numpy.argpartition(-keys[:, column], k - 1)[:k]
+            else:
+                top_indices = numpy.arange(len(self))
+            top_indices = top_indices[numpy.argsort(-keys[top_indices, column], kind='stable')]
+            rankings.append([(self.posts[index] if self.posts is not None else self.ids[index],
+                              float(scores[index, column]))
+                             for index in top_indices])
+        return rankings
+
+    def top(self, k=10, sortBy=OVERPERFORMING, weights=None):
+        """
+        Returns:
+        list of the k posts with the highest score, as (post, score) pairs (see top_many)
+        """
+        return self.top_many([weights], k=k, sortBy=sortBy)[0]
@@ -0,0 +1,333 @@
+# Copyright (C) 2020 Mattia Samory
+
+import hashlib
+import json
+import os
+import socket
+import time
+from abc import ABC
+from collections import namedtuple
+from threading import Lock, local
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+from pytangle.connectivity import ONE_MINUTE
+
+import logging
+
+logger = logging.getLogger()
+
+DEFAULT_COORDINATOR_PORT = 47215
+
+RateLimit = namedtuple('RateLimit', ['calls', 'period', 'burst'])
+RateLimit.__doc__ = """Budget of an endpoint: `calls` calls every `period` seconds, of which at most `burst` can be made 
+back to back after an idle period."""
+
+
+def override_rate_limit(rate_limit, calls=None, period=None, burst=None):
+    """
+    Returns:
+    a RateLimit with the values passed, and the values of rate_limit (or None) otherwise; bursts default to calls
+    """
+    if rate_limit is None:
+        rate_limit = RateLimit(calls=calls, period=period, burst=burst or calls)
+    return RateLimit(calls=calls or rate_limit.calls,
+                     period=period or rate_limit.period,
+                     burst=burst or rate_limit.burst)
+
+
+class TokenBucket:
+    """Token bucket rate limiter. The bucket holds up to `burst` call tokens and is refilled at `calls` tokens every
+    `period` seconds; each call consumes one token. After idle periods, up to `burst` calls can be made back to back.
+    When crowdtangle nevertheless answers with 429 (e.g. because the token is also used elsewhere), the bucket is
+    emptied, blocked for the time requested by crowdtangle, and its burst is halved; the burst then grows back by one
+    for every `burst` successful calls."""
+
+    def __init__(self, rate_limit, clock=time.monotonic, state=None):
+        """
+        Args:
+            rate_limit: (RateLimit) calls, period and burst of the bucket
+            clock: (callable, default time.monotonic) returns the current time in seconds. Buckets shared across
+                    processes must use a clock shared across processes, such as time.time
+            state: (list, default None) state of the bucket, as returned by get_state; None for a full bucket
+        """
+        self.rate_limit = rate_limit
+        self.refill_rate = rate_limit.calls / rate_limit.period
+        self.clock = clock
+        if state is None:
+            self.capacity = float(rate_limit.burst)
+            self.tokens = self.capacity
+            self.updated = clock()
+            self.blocked_until = 0.
+        else:
+            self.capacity, self.tokens, self.updated, self.blocked_until = state
+        self._lock = Lock()
+
+    def get_state(self):
+        return [self.capacity, self.tokens, self.updated, self.blocked_until]
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+            self.updated = now
+
+    def _wait_time(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.
+        return (1 - self.tokens) / self.refill_rate
+
+    def try_acquire(self):
+        """
+        Returns:
+        0 if a call can be made now (and consumes a token for it), otherwise the number of seconds to wait
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            wait_time = self._wait_time(now)
+            if wait_time <= 0:
+                self.tokens -= 1
+            return wait_time
+
+    def acquire(self):
+        """Waits until a call can be made, and consumes a token for it"""
+        wait_time = self.try_acquire()
+        while wait_time > 0:
+            time.sleep(wait_time)
+            wait_time = self.try_acquire()
+
+    def remaining(self):
+        """
+        Returns:
+        number of calls that can be made right now
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            if now < self.blocked_until:
+                return 0
+            return int(self.tokens)
+
+    def next_refill(self):
+        """
+        Returns:
+        seconds until the next call can be made (0 if a call can be made now)
+        """
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            return self._wait_time(now)
+
+    def record_success(self):
+        with self._lock:
+            self.capacity = min(float(self.rate_limit.burst), self.capacity + 1. / self.rate_limit.burst)
+
+    def record_rate_limited(self, retry_after=None):
+        """
+        Adapts the bucket to a 429 response from crowdtangle.
+
+        Args:
+            retry_after: (float, default None) seconds to wait as requested by crowdtangle. If None, waits for the
+                    time needed to refill one token.
+        """
+        with self._lock:
+            now = self.clock()
+            self.capacity = max(1., self.capacity / 2)
+            self.tokens = 0.
+            self.updated = now
+            if retry_after is None:
+                retry_after = 1. / self.refill_rate
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            logger.warning("rate limit exceeded: waiting {:.1f} seconds, burst reduced to {:.1f}".format(
+                retry_after, self.capacity))
+
+    def status(self):
+        """
+        Returns:
+        dict with the calls that can be made now, the seconds until the next call, and the current burst size
+        """
+        return dict(remaining=self.remaining(),
+                    next_refill=self.next_refill(),
+                    burst=self.capacity,
+                    )
+
+
+def get_bucket_key(token, rate_limit):
+    """
+    Returns:
+    a string identifying the bucket of the token for the rate limit. The token is hashed, so that keys can be stored
+    and shared with other processes
+    """
+    token_hash = hashlib.sha256(str(token).encode('utf-8')).hexdigest()[:16]
+    return "{}:{}:{}:{}".format(token_hash, *rate_limit)
+
+
+class RateLimitBackend(ABC):
+    """Stores the token buckets of all the tokens and rate limits. Backends other than LocalBackend share the buckets,
+    hence enforce a single budget per token, across processes or hosts."""
+
+    def try_acquire(self, token, rate_limit):
+        """
+        Returns:
+        0 if a call can be made now (and consumes a token for it), otherwise the number of seconds to wait
+        """
+        return self._apply(token, rate_limit, 'try_acquire')
+
+    def record_success(self, token, rate_limit):
+        return self._apply(token, rate_limit, 'record_success')
+
+    def record_rate_limited(self, token, rate_limit, retry_after=None):
+        return self._apply(token, rate_limit, 'record_rate_limited', retry_after)
+
+    def status(self, token, rate_limit):
+        return self._apply(token, rate_limit, 'status')
+
+    def _apply(self, token, rate_limit, method_name, *args):
+        """Calls method_name on the TokenBucket of the token for the rate limit, and returns its result"""
+        raise NotImplementedError
+
+
+class LocalBackend(RateLimitBackend):
+    """Keeps buckets in memory: the budget is shared by the threads of a process."""
+
+    def __init__(self):
+        self._buckets = dict()
+        self._lock = Lock()
+
+    def get_bucket(self, key, rate_limit):
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(rate_limit)
+            return self._buckets[key]
+
+    def _apply(self, token, rate_limit, method_name, *args):
+        bucket = self.get_bucket(get_bucket_key(token, rate_limit), rate_limit)
+        return getattr(bucket, method_name)(*args)
+
+
+class FileBackend(RateLimitBackend):
+    """Keeps buckets in a file, locked on each access: the budget is shared by all the processes of a host that use
+    the same file."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: (str) location of the file storing the buckets; created if missing
+        """
+        if fcntl is None:
+            raise ImportError("FileBackend requires fcntl, which is not available on this platform")
+        self.path = path
+        self._lock = Lock()
+
+    def _apply(self, token, rate_limit, method_name, *args):
+        key = get_bucket_key(token, rate_limit)
+        with self._lock, open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                states = json.loads(content) if content else dict()
+                bucket = TokenBucket(rate_limit, clock=time.time, state=states.get(key))
+                result = getattr(bucket, method_name)(*args)
+                states[key] = bucket.get_state()
+                f.seek(0)
+                f.truncate()
+                json.dump(states, f)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return result
+
+
+class CoordinatorBackend(RateLimitBackend):
+    """Delegates buckets to a coordinator daemon (see pytangle.coordinator), reached over a socket: the budget is
+    shared by all the processes, on any host, that use the same coordinator. If the coordinator is unreachable, falls
+    back to local buckets until it can be reached again."""
+
+    def __init__(self, host='127.0.0.1', port=None, timeout=10, reconnect_after=ONE_MINUTE):
+        """
+        Args:
+            host: (str, default 127.0.0.1) address of the coordinator
+            port: (int, default DEFAULT_COORDINATOR_PORT) port of the coordinator
+            timeout: (float, default 10) seconds to wait for an answer from the coordinator
+            reconnect_after: (float, default ONE_MINUTE) seconds to wait before trying to reach an unreachable
+                    coordinator again
+        """
+        self.address = (host, port or DEFAULT_COORDINATOR_PORT)
+        self.timeout = timeout
+        self.reconnect_after = reconnect_after
+        self._connections = local()
+        self._fallback = LocalBackend()
+        self._unreachable_until = 0.
+
+    def _get_connection(self):
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            connection = sock.makefile('rwb')
+            self._connections.connection = connection
+        return connection
+
+    def _close_connection(self):
+        connection = getattr(self._connections, 'connection', None)
+        self._connections.connection = None
+        if connection is not None:
+            try:
+                connection.close()
+            except OSError:
+                pass
+
+    def _apply(self, token, rate_limit, method_name, *args):
+        if time.monotonic() < self._unreachable_until:
+            return self._fallback._apply(token, rate_limit, method_name, *args)
+        request = dict(key=get_bucket_key(token, rate_limit),
+                       rate_limit=list(rate_limit),
+                       method=method_name,
+                       args=list(args),
+                       )
+        try:
+            connection = self._get_connection()
+            connection.write(json.dumps(request).encode('utf-8') + b'\n')
+            connection.flush()
+            line = connection.readline()
+            if not line:
+                raise ConnectionError("connection closed by the coordinator")
+        except OSError as e:
+            logger.warning("rate limit coordinator at {}:{} unreachable ({}); using local rate limits for {} "
+                           "seconds".format(*self.address, e, self.reconnect_after))
+            self._close_connection()
+            self._unreachable_until = time.monotonic() + self.reconnect_after
+            return self._fallback._apply(token, rate_limit, method_name, *args)
+        answer = json.loads(line.decode('utf-8'))
+        if 'error' in answer:
+            raise ValueError("rate limit coordinator error: {}".format(answer['error']))
+        return answer['result']
+
+
+def create_backend(backend_config):
+    """
+    Args:
+        backend_config: (dict) "type" (local, file, coordinator) of the backend, and the arguments of its constructor,
+                e.g. {"type": "file", "path": "/tmp/pytangle_rate_limits.json"}
+
+    Returns:
+    a RateLimitBackend
+    """
+    backend_config = dict(backend_config)
+    backend_type = backend_config.pop('type', 'local')
+    backends = dict(local=LocalBackend, file=FileBackend, coordinator=CoordinatorBackend)
+    if backend_type not in backends:
+        raise ValueError("rate limit backend type should be one of {}; received \"{}\" instead".format(
+            ", ".join(backends), backend_type))
+    return backends[backend_type](**backend_config)
+
+
+# shared by all the API instances in the process that do not set a backend, so that the budget of a token is
+# respected even when the token is used by several API instances
+DEFAULT_BACKEND = LocalBackend()
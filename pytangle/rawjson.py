@@ -0,0 +1,163 @@
+# Copyright (C) 2020 Mattia Samory
+
+import re
+
+from pytangle.decoding import decode
+
+# text up to the next bracket that is not within a string, and the bracket
+STRUCTURE = re.compile(rb'[^"{}\[\]]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"{}\[\]]*)*([{}\[\]])')
+# key preceding an object or list
+KEY = re.compile(rb'"((?:[^"\\]|\\.)*)"\s*:\s*[{\[]$')
+# key and scalar value
+SCALAR_FIELD = re.compile(rb'"((?:[^"\\]|\\.)*)"\s*:\s*("(?:[^"\\]|\\.)*"|-?[0-9][0-9.eE+\-]*|true|false|null)')
+
+OPENING = frozenset(b'{[')
+
+
+class RawItem(bytes):
+    """Json of an item, as sliced from the response of crowdtangle, e.g. to be written to a file without decoding and
+    encoding it again. Top-level scalar fields (e.g. id and date) can be accessed by key, as in the decoded item; other
+    fields are accessed by decoding the item."""
+
+    def __new__(cls, content, fields=None):
+        item = super().__new__(cls, content)
+        item.fields = fields if fields is not None else dict()
+        item._parsed = None
+        return item
+
+    def parse(self):
+        """
+        Returns:
+        the decoded item (dict)
+        """
+        if self._parsed is None:
+            self._parsed = decode(bytes(self))
+        return self._parsed
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in self.fields:
+                return self.fields[key]
+            return self.parse()[key]
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        if isinstance(key, str):
+            return key in self.fields or key in self.parse()
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class RawValue(bytes):
+    """Json of a field of an item, as sliced from the item without decoding it (see split_fields)"""
+
+    def parse(self):
+        """
+        Returns:
+        the decoded value
+        """
+        return decode(bytes(self))
+
+
+def get_key(text):
+    match = KEY.search(text)
+    if match is None:
+        return None
+    return match.group(1).decode('utf-8')
+
+
+def get_scalar_fields(text, fields, decoder=decode):
+    for match in SCALAR_FIELD.finditer(text):
+        fields[match.group(1).decode('utf-8')] = decoder(match.group(2))
+
+
+def split_response(content, response_field, decoder=decode):
+    """
+    Slices the items out of a response without decoding them: only the brackets outside of strings are scanned, so
+    that items are delimited, and the scalar fields at the top level of each item are decoded. Objects other than the
+    items in the result (e.g. pagination) are decoded.
+
+    Args:
+        content: (bytes) body of the response
+        response_field: (str) field of the result containing the items
+        decoder: (callable, default decoding.decode) function parsing the json decoded out of the response
+
+    Returns:
+    the response (dict), whose items are RawItem
+    """
+    response = dict()
+    result = dict()
+    items = list()
+    depth = 0
+    in_result = in_items = False
+    item_start = item_fields = None
+    section_start = section_key = None
+    content_view = memoryview(content)
+    for match in STRUCTURE.finditer(content):
+        position = match.end() - 1
+        is_opening = content[position] in OPENING
+        if depth == 1:
+            get_scalar_fields(match.group(0), response, decoder)
+            if is_opening and get_key(match.group(0)) == 'result':
+                in_result = True
+        elif depth == 2 and in_result:
+            get_scalar_fields(match.group(0), result, decoder)
+            if is_opening:
+                key = get_key(match.group(0))
+                if key == response_field:
+                    in_items = True
+                    result[response_field] = items
+                else:
+                    section_start, section_key = position, key
+            else:
+                in_result = False
+        elif depth == 3 and in_items:
+            if is_opening:
+                item_start, item_fields = position, dict()
+            else:
+                in_items = False
+        elif depth == 3 and section_key is not None and not is_opening:
+            result[section_key] = decoder(content[section_start:position + 1])
+            section_start = section_key = None
+        elif depth == 4 and item_start is not None:
+            get_scalar_fields(match.group(0), item_fields, decoder)
+            if not is_opening:
+                items.append(RawItem(content_view[item_start:position + 1], item_fields))
+                item_start = item_fields = None
+        depth += 1 if is_opening else -1
+    if len(result):
+        response['result'] = result
+    return response
+
+
+def split_fields(content):
+    """
+    Slices the top-level fields of an item without decoding the objects and lists among them, as split_response does
+    for the items of a response.
+
+    Args:
+        content: (bytes) json of the item, e.g. a RawItem
+
+    Returns:
+    dict mapping each top-level field of the item to its value: decoded for scalars, RawValue for objects and lists
+    """
+    fields = dict()
+    depth = 0
+    field_start = field_key = None
+    for match in STRUCTURE.finditer(content):
+        position = match.end() - 1
+        is_opening = content[position] in OPENING
+        if depth == 1:
+            get_scalar_fields(match.group(0), fields)
+            if is_opening:
+                field_start, field_key = position, get_key(match.group(0))
+        elif depth == 2 and not is_opening and field_key is not None:
+            fields[field_key] = RawValue(content[field_start:position + 1])
+            field_start = field_key = None
+        depth += 1 if is_opening else -1
+    return fields
@@ -0,0 +1,142 @@
+# Copyright (C) 2020 Mattia Samory
+
+from pytangle.rawjson import RawItem, RawValue, split_fields
+
+
+class Record:
+    """Compact representation of an item returned by crowdtangle. The most common fields are kept in slots (counts as
+    int, nested objects as records), the others in a dict. Records built from raw items (see rawjson.RawItem) keep the
+    objects and lists of the other fields (e.g. history and media) as sliced json, decoded on first access.
+    Fields can be accessed as attributes or by key, as in the dict they were built from; fields that were not
+    returned by crowdtangle are None."""
+    __slots__ = ('_extra',)
+    # fields kept in slots
+    _fields = ()
+    # fields converted to records, mapped to the class of the record
+    _records = dict()
+    # fields converted to int
+    _integers = frozenset()
+
+    @classmethod
+    def from_dict(cls, item):
+        """
+        Args:
+            item: (dict or RawItem) item as returned by crowdtangle
+
+        Returns:
+        the record
+        """
+        if isinstance(item, RawItem):
+            item = split_fields(item)
+        record = cls.__new__(cls)
+        extra = {key: value for key, value in item.items() if key not in cls._fields}
+        record._extra = extra if len(extra) else None
+        for field in cls._fields:
+            if field in item:
+                value = item[field]
+                if isinstance(value, RawValue):
+                    value = value.parse()
+                record._set(field, value)
+        return record
+
+    def _set(self, field, value):
+        if value is not None:
+            if field in self._records and isinstance(value, dict):
+                value = self._records[field].from_dict(value)
+            elif field in self._integers:
+                value = int(value)
+        setattr(self, field, value)
+
+    def __getattr__(self, name):
+        # called for fields that are not set, or not kept in slots
+        if name.startswith('_'):
+            raise AttributeError(name)
+        extra = self._extra
+        if extra is not None and name in extra:
+            value = extra[name]
+            if isinstance(value, RawValue):
+                value = extra[name] = value.parse()
+            return value
+        if name in self._fields:
+            return None
+        raise AttributeError("{} has no field {}".format(type(self).__name__, name))
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+
+    def to_dict(self):
+        """
+        Returns:
+        the item as a dict, as returned by crowdtangle
+        """
+        item = {key: value.parse() if isinstance(value, RawValue) else value
+                for key, value in (self._extra or dict()).items()}
+        for field in self._fields:
+            try:
+                value = object.__getattribute__(self, field)
+            except AttributeError:
+                continue
+            if isinstance(value, Record):
+                value = value.to_dict()
+            item[field] = value
+        return item
+
+    def __eq__(self, other):
+        if not isinstance(other, Record):
+            return NotImplemented
+        return type(self) == type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        values = list()
+        for field in self._fields:
+            try:
+                value = object.__getattribute__(self, field)
+            except AttributeError:
+                continue
+            values.append("{}={!r}".format(field, value))
+        return "{}({})".format(type(self).__name__, ", ".join(values))
+
+
+class Interactions(Record):
+    """Counts of interactions, as in the actual and expected statistics of a post"""
+    __slots__ = ('likeCount', 'shareCount', 'commentCount', 'loveCount', 'wowCount', 'hahaCount', 'sadCount',
+                 'angryCount', 'thankfulCount', 'careCount')
+    _fields = __slots__
+    _integers = frozenset(__slots__)
+
+
+class Statistics(Record):
+    __slots__ = ('actual', 'expected')
+    _fields = __slots__
+    _records = dict(actual=Interactions, expected=Interactions)
+
+
+class Account(Record):
+    __slots__ = ('id', 'name', 'handle', 'profileImage', 'subscriberCount', 'url', 'platform', 'platformId',
+                 'accountType', 'pageAdminTopCountry', 'verified')
+    _fields = __slots__
+    _integers = frozenset(['subscriberCount'])
+
+
+class Post(Record):
+    """Post returned by the posts, search, and links endpoints. History, media, and expanded links are kept as
+    returned by crowdtangle."""
+    __slots__ = ('id', 'platformId', 'platform', 'date', 'updated', 'type', 'title', 'caption', 'description',
+                 'message', 'link', 'postUrl', 'subscriberCount', 'score', 'languageCode', 'account', 'statistics')
+    _fields = __slots__
+    _records = dict(account=Account, statistics=Statistics)
+    _integers = frozenset(['subscriberCount'])
+
+
+class AccountStatistics(Record):
+    """Entry of the leaderboard"""
+    __slots__ = ('account', 'summary', 'subscriberData')
+    _fields = __slots__
+    _records = dict(account=Account)
@@ -0,0 +1,343 @@
+# Copyright (C) 2020 Mattia Samory
+
+import calendar
+import heapq
+import json
+import math
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from dateutil.parser import parse as date_parse
+
+from pytangle.endpoints import PostEndpoint, PostsEndpoint
+from pytangle.errors import ClientError, NotFoundError
+from pytangle.rawjson import RawItem
+from pytangle.records import Record
+
+import logging
+
+logger = logging.getLogger()
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_FIRST_INTERVAL = 15 * 60
+DEFAULT_GROWTH = 2
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_RETRY_DELAY = 60
+# seconds a call takes, besides waiting for rate budget
+DEFAULT_CALL_OVERHEAD = .5
+
+ONE_SHOT = 'one_shot'
+WINDOW = 'window'
+
+
+def to_timestamp(date):
+    return calendar.timegm(date_parse(date).timetuple())
+
+
+def get_actual_statistics(post):
+    """
+    Returns:
+    dict mapping each interaction count of the post to its value
+    """
+    if isinstance(post, Record):
+        post = post.to_dict()
+    elif isinstance(post, RawItem):
+        post = post.parse()
+    return dict((post.get('statistics') or dict()).get('actual') or dict())
+
+
+def get_delta(previous, current):
+    """
+    Returns:
+    dict mapping the interaction counts that changed to their change
+    """
+    return {count: value - previous.get(count, 0) for count, value in current.items()
+            if value != previous.get(count, 0)}
+
+
+def get_seconds_per_call(rate_limit, call_overhead=DEFAULT_CALL_OVERHEAD):
+    if rate_limit is None:
+        return call_overhead
+    return rate_limit.period / rate_limit.calls + call_overhead
+
+
+class TrackedPost:
+    __slots__ = ('id', 'published', 'list_ids', 'statistics', 'refreshes', 'next_refresh')
+
+    def __init__(self, post_id, published, list_ids, statistics):
+        self.id = post_id
+        self.published = published
+        self.list_ids = list_ids
+        self.statistics = statistics
+        self.refreshes = 0
+        self.next_refresh = None
+
+    def __lt__(self, other):
+        return self.next_refresh < other.next_refresh
+
+
+class RefreshScheduler:
+    """Refreshes the statistics of tracked posts as they age, to record how their interactions grow. Each post is
+    refreshed after an interval proportional to its age (e.g. at 15 minutes, 30 minutes, 1 hour, 2 hours... after
+    publication, with growth 2), so that refreshes are frequent while interactions grow fast, and rare afterwards,
+    until the post is max_age old.
+    Posts due at the same time are refreshed in batches, over the cheapest endpoint: one call per post to the post
+    endpoint, or a query of the posts endpoint for the time window of the due posts of a list, which returns a page
+    of up to 100 posts per call. The cost of a batch is estimated in seconds, from the rate limits of the endpoints.
+    Only changes are stored: for each refresh that changed the statistics of a post, a line with the change of each
+    interaction count that changed; the first line of each post has its counts when tracked. Interactions over time
+    are the cumulative sums of the changes.
+
+    Example use:
+    from pytangle.api import API
+    from pytangle.refresh import RefreshScheduler
+
+    api = API()
+    scheduler = RefreshScheduler(api, 'growth.ndjson')
+    for a_post in api.posts(listIds=[12345], count=100, sortBy='date'):
+        scheduler.track(a_post, list_ids=[12345])
+    scheduler.run()
+    """
+
+    def __init__(self, api, store_path, endpoint='ct', first_interval=DEFAULT_FIRST_INTERVAL,
+                 growth=DEFAULT_GROWTH, max_age=DEFAULT_MAX_AGE, call_overhead=DEFAULT_CALL_OVERHEAD,
+                 retry_delay=DEFAULT_RETRY_DELAY):
+        """
+        Args:
+            api: (api.API) api to query
+            store_path: (str) file where changes are appended, one json object per line
+            endpoint: (platform, ct, default ct) endpoint of one-shot refreshes (see api.post); ct refreshes posts by
+                    their id, platform by their platformId
+            first_interval: (float, default 900) seconds after publication of the first refresh, and shortest
+                    interval between refreshes
+            growth: (float, default 2) ratio between the age of a post at a refresh and at the previous one
+            max_age: (float, default 604800) age in seconds past which posts are not refreshed anymore
+            call_overhead: (float, default 0.5) seconds a call takes, on top of waiting for rate budget, used to
+                    estimate the cost of refreshes
+            retry_delay: (float, default 60) seconds after which a post whose refresh failed is refreshed again
+        """
+        if growth <= 1:
+            raise ValueError("growth must be greater than 1")
+        self.api = api
+        self.store_path = store_path
+        self.endpoint = endpoint
+        self.first_interval = first_interval
+        self.growth = growth
+        self.max_age = max_age
+        self.call_overhead = call_overhead
+        self.retry_delay = retry_delay
+        self.tracked = dict()
+        self._queue = list()
+        self._stats = dict(refreshes=0, changes=0, not_found=0, expired=0, errors=0, calls=defaultdict(int))
+
+    def __len__(self):
+        return len(self.tracked)
+
+    def __contains__(self, post_id):
+        return post_id in self.tracked
+
+    def get_next_refresh(self, published, now):
+        """
+        Returns:
+        the time of the next refresh of a post published at the given time, or None if it is too old
+        """
+        age = max(0., now - published)
+        next_refresh = published + max(age * self.growth, age + self.first_interval)
+        if next_refresh - published > self.max_age:
+            return None
+        return next_refresh
+
+    def _schedule(self, tracked_post, now):
+        tracked_post.next_refresh = self.get_next_refresh(tracked_post.published, now)
+        if tracked_post.next_refresh is None:
+            del self.tracked[tracked_post.id]
+            self._stats['expired'] += 1
+            return
+        heapq.heappush(self._queue, tracked_post)
+
+    def _write(self, out_file, tracked_post, delta, now):
+        out_file.write(json.dumps(dict(id=tracked_post.id, date=datetime.utcfromtimestamp(now).strftime(DATE_FORMAT),
+                                       age=int(now - tracked_post.published), actual=delta)) + '\n')
+
+    def track(self, post, list_ids=None):
+        """
+        Tracks a post, storing its interaction counts. Posts already tracked are ignored.
+
+        Args:
+            post: (dict, records.Record, or rawjson.RawItem) post as returned by crowdtangle, e.g. by api.posts
+            list_ids: (list, default None) ids of lists the post belongs to: refreshes of posts of the same lists can
+                    be batched in queries of the posts endpoint. If None, the post is refreshed via api.post
+        """
+        post_id = post['id'] if self.endpoint == 'ct' else post['platformId']
+        if post_id in self.tracked:
+            return
+        now = time.time()
+        statistics = get_actual_statistics(post)
+        tracked_post = TrackedPost(post_id, to_timestamp(post['date']),
+                                   None if list_ids is None else tuple(sorted(str(a_list) for a_list in list_ids)),
+                                   statistics)
+        self.tracked[post_id] = tracked_post
+        with open(self.store_path, 'a') as out_file:
+            self._write(out_file, tracked_post, get_delta(dict(), statistics), now)
+        self._schedule(tracked_post, now)
+
+    def plan(self, due_posts):
+        """
+        Splits the posts due into batches, each refreshed over the cheapest endpoint: the posts of the same lists are
+        refreshed by a query of the posts endpoint for their time window, if the pages of the query (at least as many
+        as the tracked posts in the window) take less time than a call per post
+
+        Returns:
+        list of (one_shot or window, list of TrackedPost)
+        """
+        post_cost = get_seconds_per_call(self.api.get_rate_limit(PostEndpoint), self.call_overhead)
+        page_cost = get_seconds_per_call(self.api.get_rate_limit(PostsEndpoint), self.call_overhead)
+        by_lists = defaultdict(list)
+        for tracked_post in due_posts:
+            by_lists[tracked_post.list_ids].append(tracked_post)
+        batches = list()
+        for list_ids, posts in by_lists.items():
+            if list_ids is not None:
+                start = min(tracked_post.published for tracked_post in posts)
+                end = max(tracked_post.published for tracked_post in posts)
+                window_count = sum(1 for tracked_post in self.tracked.values()
+                                   if tracked_post.list_ids == list_ids and start <= tracked_post.published <= end)
+                if math.ceil(window_count / DEFAULT_PAGE_SIZE) * page_cost < len(posts) * post_cost:
+                    batches.append((WINDOW, posts))
+                    continue
+            batches.append((ONE_SHOT, posts))
+        return batches
+
+    def _refresh_window(self, posts):
+        """
+        Returns:
+        dict mapping the ids of the posts returned to their interaction counts
+        """
+        by_id = {tracked_post.id: tracked_post for tracked_post in posts}
+        start = min(tracked_post.published for tracked_post in posts)
+        # endDate is exclusive
+        end = max(tracked_post.published for tracked_post in posts) + 1
+        refreshed = dict()
+        crawl = self.api.posts(listIds=list(posts[0].list_ids), sortBy='date', count=-1, timeframe=None,
+                               batchSize=DEFAULT_PAGE_SIZE,
+                               startDate=datetime.utcfromtimestamp(start).strftime(DATE_FORMAT),
+                               endDate=datetime.utcfromtimestamp(end).strftime(DATE_FORMAT))
+        for post in crawl:
+            post_id = post['id'] if self.endpoint == 'ct' else post['platformId']
+            if post_id in by_id:
+                refreshed[post_id] = get_actual_statistics(post)
+        self._stats['calls'][WINDOW] += max(1, math.ceil(crawl.returned_count / DEFAULT_PAGE_SIZE))
+        return refreshed
+
+    def _refresh_one(self, tracked_post):
+        """
+        Returns:
+        the interaction counts of the post, or None if it was not found
+        """
+        self._stats['calls'][ONE_SHOT] += 1
+        try:
+            for post in self.api.post(id=tracked_post.id, endpoint=self.endpoint):
+                return get_actual_statistics(post)
+        except NotFoundError:
+            pass
+        except ClientError as e:
+            if e.http_status != 404:
+                raise
+        return None
+
+    def refresh_pending(self):
+        """
+        Refreshes the posts that are due
+
+        Returns:
+        the number of posts whose statistics changed
+        """
+        now = time.time()
+        due_posts = list()
+        while len(self._queue) and self._queue[0].next_refresh <= now:
+            due_posts.append(heapq.heappop(self._queue))
+        if not len(due_posts):
+            return 0
+        changed = 0
+        # due posts not rescheduled nor untracked yet: queued again, still due, if interrupted
+        unscheduled = {tracked_post.id: tracked_post for tracked_post in due_posts}
+        try:
+            with open(self.store_path, 'a') as out_file:
+                for method, posts in self.plan(due_posts):
+                    refreshed = dict()
+                    if method == WINDOW:
+                        try:
+                            refreshed = self._refresh_window(posts)
+                        except Exception as e:
+                            logger.warning("refreshing a window of {} posts failed: {}".format(len(posts), e))
+                    for tracked_post in posts:
+                        statistics = refreshed.get(tracked_post.id)
+                        if statistics is None:
+                            # not returned by the window query, e.g. removed from the list: refreshed alone
+                            try:
+                                statistics = self._refresh_one(tracked_post)
+                            except Exception as e:
+                                logger.warning("refreshing post {} failed: {}. Retrying in {} seconds".format(
+                                    tracked_post.id, e, self.retry_delay))
+                                self._stats['errors'] += 1
+                                tracked_post.next_refresh = time.time() + self.retry_delay
+                                heapq.heappush(self._queue, unscheduled.pop(tracked_post.id))
+                                continue
+                        now = time.time()
+                        del unscheduled[tracked_post.id]
+                        if statistics is None:
+                            logger.warning("post {} not found: not tracked anymore".format(tracked_post.id))
+                            del self.tracked[tracked_post.id]
+                            self._stats['not_found'] += 1
+                            continue
+                        tracked_post.refreshes += 1
+                        self._stats['refreshes'] += 1
+                        delta = get_delta(tracked_post.statistics, statistics)
+                        if len(delta):
+                            self._write(out_file, tracked_post, delta, now)
+                            tracked_post.statistics = statistics
+                            changed += 1
+                            self._stats['changes'] += 1
+                        self._schedule(tracked_post, now)
+        finally:
+            for tracked_post in unscheduled.values():
+                heapq.heappush(self._queue, tracked_post)
+        return changed
+
+    def next_refresh(self):
+        """
+        Returns:
+        the time of the next refresh, or None if no post is tracked
+        """
+        if not len(self._queue):
+            return None
+        return self._queue[0].next_refresh
+
+    def run(self, duration=None):
+        """
+        Refreshes posts as they are due, until no post is tracked anymore or interrupted
+
+        Args:
+            duration: (float, default None) seconds after which to stop. If None, until no post is tracked
+        """
+        end_time = float('inf') if duration is None else time.time() + duration
+        while len(self._queue) and time.time() < end_time:
+            self.refresh_pending()
+            next_refresh = self.next_refresh()
+            if next_refresh is None:
+                break
+            sleep_time = max(0, min(next_refresh, end_time) - time.time())
+            logger.debug('sleeping for {} seconds'.format(sleep_time))
+            time.sleep(sleep_time)
+
+    def stats(self):
+        """
+        Returns:
+        dict with the number of posts tracked, of refreshes, of refreshes that changed statistics, of posts dropped
+        because not found or too old, of failed refreshes, and of calls by method (one_shot, window)
+        """
+        return dict(tracked=len(self.tracked), refreshes=self._stats['refreshes'], changes=self._stats['changes'],
+                    not_found=self._stats['not_found'], expired=self._stats['expired'], errors=self._stats['errors'],
+                    calls=dict(self._stats['calls']))
@@ -0,0 +1,100 @@
+# Copyright (C) 2020 Mattia Samory
+
+import random
+
+import requests
+
+from pytangle.errors import CrowdTangleError
+
+
+class RetryPolicy:
+    """Decides whether, and after how long, a failed call should be retried."""
+
+    def is_retryable(self, error):
+        """
+        Returns:
+        True if the call that raised the error may succeed when retried
+        """
+        if isinstance(error, CrowdTangleError):
+            return error.retryable
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def get_wait_time(self, error, attempt, elapsed):
+        """
+        Args:
+            error: (Exception) the error raised by the last attempt
+            attempt: (int) number of attempts failed so far
+            elapsed: (float) seconds since the first attempt
+
+        Returns:
+        seconds to wait before retrying, or None if the error should be raised
+        """
+        raise NotImplementedError
+
+
+class NoRetry(RetryPolicy):
+    """Raises every error"""
+
+    def get_wait_time(self, error, attempt, elapsed):
+        return None
+
+
+class ExponentialBackoff(RetryPolicy):
+    """Retries retryable errors after exponentially increasing, randomized waits, or after the wait requested by
+    crowdtangle (Retry-After), until max_retries attempts failed or the deadline passed. Other errors are raised
+    immediately."""
+
+    def __init__(self, max_retries=5, initial_delay=1, max_delay=60, multiplier=2, jitter=0.5, deadline=None,
+                 honor_retry_after=True):
+        """
+        Args:
+            max_retries: (int, default 5) maximum number of retries
+            initial_delay: (float, default 1) seconds to wait before the first retry
+            max_delay: (float, default 60) maximum number of seconds to wait between retries
+            multiplier: (float, default 2) factor by which waits increase after each retry
+            jitter: (0-1, default 0.5) fraction of each wait that is randomized, so that concurrent clients do not
+                    retry in lockstep
+            deadline: (float, default None) seconds after the first attempt past which the call is not retried
+            honor_retry_after: (bool, default True) wait as long as requested by crowdtangle, when it does
+        """
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+        self.honor_retry_after = honor_retry_after
+
+    def get_wait_time(self, error, attempt, elapsed):
+        if not self.is_retryable(error) or attempt > self.max_retries:
+            return None
+        retry_after = getattr(error, 'retry_after', None)
+        if self.honor_retry_after and retry_after is not None:
+            wait_time = retry_after
+        else:
+            wait_time = min(self.max_delay, self.initial_delay * self.multiplier ** (attempt - 1))
+            wait_time = wait_time * (1 - self.jitter) + random.uniform(0, wait_time * self.jitter)
+        if self.deadline is not None and elapsed + wait_time > self.deadline:
+            return None
+        return wait_time
+
+
+def create_retry_policy(retry_config):
+    """
+    Args:
+        retry_config: (dict) "type" (exponential, none) of the policy, and the arguments of its constructor,
+                e.g. {"type": "exponential", "max_retries": 3, "deadline": 300}
+
+    Returns:
+    a RetryPolicy
+    """
+    retry_config = dict(retry_config)
+    policy_type = retry_config.pop('type', 'exponential')
+    policies = dict(exponential=ExponentialBackoff, none=NoRetry)
+    if policy_type not in policies:
+        raise ValueError("retry policy type should be one of {}; received \"{}\" instead".format(
+            ", ".join(policies), policy_type))
+    return policies[policy_type](**retry_config)
+
+
+DEFAULT_RETRY_POLICY = ExponentialBackoff()
@@ -0,0 +1,239 @@
+# Copyright (C) 2020 Mattia Samory
+
+import json
+
+from pytangle.history import CompactHistory
+from pytangle.rawjson import RawItem
+from pytangle.records import Record, Interactions, Account, Post
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+PARQUET = 'parquet'
+ARROW = 'arrow'
+
+# column collecting the fields that are not in the schema, as json
+EXTRA_COLUMN = 'extra'
+
+DEFAULT_BATCH_SIZE = 10000
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise ImportError("columnar sinks require pyarrow. Install it via `pip3 install pytangle[arrow]`")
+
+
+def get_post_schema():
+    """
+    Returns:
+    pyarrow.Schema of flattened posts: account and statistics fields are columns (e.g. "account.handle",
+    "statistics.actual.likeCount"); lists (history, media, expandedLinks) are json strings
+    """
+    require_pyarrow()
+    integer_fields = {'subscriberCount'}
+    float_fields = {'score'}
+    boolean_fields = {'verified'}
+
+    def get_type(field):
+        if field in integer_fields:
+            return pyarrow.int64()
+        if field in float_fields:
+            return pyarrow.float64()
+        if field in boolean_fields:
+            return pyarrow.bool_()
+        return pyarrow.string()
+
+    fields = list()
+    for field in Post._fields:
+        if field == 'account':
+            fields.extend(pyarrow.field('account.' + account_field, pyarrow.int64() if account_field == 'id'
+                                        else get_type(account_field))
+                          for account_field in Account._fields)
+        elif field == 'statistics':
+            for statistics_field in ('actual', 'expected'):
+                fields.extend(pyarrow.field('statistics.{}.{}'.format(statistics_field, count), pyarrow.int64())
+                              for count in Interactions._fields)
+        else:
+            fields.append(pyarrow.field(field, get_type(field)))
+    fields.append(pyarrow.field('accountId', pyarrow.int64()))
+    fields.extend(pyarrow.field(field, pyarrow.string()) for field in ('media', 'expandedLinks', 'history'))
+    return pyarrow.schema(fields)
+
+
+def to_dict(item):
+    if isinstance(item, Record):
+        item = item.to_dict()
+    elif isinstance(item, RawItem):
+        return item.parse()
+    if isinstance(item.get('history'), CompactHistory):
+        item = dict(item, history=item['history'].to_list())
+    return item
+
+
+def flatten(item, prefix='', flat=None):
+    """
+    Returns:
+    dict mapping the dotted path of each field of the item that is not a dict to its value, e.g.
+    {"account": {"id": 1}} to {"account.id": 1}
+    """
+    if flat is None:
+        flat = dict()
+    for key, value in item.items():
+        if isinstance(value, dict) and len(value):
+            flatten(value, prefix + key + '.', flat)
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def infer_type(value):
+    if isinstance(value, bool):
+        return pyarrow.bool_()
+    if isinstance(value, int):
+        return pyarrow.int64()
+    if isinstance(value, float):
+        return pyarrow.float64()
+    return pyarrow.string()
+
+
+def infer_schema(rows):
+    """
+    Returns:
+    pyarrow.Schema with a column per field in the rows, typed after the first value that is not None
+    """
+    types = dict()
+    for row in rows:
+        for name, value in row.items():
+            if types.get(name) is None:
+                types[name] = None if value is None else infer_type(value)
+    return pyarrow.schema([pyarrow.field(name, a_type or pyarrow.string()) for name, a_type in types.items()])
+
+
+def coerce(value, a_type):
+    if value is None:
+        return None
+    if pyarrow.types.is_string(a_type):
+        if isinstance(value, str):
+            return value
+        return json.dumps(value)
+    try:
+        if pyarrow.types.is_boolean(a_type):
+            return bool(value)
+        if pyarrow.types.is_integer(a_type):
+            return int(value)
+        if pyarrow.types.is_floating(a_type):
+            return float(value)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+class ColumnarSink:
+    """Writes items returned by an API iterator to a Parquet or Arrow file, a batch of rows at a time, so that memory
+    stays bounded however long the crawl. Items are flattened into columns (see flatten); fields that are not in the
+    schema are kept, as json, in the "extra" column, so that optional fields appearing late in a crawl are not lost.
+
+    Example use:
+    from pytangle.api import API
+    from pytangle.sinks import ColumnarSink, get_post_schema
+
+    api = API()
+    with ColumnarSink('posts.parquet', schema=get_post_schema()) as sink:
+        sink.write_all(api.posts(count=1000))
+    """
+
+    def __init__(self, path, schema=None, file_format=PARQUET, batch_size=DEFAULT_BATCH_SIZE, compression='snappy'):
+        """
+        Args:
+            path: (str) file to write
+            schema: (pyarrow.Schema, default None) columns of the file, e.g. get_post_schema(). If None, inferred
+                    from the first batch
+            file_format: (parquet, arrow, default parquet) Parquet, with a row group per batch, or Arrow IPC, with a
+                    record batch per batch
+            batch_size: (int, default 10000) number of rows buffered before writing them
+            compression: (str, default snappy) compression of Parquet files
+        """
+        require_pyarrow()
+        if file_format not in (PARQUET, ARROW):
+            raise ValueError("unknown file format: {}".format(file_format))
+        self.path = path
+        self.schema = schema
+        self.file_format = file_format
+        self.batch_size = batch_size
+        self.compression = compression
+        self.rows = list()
+        self.written_count = 0
+        self._writer = None
+
+    def _open(self):
+        if self.schema is None:
+            self.schema = infer_schema(self.rows)
+        if EXTRA_COLUMN not in self.schema.names:
+            self.schema = self.schema.append(pyarrow.field(EXTRA_COLUMN, pyarrow.string()))
+        if self.file_format == PARQUET:
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, self.schema, compression=self.compression)
+        else:
+            self._writer = pyarrow.ipc.new_file(self.path, self.schema)
+
+    def write(self, item):
+        """Buffers an item (dict, records.Record, or rawjson.RawItem), writing the buffer when full"""
+        self.rows.append(flatten(to_dict(item)))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, items):
+        """
+        Returns:
+        the number of items written
+        """
+        count = 0
+        for item in items:
+            self.write(item)
+            count += 1
+        self.flush()
+        return count
+
+    def _to_batch(self):
+        columns = list()
+        names = set(self.schema.names)
+        for field in self.schema:
+            if field.name == EXTRA_COLUMN:
+                continue
+            columns.append(pyarrow.array([coerce(row.get(field.name), field.type) for row in self.rows],
+                                         type=field.type))
+        extra = list()
+        for row in self.rows:
+            extra_fields = {name: value for name, value in row.items() if name not in names}
+            extra.append(json.dumps(extra_fields) if len(extra_fields) else None)
+        columns.insert(self.schema.get_field_index(EXTRA_COLUMN), pyarrow.array(extra, type=pyarrow.string()))
+        return pyarrow.RecordBatch.from_arrays(columns, schema=self.schema)
+
+    def flush(self):
+        """Writes the buffered rows"""
+        if not len(self.rows):
+            return
+        if self._writer is None:
+            self._open()
+        batch = self._to_batch()
+        if self.file_format == PARQUET:
+            self._writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+        self.written_count += len(self.rows)
+        self.rows = list()
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
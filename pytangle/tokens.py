@@ -0,0 +1,230 @@
+# Copyright (C) 2020 Mattia Samory
+
+import time
+from threading import Lock
+
+from pytangle.connectivity import make_request, ONE_SECOND, ONE_MINUTE
+from pytangle.errors import TokenError, RateLimitError
+from pytangle.ratelimiting import DEFAULT_BACKEND, override_rate_limit
+from pytangle.retry import DEFAULT_RETRY_POLICY
+
+import logging
+
+logger = logging.getLogger()
+
+ROUND_ROBIN = 'round_robin'
+LEAST_RECENTLY_USED = 'least_recently_used'
+
+# how long a token rejected by crowdtangle (missing or invalid) is removed from the pool
+INVALID_TOKEN_COOLDOWN = 10 * ONE_MINUTE
+
+
+def describe_token(token):
+    """Returns a representation of the token that is safe to log"""
+    return "...{}".format(token[-4:])
+
+
+class TokenPool:
+    """Schedules calls to crowdtangle across several tokens, each with its own rate budget. Calls go to the next token
+    (round robin) or to the token used least recently, skipping tokens whose budget is spent. Tokens rejected by
+    crowdtangle are temporarily removed from the pool; tokens that hit the rate limit have their budget adapted."""
+
+    def __init__(self, tokens, strategy=ROUND_ROBIN, backend=None, retry_policy=None):
+        """
+        Args:
+            tokens: (list of str) crowdtangle tokens
+            strategy: (round_robin, least_recently_used, default round_robin) order in which tokens are tried
+            backend: (RateLimitBackend, default None) where the rate budget of each token is kept. None keeps it in
+                    memory, shared by all the pools of the process
+            retry_policy: (RetryPolicy, default None) decides which failed calls are retried, and when; if None, uses
+                    retry.DEFAULT_RETRY_POLICY
+        """
+        tokens = list(dict.fromkeys(tokens))
+        if not len(tokens):
+            raise ValueError("a token pool needs at least one token")
+        if strategy not in (ROUND_ROBIN, LEAST_RECENTLY_USED):
+            raise ValueError("strategy should be one of \"{}\" or \"{}\"; received \"{}\" instead".format(
+                ROUND_ROBIN, LEAST_RECENTLY_USED, strategy))
+        self.tokens = tokens
+        self.strategy = strategy
+        self.backend = backend if backend is not None else DEFAULT_BACKEND
+        self.retry_policy = retry_policy if retry_policy is not None else DEFAULT_RETRY_POLICY
+        self._lock = Lock()
+        self._next_token = 0
+        self._last_used = {token: 0. for token in tokens}
+        self._benched_until = {token: 0. for token in tokens}
+        self._rejections = dict()
+        self._rate_limit_overrides = dict()
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def set_rate_limit(self, endpoint_class, calls=None, period=None, burst=None):
+        """
+        Overrides the rate limit of the endpoint class and of its subclasses for the calls made through this pool only
+        (see Endpoint.set_rate_limit). Values that are not passed are left as set for the class.
+        """
+        overrides = self._rate_limit_overrides.setdefault(endpoint_class, dict())
+        overrides.update({name: value for name, value in dict(calls=calls, period=period, burst=burst).items()
+                          if value is not None})
+
+    def get_rate_limit(self, endpoint_class):
+        """
+        Returns:
+        RateLimit of the calls to the endpoint class made through this pool, or None if they are not rate limited
+        """
+        rate_limit = endpoint_class.rate_limit()
+        for cls in reversed(endpoint_class.__mro__):
+            if cls in self._rate_limit_overrides:
+                rate_limit = override_rate_limit(rate_limit, **self._rate_limit_overrides[cls])
+        return rate_limit
+
+    def available_tokens(self):
+        """
+        Returns:
+        list of the tokens currently in the pool, in the order in which they should be tried
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.strategy == ROUND_ROBIN:
+                start = self._next_token % len(self.tokens)
+                self._next_token += 1
+                ordered = self.tokens[start:] + self.tokens[:start]
+            else:
+                ordered = sorted(self.tokens, key=self._last_used.get)
+            return [token for token in ordered if self._benched_until[token] <= now]
+
+    def mark_used(self, token):
+        with self._lock:
+            self._last_used[token] = time.monotonic()
+
+    def bench(self, token, seconds):
+        """Removes the token from the pool for the given number of seconds"""
+        logger.warning("token {} removed from the pool for {} seconds".format(describe_token(token), seconds))
+        with self._lock:
+            self._benched_until[token] = max(self._benched_until[token], time.monotonic() + seconds)
+
+    def reject(self, token, error):
+        """Removes a token rejected by crowdtangle (missing or invalid) from the pool for INVALID_TOKEN_COOLDOWN"""
+        self.bench(token, INVALID_TOKEN_COOLDOWN)
+        with self._lock:
+            self._rejections[token] = error
+
+    def get_rejection(self):
+        """
+        Returns:
+        the last error raised for a rejected token if every token in the pool is currently rejected, otherwise None
+        """
+        now = time.monotonic()
+        with self._lock:
+            for token in self.tokens:
+                if token not in self._rejections or self._benched_until[token] <= now:
+                    return None
+            return self._rejections[self.tokens[-1]]
+
+    def time_until_available(self):
+        """
+        Returns:
+        seconds until the first removed token returns to the pool, or None if no token is removed
+        """
+        now = time.monotonic()
+        with self._lock:
+            benched = [until - now for until in self._benched_until.values() if until > now]
+        if not len(benched):
+            return None
+        return min(benched)
+
+    def quota(self, rate_limits):
+        """
+        Args:
+            rate_limits: (dict) names of the rate limits to report, mapped to their RateLimit
+
+        Returns:
+        dict mapping each token (as safe to log) to the status of its buckets (see TokenBucket.status), and to the
+        seconds until the token returns to the pool if it was removed ("benched")
+        """
+        now = time.monotonic()
+        quota = dict()
+        for token in self.tokens:
+            token_quota = {name: self.backend.status(token, rate_limit)
+                           for name, rate_limit in rate_limits.items()}
+            with self._lock:
+                token_quota['benched'] = max(0., self._benched_until[token] - now)
+            quota[describe_token(token)] = token_quota
+        return quota
+
+    def request(self, rate_limit, uri, params, session=None, decoder=None):
+        """
+        Calls crowdtangle with the first token in the pool that has budget left, waiting if there is none.
+
+        Args:
+            rate_limit: (RateLimit or None) budget of the endpoint, for each token
+            uri: (str) endpoint url
+            params: (dict) query parameters; the token is overwritten with the one from the pool
+            session: (Session, default None) connections to use for the call
+            decoder: (callable, default None) function parsing the body of the response; if None, decoding.decode
+
+        Returns:
+        the decoded response
+
+        Raises:
+        CrowdTangleError if the call fails and is not retried, or if every token in the pool was rejected
+        """
+        start_time = time.monotonic()
+        rate_limit_errors = 0
+        while True:
+            rejection = self.get_rejection()
+            if rejection is not None:
+                raise rejection
+            wait_times = list()
+            for token in self.available_tokens():
+                if rate_limit is not None:
+                    wait_time = self.backend.try_acquire(token, rate_limit)
+                    if wait_time > 0:
+                        wait_times.append(wait_time)
+                        continue
+                self.mark_used(token)
+                try:
+                    response = make_request(uri, dict(params, token=token), session=session,
+                                            retry_policy=self.retry_policy, fail_on_token_error=True,
+                                            decoder=decoder)
+                except RateLimitError as e:
+                    rate_limit_errors += 1
+                    wait_time = self.retry_policy.get_wait_time(e, rate_limit_errors, time.monotonic() - start_time)
+                    if wait_time is None:
+                        raise
+                    if rate_limit is not None:
+                        self.backend.record_rate_limited(token, rate_limit, e.retry_after)
+                    else:
+                        self.bench(token, wait_time)
+                    continue
+                except TokenError as e:
+                    # missing or invalid token: other tokens in the pool may still be valid
+                    self.reject(token, e)
+                    continue
+                if rate_limit is not None:
+                    self.backend.record_success(token, rate_limit)
+                return response
+            if self.get_rejection() is not None:
+                continue
+            # every token is either out of budget or out of the pool
+            benched_wait_time = self.time_until_available()
+            if benched_wait_time is not None:
+                wait_times.append(benched_wait_time)
+            time.sleep(max(min(wait_times, default=ONE_SECOND), ONE_SECOND / 10))
+
+
+# pools of a single token, for endpoints that are not bound to the pool of an API instance
+_SINGLE_TOKEN_POOLS = dict()
+_SINGLE_TOKEN_POOLS_LOCK = Lock()
+
+
+def get_token_pool(token):
+    """
+    Returns:
+    a TokenPool containing only the token, shared by all the calls made with it
+    """
+    with _SINGLE_TOKEN_POOLS_LOCK:
+        if token not in _SINGLE_TOKEN_POOLS:
+            _SINGLE_TOKEN_POOLS[token] = TokenPool([token])
+        return _SINGLE_TOKEN_POOLS[token]
@@ -1,4 +1,47 @@
 # Copyright (C) 2020 Mattia Samory
 
 def remove_null_values_from_dict(params):
-    return dict(filter(lambda x: x[1] is not None, params.items()))
\ No newline at end of file
+    return dict(filter(lambda x: x[1] is not None, params.items()))
+
+
+def compile_projection(fields):
+    """
+    Args:
+        fields: (list of str) fields to keep, as dotted paths, e.g. ["id", "account.handle", "statistics.actual"]
+
+    Returns:
+    tree of the fields to keep: dict mapping each field to the tree of its subfields, or to None to keep it whole
+    """
+    projection = dict()
+    for field in fields:
+        subtree = projection
+        path = field.split('.')
+        for key in path[:-1]:
+            if key in subtree and subtree[key] is None:
+                # the whole field is kept already
+                break
+            subtree = subtree.setdefault(key, dict())
+        else:
+            subtree[path[-1]] = None
+    return projection
+
+
+def project(item, projection):
+    """
+    Returns:
+    a copy of item (dict) restricted to the fields in the projection (see compile_projection). Fields missing from the
+    item are skipped; projections of lists apply to each of their elements.
+    """
+    if isinstance(item, list):
+        return [project(element, projection) for element in item]
+    if not isinstance(item, dict):
+        return item
+    projected = dict()
+    for key, subprojection in projection.items():
+        if key not in item:
+            continue
+        if subprojection is None:
+            projected[key] = item[key]
+        else:
+            projected[key] = project(item[key], subprojection)
+    return projected
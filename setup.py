@@ -17,14 +17,18 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     install_requires=[
         "requests>=2.9.1",
-        "ratelimit>=2.2.1",
         "python_dateutil>=2.8.1",
     ],
-    extras_require={'examples': ["schedule>=0.6.0"]},
+    extras_require={'examples': ["schedule>=0.6.0"],
+                    'async': ["aiohttp>=3.6.0"],
+                    'fast': ["orjson>=3.0.0"],
+                    'arrow': ["pyarrow>=1.0.0"],
+                    'frames': ["numpy>=1.16.0", "pandas>=1.0.0"],
+                    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.5',
+    python_requires='>=3.6',
 )